@@ -14,11 +14,27 @@ import argparse
 import csv
 import gzip
 import json
+import multiprocessing
 import re
 import sys
+from contextlib import nullcontext
+from functools import partial
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional
-from collections import defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+# Utilidades compartidas entre conversores (carpeta comun/ en la raíz del proyecto)
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from comun.fechas import duracion_minutos, formatear_fecha, formatear_hora
+from comun.lotes import comprobar_sufijos, convertir_en_lote, ejecutar_tareas, expandir_entradas
+from comun.registros import Diccionarios, compactar
+from comun.eventos import eventos_por_stdout, evento, seguir_lectura
+from comun.memoria import diccionario, limitar_memoria, multidiccionario
+from comun.perfil import etapa, fijar_entrada, perfilar, repartir_bucle
+from comun.opciones import anadir_opciones_comunes, comprobar_opciones_comunes
+from comun.salida_csv import SalidaZip, escribir_csv, leer_cabeceras
+from comun.xml_elementos import iterar_elementos_iterparse, iterar_elementos_xml
 
 
 # ---------------------------------------------------------------------------
@@ -26,24 +42,6 @@ from collections import defaultdict
 # ---------------------------------------------------------------------------
 
 
-def _read_csv_headers(plantilla_path: Path) -> List[str]:
-    """Lee las cabeceras de una plantilla CSV."""
-    with plantilla_path.open("r", encoding="utf-8-sig", errors="replace") as f:
-        reader = csv.reader(f)
-        headers = next(reader)
-        return [h.strip() for h in headers if h.strip()]
-
-
-def _write_csv(path: Path, fieldnames: List[str], rows: Iterable[Dict[str, str]]) -> None:
-    """Escribe un CSV en UTF‑8 con BOM para que Excel lo abra bien."""
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8-sig", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow({k: row.get(k, "") for k in fieldnames})
-
-
 def _first_no_empty(*values: Optional[str]) -> str:
     """Devuelve el primer valor no vacío."""
     for v in values:
@@ -52,6 +50,70 @@ def _first_no_empty(*values: Optional[str]) -> str:
     return ""
 
 
+# Órdenes de claves distintos que se recuerdan por cada tabla de alias (por encima,
+# el acceso se busca por los alias presentes, que no dependen del orden)
+MAX_ESQUEMAS_ALIAS = 1024
+
+
+def _texto(v) -> str:
+    """Como _first_no_empty con un solo valor."""
+    if v is None:
+        return ""
+    v = str(v)
+    return v if v.strip() != "" else ""
+
+
+def compilar_alias(campos: Dict[str, Sequence[str]]) -> Callable[[Dict], Dict[str, str]]:
+    """
+    Devuelve una función que saca de un registro los 'campos' indicados
+    ({campo: (alias1, alias2, ...)}), cada uno con el mismo resultado que
+    _first_no_empty(registro.get(alias1), registro.get(alias2), ...).
+    
+    Qué alias existen en el registro se decide una vez por conjunto de alias
+    presentes (una exportación usa siempre los mismos nombres) y para ese
+    conjunto se prepara una función que lee directamente solo esas claves.
+    Para no calcular los alias presentes en cada registro, la función también
+    se recuerda por el orden de claves del registro (hasta MAX_ESQUEMAS_ALIAS
+    órdenes distintos).
+    """
+    nombres = list(campos)
+    aliases = [tuple(dict.fromkeys(campos[n])) for n in nombres]
+    todos = tuple(dict.fromkeys(k for alias in aliases for k in alias))
+    por_orden: Dict[Tuple, Callable[[Dict], Dict[str, str]]] = {}
+    por_presentes: Dict[Tuple, Callable[[Dict], Dict[str, str]]] = {}
+    
+    def preparar(presentes: Tuple[str, ...]) -> Callable[[Dict], Dict[str, str]]:
+        plan = [(nombre, tuple(k for k in alias if k in presentes)) for nombre, alias in zip(nombres, aliases)]
+        unicos = [(nombre, claves[0]) for nombre, claves in plan if len(claves) == 1]
+        varios = [(nombre, claves) for nombre, claves in plan if len(claves) > 1]
+        vacios = dict.fromkeys((nombre for nombre, claves in plan if not claves), "")
+        
+        def acceso(r: Dict) -> Dict[str, str]:
+            salida = dict(vacios)
+            for nombre, clave in unicos:
+                v = r[clave]
+                salida[nombre] = v if v.__class__ is str and v.strip() else _texto(v)
+            for nombre, claves in varios:
+                salida[nombre] = _first_no_empty(*[r[k] for k in claves])
+            return salida
+        
+        return acceso
+    
+    def extraer(registro: Dict) -> Dict[str, str]:
+        orden = tuple(registro)
+        acceso = por_orden.get(orden)
+        if acceso is None:
+            presentes = tuple(k for k in todos if k in registro)
+            acceso = por_presentes.get(presentes)
+            if acceso is None:
+                acceso = por_presentes[presentes] = preparar(presentes)
+            if len(por_orden) < MAX_ESQUEMAS_ALIAS:
+                por_orden[orden] = acceso
+        return acceso(registro)
+    
+    return extraer
+
+
 def _sanitize_filename(name: str) -> str:
     """Limpia un nombre para que sea válido como parte de un nombre de archivo."""
     # Quitar extensión si existe
@@ -65,34 +127,19 @@ def _sanitize_filename(name: str) -> str:
     return name
 
 
-def formatear_fecha(fecha_str: str) -> str:
-    """Convierte fecha a formato DD/MM/YYYY."""
-    if not fecha_str:
-        return ""
-    
-    # Intentar varios formatos comunes
-    # ISO: 2019-03-15 o 2019-03-15T14:30:00
-    match = re.match(r'(\d{4})-(\d{2})-(\d{2})', fecha_str)
-    if match:
-        return f"{match.group(3)}/{match.group(2)}/{match.group(1)}"
-    
-    # DD/MM/YYYY ya está bien
-    if re.match(r'\d{2}/\d{2}/\d{4}', fecha_str):
-        return fecha_str
-    
-    return fecha_str
+_RE_ETIQUETA_HTML = re.compile(r'<[^>]+>')
+_RE_ESPACIOS = re.compile(r'\s+')
 
 
-def formatear_hora(fecha_str: str) -> str:
-    """Extrae la hora de un datetime ISO."""
-    if not fecha_str:
+def limpiar_html(texto) -> str:
+    """Quita las etiquetas HTML de un texto y junta los espacios repetidos."""
+    if not texto:
         return ""
-    
-    match = re.match(r'\d{4}-\d{2}-\d{2}T(\d{2}):(\d{2}):(\d{2})', fecha_str)
-    if match:
-        return f"{match.group(1)}:{match.group(2)}:00"
-    
-    return ""
+    # Remover tags HTML básicos
+    texto = _RE_ETIQUETA_HTML.sub('', str(texto))
+    # Limpiar espacios múltiples
+    texto = _RE_ESPACIOS.sub(' ', texto)
+    return texto.strip()
 
 
 # ---------------------------------------------------------------------------
@@ -100,6 +147,13 @@ def formatear_hora(fecha_str: str) -> str:
 # ---------------------------------------------------------------------------
 
 
+# Colecciones en las que se estructura un export de CLINNI
+COLECCIONES_CLINNI = ('pacientes', 'bonos', 'citas', 'historial')
+
+# Valores compartidos de las columnas con pocos valores distintos, por colección
+DICCIONARIOS = Diccionarios()
+
+
 def detectar_formato_archivo(file_path: Path) -> str:
     """Detecta el formato del archivo (gz, json, csv, txt, xml)."""
     # Leer los primeros bytes para detectar el formato
@@ -136,111 +190,147 @@ def detectar_formato_archivo(file_path: Path) -> str:
     return 'txt'
 
 
-def leer_archivo_clinni(file_path: Path) -> Dict:
+def leer_archivo_clinni(
+    file_path: Path,
+    xml_parser: str = "regex",
+    colecciones: Optional[Iterable[str]] = None,
+    json_workers: int = 1,
+) -> Dict:
     """
     Lee un archivo de CLINNI y devuelve un diccionario estructurado.
     Maneja diferentes formatos: gz, json, csv, txt, xml.
     Retorna un dict con claves: 'pacientes', 'bonos', 'citas', 'historial'
+    (solo se rellenan las de 'colecciones', si se indica).
+    
+    Con json_workers > 1, un JSON {"pacientes": [...]} se parsea y aplana en
+    varios procesos (ver procesar_json_en_paralelo).
     """
-    formato = detectar_formato_archivo(file_path)
+    with etapa("deteccion de formato"):
+        formato = detectar_formato_archivo(file_path)
     print(f"[INFO] Formato detectado: {formato}")
     
     datos_raw = None
+    texto_json = None
     
     try:
-        if formato == 'gz':
-            # Intentar descomprimir y leer como JSON, CSV o texto
-            with gzip.open(file_path, 'rt', encoding='utf-8', errors='replace') as f:
-                contenido = f.read(1000)  # Leer primeros 1000 caracteres para detectar
-                f.seek(0)
-                
-                if contenido.strip().startswith('{') or contenido.strip().startswith('['):
-                    # Es JSON
-                    datos_raw = json.load(f)
-                else:
-                    # Intentar como CSV
+        with etapa(f"lectura {formato}"):
+            if formato == 'gz':
+                # Intentar descomprimir y leer como JSON, CSV o texto
+                with gzip.open(file_path, 'rt', encoding='utf-8', errors='replace') as f:
+                    contenido = f.read(1000)  # Leer primeros 1000 caracteres para detectar
                     f.seek(0)
-                    reader = csv.DictReader(f)
-                    datos_raw = list(reader)
-        
-        elif formato == 'json':
-            with file_path.open('r', encoding='utf-8', errors='replace') as f:
-                datos_raw = json.load(f)
-        
-        elif formato == 'csv':
-            with file_path.open('r', encoding='utf-8', errors='replace') as f:
-                reader = csv.DictReader(f)
-                datos_raw = list(reader)
+                
+                    if contenido.strip().startswith('{') or contenido.strip().startswith('['):
+                        # Es JSON
+                        if json_workers > 1:
+                            texto_json = f.read()
+                        else:
+                            datos_raw = json.load(f)
+                    else:
+                        # Intentar como CSV
+                        f.seek(0)
+                        reader = csv.DictReader(f)
+                        datos_raw = list(reader)
         
-        elif formato == 'xml':
-            # Leer XML de forma básica (similar a DRICloud)
-            datos_raw = leer_xml_basico(file_path)
+            elif formato == 'json':
+                with file_path.open('r', encoding='utf-8', errors='replace') as f:
+                    if json_workers > 1:
+                        texto_json = f.read()
+                    else:
+                        datos_raw = json.load(f)
         
-        else:  # txt o desconocido
-            # Intentar leer como CSV primero
-            try:
+            elif formato == 'csv':
                 with file_path.open('r', encoding='utf-8', errors='replace') as f:
                     reader = csv.DictReader(f)
                     datos_raw = list(reader)
-            except:
-                # Si falla, leer línea por línea y parsear manualmente
-                datos_raw = leer_texto_estructurado(file_path)
+        
+            elif formato == 'xml':
+                # Leer XML de forma básica (similar a DRICloud)
+                datos_raw = leer_xml_basico(file_path, xml_parser)
+        
+            else:  # txt o desconocido
+                # Intentar leer como CSV primero
+                try:
+                    with file_path.open('r', encoding='utf-8', errors='replace') as f:
+                        reader = csv.DictReader(f)
+                        datos_raw = list(reader)
+                except:
+                    # Si falla, leer línea por línea y parsear manualmente
+                    datos_raw = leer_texto_estructurado(file_path)
+        tamano = file_path.stat().st_size
+        evento("lectura", archivo=file_path.name, bytes=tamano, bytes_total=tamano, terminado=True)
+        
+        if texto_json is not None:
+            with etapa("aplanado en paralelo") as e:
+                estructurado = procesar_json_en_paralelo(texto_json, json_workers, colecciones)
+                if estructurado is not None:
+                    e["filas"] = {clave: len(valores) for clave, valores in estructurado.items()}
+            if estructurado is not None:
+                evento(
+                    "carga", archivo=file_path.name,
+                    registros={clave: len(valores) for clave, valores in estructurado.items()},
+                )
+                return estructurado
+            datos_raw = json.loads(texto_json)
     
     except Exception as e:
         print(f"[ERROR] Error leyendo archivo: {e}", file=sys.stderr)
         return {'pacientes': [], 'bonos': [], 'citas': [], 'historial': []}
     
     # Procesar datos según su estructura
-    return procesar_datos_clinni(datos_raw)
+    with etapa("aplanado") as e:
+        estructurado = procesar_datos_clinni(datos_raw, colecciones)
+        e["filas"] = {clave: len(valores) for clave, valores in estructurado.items()}
+    evento("carga", archivo=file_path.name, registros={clave: len(valores) for clave, valores in estructurado.items()})
+    return estructurado
+
+
+def _extraer_tablas_xml(file_path: Path, tags: List[str], parser: str) -> Dict[str, List[Dict[str, str]]]:
+    """Extrae en una sola pasada los elementos de todos los tags indicados."""
+    elementos: Dict[str, List[Dict[str, str]]] = {tag: [] for tag in tags}
+    
+    if parser == "iterparse":
+        try:
+            filas = seguir_lectura(
+                iterar_elementos_iterparse(file_path, tags), file_path.name, file_path.stat().st_size,
+                tabla=itemgetter(0),
+            )
+            for tag, campos in repartir_bucle(filas, "carga", itemgetter(0)):
+                elementos[tag].append(compactar(DICCIONARIOS.codificar(tag, campos)))
+        except Exception as e:
+            print(f"[ERROR] Error leyendo XML: {e}", file=sys.stderr)
+        return elementos
+    
+    try:
+        filas = seguir_lectura(
+            iterar_elementos_xml(file_path, tags), file_path.name, file_path.stat().st_size,
+            posicion=itemgetter(2), tabla=itemgetter(0),
+        )
+        for tag, _inicio, _fin, campos in repartir_bucle(filas, "carga", itemgetter(0)):
+            elementos[tag].append(compactar(DICCIONARIOS.codificar(tag, campos)))
+    except Exception as e:
+        print(f"[ERROR] Error leyendo XML: {e}", file=sys.stderr)
+    
+    return elementos
 
 
-def leer_xml_basico(file_path: Path) -> List[Dict[str, str]]:
-    """Lee XML de forma básica usando regex (para archivos grandes)."""
-    elementos = []
+def leer_xml_basico(file_path: Path, parser: str = "regex") -> List[Dict[str, str]]:
+    """
+    Lee XML de forma básica (para archivos grandes).
     
+    Con parser='regex' usa expresiones regulares; con parser='iterparse' usa un
+    parser XML incremental. Devuelve los elementos del primer tag común que
+    aparezca en el archivo.
+    """
     # Buscar elementos comunes en XML de sistemas médicos
     tags_comunes = ['PACIENTE', 'CLIENTE', 'CITA', 'BONO', 'HISTORIAL', 'CONSULTA']
     
+    elementos = _extraer_tablas_xml(file_path, tags_comunes, parser)
     for tag in tags_comunes:
-        pattern = re.compile(
-            rf'<{re.escape(tag)}>(.*?)</{re.escape(tag)}>',
-            re.DOTALL | re.IGNORECASE
-        )
-        
-        chunk_size = 10 * 1024 * 1024  # 10MB chunks
-        buffer = ""
-        
-        try:
-            with file_path.open('r', encoding='utf-8', errors='replace') as f:
-                while True:
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    
-                    buffer += chunk
-                    matches = list(pattern.finditer(buffer))
-                    
-                    for match in matches:
-                        contenido = match.group(1)
-                        campos_pattern = re.compile(r'<([A-Z_][A-Z0-9_]*)>(.*?)</\1>', re.DOTALL)
-                        campos = {}
-                        for campo_match in campos_pattern.finditer(contenido):
-                            campo_nombre = campo_match.group(1)
-                            campo_valor = campo_match.group(2).strip()
-                            campos[campo_nombre] = campo_valor
-                        
-                        if campos:
-                            elementos.append(campos)
-                    
-                    if len(buffer) > 1024 * 1024:
-                        buffer = buffer[-1024 * 1024:]
-        except:
-            pass
-        
-        if elementos:
-            break
+        if elementos[tag]:
+            return elementos[tag]
     
-    return elementos
+    return []
 
 
 def leer_texto_estructurado(file_path: Path) -> List[Dict[str, str]]:
@@ -279,11 +369,103 @@ def leer_texto_estructurado(file_path: Path) -> List[Dict[str, str]]:
     return datos
 
 
-def procesar_datos_clinni(datos_raw) -> Dict:
+def _clave_pacientes(claves: Iterable[str]) -> Optional[str]:
+    """Primera clave de nivel superior que parece la lista de pacientes."""
+    for key in claves:
+        if 'paciente' in key.lower() or 'patient' in key.lower() or 'cliente' in key.lower():
+            return key
+    return None
+
+
+def _clave_bonos(claves: Iterable[str]) -> Optional[str]:
+    """Primera clave de nivel superior que parece la lista de bonos."""
+    for key in claves:
+        if 'bono' in key.lower() or 'pack' in key.lower() or 'abono' in key.lower():
+            return key
+    return None
+
+
+def _aplanar_pacientes(pacientes: List[Dict], colecciones: Iterable[str]) -> Dict[str, List]:
+    """
+    Recorre pacientes -> procesos -> citas/evoluciones y devuelve las listas
+    'pacientes', 'citas' e 'historial' (solo las de 'colecciones').
+    
+    Cada cita o entrada de historial se guarda como Registro compacto con sus
+    campos más las referencias PAC_ID/PACIENTE(/PROCESO), en lugar de copiar
+    el dict original para añadírselas. Los valores repetidos de las columnas
+    con pocos valores distintos se comparten (ver DICCIONARIOS).
+    """
+    aplanado = {'pacientes': [], 'citas': [], 'historial': []}
+    
+    for paciente in pacientes:
+        # Agregar paciente
+        if 'pacientes' in colecciones:
+            aplanado['pacientes'].append(DICCIONARIOS.codificar('pacientes', paciente))
+        
+        # Extraer citas de procesos
+        procesos = paciente.get('procesos', [])
+        if isinstance(procesos, list):
+            for proceso in procesos:
+                # Las citas están en proceso.citas
+                citas_proceso = proceso.get('citas', []) if 'citas' in colecciones else None
+                if isinstance(citas_proceso, list):
+                    for cita in citas_proceso:
+                        # Agregar referencia al paciente en la cita
+                        aplanado['citas'].append(compactar(DICCIONARIOS.codificar('citas', cita), {
+                            'PAC_ID': paciente.get('dni') or paciente.get('id'),
+                            'PACIENTE': paciente,
+                        }))
+                
+                if 'historial' not in colecciones:
+                    continue
+                
+                # Las evoluciones están en proceso.evoluciones
+                evoluciones = proceso.get('evoluciones', [])
+                if isinstance(evoluciones, list):
+                    for evolucion in evoluciones:
+                        # Agregar referencia al paciente y proceso
+                        if not isinstance(evolucion, dict):
+                            evolucion = {'contenido': str(evolucion)}
+                        aplanado['historial'].append(compactar(DICCIONARIOS.codificar('historial', evolucion), {
+                            'PAC_ID': paciente.get('dni') or paciente.get('id'),
+                            'PACIENTE': paciente,
+                            'PROCESO': proceso,
+                        }))
+                
+                # El proceso mismo puede ser historial (solo si tiene datos relevantes)
+                if proceso.get('diagnostico') or proceso.get('titulo') or proceso.get('evoluciones'):
+                    aplanado['historial'].append(compactar(DICCIONARIOS.codificar('historial', proceso), {
+                        'PAC_ID': paciente.get('dni') or paciente.get('id'),
+                        'PACIENTE': paciente,
+                    }))
+    
+    return aplanado
+
+
+def _codificar_bonos(bonos: List) -> List:
+    """Comparte los valores repetidos de los bonos (ver DICCIONARIOS)."""
+    for bono in bonos:
+        if isinstance(bono, dict):
+            DICCIONARIOS.codificar('bonos', bono)
+    return bonos
+
+
+def _imprimir_resumen(estructurado: Dict) -> None:
+    print(f"[INFO] Datos procesados: {len(estructurado['pacientes'])} pacientes, "
+          f"{len(estructurado['bonos'])} bonos, {len(estructurado['citas'])} citas, "
+          f"{len(estructurado['historial'])} historiales")
+
+
+def procesar_datos_clinni(datos_raw, colecciones: Optional[Iterable[str]] = None) -> Dict:
     """
     Procesa los datos raw de CLINNI y los estructura según el formato.
     Maneja JSON anidado con estructura {"pacientes": [...], ...}
+    
+    Si se indica 'colecciones', solo se construyen esas listas (las citas y el
+    historial se aplanan copiando cada registro, así que saltarlos ahorra tiempo
+    y memoria cuando no se van a generar).
     """
+    colecciones = set(colecciones) if colecciones is not None else set(COLECCIONES_CLINNI)
     estructurado = {
         'pacientes': [],
         'bonos': [],
@@ -294,72 +476,258 @@ def procesar_datos_clinni(datos_raw) -> Dict:
     # Si es un diccionario (JSON estructurado)
     if isinstance(datos_raw, dict):
         # Buscar clave "pacientes" o variaciones
-        pacientes_key = None
-        for key in datos_raw.keys():
-            if 'paciente' in key.lower() or 'patient' in key.lower() or 'cliente' in key.lower():
-                pacientes_key = key
-                break
+        pacientes_key = _clave_pacientes(datos_raw.keys())
         
         if pacientes_key and isinstance(datos_raw[pacientes_key], list):
-            pacientes = datos_raw[pacientes_key]
-            
-            for paciente in pacientes:
-                # Agregar paciente
-                estructurado['pacientes'].append(paciente)
-                
-                # Extraer citas de procesos
-                procesos = paciente.get('procesos', [])
-                if isinstance(procesos, list):
-                    for proceso in procesos:
-                        # Las citas están en proceso.citas
-                        citas_proceso = proceso.get('citas', [])
-                        if isinstance(citas_proceso, list):
-                            for cita in citas_proceso:
-                                # Agregar referencia al paciente en la cita
-                                cita_con_paciente = cita.copy()
-                                cita_con_paciente['PAC_ID'] = paciente.get('dni') or paciente.get('id')
-                                cita_con_paciente['PACIENTE'] = paciente
-                                estructurado['citas'].append(cita_con_paciente)
-                        
-                        # Las evoluciones están en proceso.evoluciones
-                        evoluciones = proceso.get('evoluciones', [])
-                        if isinstance(evoluciones, list):
-                            for evolucion in evoluciones:
-                                # Agregar referencia al paciente y proceso
-                                evolucion_con_ref = evolucion.copy() if isinstance(evolucion, dict) else {'contenido': str(evolucion)}
-                                evolucion_con_ref['PAC_ID'] = paciente.get('dni') or paciente.get('id')
-                                evolucion_con_ref['PACIENTE'] = paciente
-                                evolucion_con_ref['PROCESO'] = proceso
-                                estructurado['historial'].append(evolucion_con_ref)
-                        
-                        # El proceso mismo puede ser historial (solo si tiene datos relevantes)
-                        if proceso.get('diagnostico') or proceso.get('titulo') or proceso.get('evoluciones'):
-                            proceso_con_ref = proceso.copy()
-                            proceso_con_ref['PAC_ID'] = paciente.get('dni') or paciente.get('id')
-                            proceso_con_ref['PACIENTE'] = paciente
-                            estructurado['historial'].append(proceso_con_ref)
+            estructurado.update(_aplanar_pacientes(datos_raw[pacientes_key], colecciones))
         
         # Buscar bonos si existen
-        bonos_key = None
-        for key in datos_raw.keys():
-            if 'bono' in key.lower() or 'pack' in key.lower() or 'abono' in key.lower():
-                bonos_key = key
-                break
+        bonos_key = _clave_bonos(datos_raw.keys())
         
-        if bonos_key and isinstance(datos_raw[bonos_key], list):
-            estructurado['bonos'] = datos_raw[bonos_key]
+        if bonos_key and isinstance(datos_raw[bonos_key], list) and 'bonos' in colecciones:
+            estructurado['bonos'] = _codificar_bonos(datos_raw[bonos_key])
     
     # Si es una lista, procesar como antes
     elif isinstance(datos_raw, list):
         estructurado = extraer_datos_estructurados(datos_raw)
+        for coleccion in estructurado:
+            if coleccion not in colecciones:
+                estructurado[coleccion] = []
     
-    print(f"[INFO] Datos procesados: {len(estructurado['pacientes'])} pacientes, "
-          f"{len(estructurado['bonos'])} bonos, {len(estructurado['citas'])} citas, "
-          f"{len(estructurado['historial'])} historiales")
+    _imprimir_resumen(estructurado)
     
     return estructurado
 
 
+# ---------------------------------------------------------------------------
+# Lectura en paralelo de un JSON grande (--json-workers)
+# ---------------------------------------------------------------------------
+
+
+ESPACIOS_JSON = re.compile(r'\s*')
+
+# Separadores que se prueban como mucho al buscar cada frontera entre pacientes
+MAX_CANDIDATOS_FRONTERA = 1000
+
+# Texto completo del JSON; los procesos hijos lo heredan por fork en lugar de recibirlo serializado
+_texto_json = ""
+
+
+def _saltar_espacios(texto: str, pos: int) -> int:
+    return ESPACIOS_JSON.match(texto, pos).end()
+
+
+def _fronteras_pacientes(texto: str, inicio: int, fragmentos: int) -> List[int]:
+    """
+    Busca posiciones donde empieza un paciente para repartir la lista en
+    'fragmentos' trozos de tamaño parecido.
+    
+    Se buscan separadores '}, {' seguidos de la misma primera clave que el primer
+    paciente, y el objeto que empieza ahí debe tener claves parecidas a las de ese
+    paciente, para no cortar dentro de las citas o procesos anidados. Si aun así
+    una frontera cae mal, el trozo no es JSON válido y se detecta al parsearlo.
+    """
+    decoder = json.JSONDecoder()
+    try:
+        primero, _ = decoder.raw_decode(texto, _saltar_espacios(texto, inicio))
+    except ValueError:
+        return []
+    if not isinstance(primero, dict) or not primero:
+        return []
+    claves_paciente = set(primero)
+    separador = re.compile(
+        r'\}\s*,\s*(?=\{\s*' + re.escape(json.dumps(next(iter(primero)))) + r'\s*:)'
+    )
+    
+    def parece_paciente(pos: int) -> bool:
+        try:
+            obj, _ = decoder.raw_decode(texto, pos)
+        except ValueError:
+            return False
+        if not isinstance(obj, dict):
+            return False
+        claves = set(obj)
+        return len(claves & claves_paciente) * 2 >= len(claves | claves_paciente)
+    
+    fronteras = []
+    paso = (len(texto) - inicio) // fragmentos
+    for k in range(1, fragmentos):
+        desde = max(inicio + k * paso, fronteras[-1] if fronteras else inicio)
+        for _intento in range(MAX_CANDIDATOS_FRONTERA):
+            match = separador.search(texto, desde)
+            if match is None or parece_paciente(match.end()):
+                break
+            desde = match.end()
+        else:
+            continue
+        if match is None:
+            break
+        if not fronteras or match.end() > fronteras[-1]:
+            fronteras.append(match.end())
+    return fronteras
+
+
+def _aplanar_fragmento(trabajo: Tuple[int, Optional[int], Tuple[str, ...]]):
+    """
+    Parsea y aplana en un proceso hijo los pacientes de texto[inicio:fin].
+    
+    El último fragmento (fin=None) llega hasta el final del archivo: se parsea con
+    raw_decode, que se detiene en el ']' que cierra la lista, y se devuelve esa
+    posición para seguir leyendo el resto del objeto. Devuelve None si el trozo no
+    es JSON válido. Junto al resultado se devuelven los diccionarios de columnas
+    del fragmento, para el resumen del proceso padre.
+    """
+    global DICCIONARIOS
+    inicio, fin, colecciones = trabajo
+    DICCIONARIOS = Diccionarios()
+    try:
+        if fin is None:
+            pacientes, fin_lista = json.JSONDecoder().raw_decode('[' + _texto_json[inicio:])
+            fin_lista += inicio - 1
+        else:
+            pacientes = json.loads('[' + _texto_json[inicio:fin] + ']')
+            fin_lista = None
+    except ValueError:
+        return None
+    if not all(isinstance(p, dict) for p in pacientes):
+        return None
+    return _aplanar_pacientes(pacientes, colecciones), fin_lista, DICCIONARIOS
+
+
+def procesar_json_en_paralelo(texto: str, workers: int, colecciones: Optional[Iterable[str]] = None) -> Optional[Dict]:
+    """
+    Variante de json.loads + procesar_datos_clinni para exportaciones grandes
+    con forma {"pacientes": [...], ...}.
+    
+    La lista de pacientes se divide en rangos de texto que se parsean y aplanan
+    en 'workers' procesos; los resultados se unen en el orden original. Si un
+    trozo no es JSON válido (frontera dentro de un objeto anidado) se une con su
+    vecino y se vuelve a parsear. Devuelve None si el archivo no tiene esa forma
+    o la lista no se puede parsear, y entonces hay que procesarlo de la forma normal.
+    """
+    global _texto_json
+    colecciones = tuple(colecciones) if colecciones is not None else COLECCIONES_CLINNI
+    if "fork" not in multiprocessing.get_all_start_methods():
+        print("[AVISO] Este sistema no permite fork; el JSON se procesa en un solo proceso.", file=sys.stderr)
+        return None
+    
+    decoder = json.JSONDecoder()
+    pos = _saltar_espacios(texto, 0)
+    if not texto.startswith('{', pos):
+        return None
+    
+    # Recorrer las claves del objeto principal hasta la lista de pacientes
+    valores: Dict[str, object] = {}
+    claves: List[str] = []  # en orden de aparición, para elegir la de bonos igual que procesar_datos_clinni
+    pos = _saltar_espacios(texto, pos + 1)
+    pacientes_key = None
+    inicio_lista = None
+    try:
+        while texto.startswith('"', pos):
+            clave, pos = json.decoder.scanstring(texto, pos + 1)
+            pos = _saltar_espacios(texto, pos)
+            if not texto.startswith(':', pos):
+                return None
+            pos = _saltar_espacios(texto, pos + 1)
+            claves.append(clave)
+            if _clave_pacientes([clave]) == clave:
+                if not texto.startswith('[', pos):
+                    return None
+                pacientes_key = clave
+                inicio_lista = pos + 1
+                break
+            valores[clave], pos = decoder.raw_decode(texto, pos)
+            pos = _saltar_espacios(texto, pos)
+            if texto.startswith(',', pos):
+                pos = _saltar_espacios(texto, pos + 1)
+    except ValueError:
+        return None
+    if inicio_lista is None:
+        return None
+    
+    fronteras = _fronteras_pacientes(texto, inicio_lista, workers)
+    if not fronteras:
+        return None
+    inicios = [inicio_lista] + fronteras
+    # Cada fragmento acaba justo después de la '}' anterior a la siguiente frontera
+    fines: List[Optional[int]] = [texto.rindex('}', 0, f) + 1 for f in fronteras] + [None]
+    tramos = list(zip(inicios, fines))
+    resultados: List = [None] * len(tramos)
+    
+    _texto_json = texto
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        with multiprocessing.get_context("fork").Pool(min(workers, len(tramos))) as pool:
+            while True:
+                pendientes = [i for i, r in enumerate(resultados) if r is None]
+                nuevos = pool.map(_aplanar_fragmento, [(*tramos[i], colecciones) for i in pendientes])
+                for i, r in zip(pendientes, nuevos):
+                    resultados[i] = r
+                fallidos = {i for i in pendientes if resultados[i] is None}
+                if not fallidos:
+                    break
+                if len(tramos) == 1:
+                    # Ni la lista entera se puede parsear: que lo intente la ruta normal
+                    print("[AVISO] No se pudo dividir la lista de pacientes; el JSON se procesa en un solo proceso.",
+                          file=sys.stderr)
+                    return None
+                # Una frontera equivocada invalida los dos trozos que separa: se unen
+                # los fallidos con su vecino y se reparsean solo esos
+                unidos_tramos, unidos_resultados = [], []
+                i = 0
+                while i < len(tramos):
+                    if i in fallidos and i + 1 < len(tramos):
+                        unidos_tramos.append((tramos[i][0], tramos[i + 1][1]))
+                        unidos_resultados.append(None)
+                        i += 2
+                    elif i in fallidos:
+                        unidos_tramos[-1] = (unidos_tramos[-1][0], tramos[i][1])
+                        unidos_resultados[-1] = None
+                        i += 1
+                    else:
+                        unidos_tramos.append(tramos[i])
+                        unidos_resultados.append(resultados[i])
+                        i += 1
+                tramos, resultados = unidos_tramos, unidos_resultados
+    finally:
+        _texto_json = ""
+    
+    estructurado = {'pacientes': [], 'bonos': [], 'citas': [], 'historial': []}
+    for aplanado, _, diccionarios in resultados:
+        for coleccion, registros in aplanado.items():
+            estructurado[coleccion].extend(registros)
+        DICCIONARIOS.unir(diccionarios)
+    
+    # Resto del objeto principal, a partir del ']' que cierra la lista de pacientes
+    pos = _saltar_espacios(texto, resultados[-1][1])
+    try:
+        while texto.startswith(',', pos):
+            pos = _saltar_espacios(texto, pos + 1)
+            if not texto.startswith('"', pos):
+                break
+            clave, pos = json.decoder.scanstring(texto, pos + 1)
+            claves.append(clave)
+            pos = _saltar_espacios(texto, pos)
+            if not texto.startswith(':', pos):
+                return None
+            valores[clave], pos = decoder.raw_decode(texto, _saltar_espacios(texto, pos + 1))
+            pos = _saltar_espacios(texto, pos)
+    except ValueError:
+        return None
+    
+    bonos_key = _clave_bonos(claves)
+    if bonos_key == pacientes_key:
+        # La lista de pacientes no se ha guardado entera: mejor la ruta normal
+        return None
+    if bonos_key and isinstance(valores[bonos_key], list) and 'bonos' in colecciones:
+        estructurado['bonos'] = _codificar_bonos(valores[bonos_key])
+    
+    print(f"[INFO] Lista de pacientes procesada en {len(tramos)} fragmentos")
+    _imprimir_resumen(estructurado)
+    return estructurado
+
+
 def extraer_datos_estructurados(datos: List[Dict[str, str]]) -> Dict:
     """
     Extrae y organiza los datos en estructuras similares a las plantillas.
@@ -417,110 +785,126 @@ def extraer_datos_estructurados(datos: List[Dict[str, str]]) -> Dict:
 # ---------------------------------------------------------------------------
 
 
-def generar_clientes_y_bonos(datos: Dict, output_path: Path, plantilla_path: Path) -> None:
-    """Genera plantilla_clientes_y_bonos.csv desde datos de CLINNI."""
-    headers = _read_csv_headers(plantilla_path)
+# Colecciones de datos que lee esta plantilla
+FUENTES_CLIENTES_Y_BONOS = ('pacientes', 'bonos')
+
+
+ALIAS_CLIENTES_Y_BONOS_PACIENTE = compilar_alias({
+    'id': ('dni', 'id', 'PAC_ID', 'CLIENTE_ID', 'ID', 'ID_PACIENTE', 'PATIENT_ID'),
+    'nombre': ('nombre', 'NOMBRE', 'PAC_NOMBRE', 'NAME', 'NOMBRE_CLIENTE', 'CLIENTE_NOMBRE'),
+    'apellidos': ('apellidos', 'APELLIDOS', 'PAC_APELLIDOS', 'SURNAME', 'APELLIDO', 'LAST_NAME'),
+    'telefono': ('movil', 'TELEFONO', 'PAC_TELEFONO1', 'PHONE', 'TEL', 'TELEFONO1', 'MOVIL'),
+    'nif': ('dni', 'NIF', 'DNI', 'CIF', 'ID_FISCAL'),
+    'direccion': ('direccionFacturacion', 'DIRECCION', 'DIR', 'ADDRESS'),
+    'cp': ('cp', 'CP', 'COD_POSTAL', 'POSTAL_CODE'),
+    'ciudad': ('localidad', 'CIUDAD', 'POBLACION', 'CITY'),
+    'provincia': ('provincia', 'PROVINCIA', 'PROV', 'PROVINCE'),
+    'pais': ('pais', 'PAIS', 'COUNTRY'),
+    'email': ('email', 'EMAIL', 'E_MAIL', 'CORREO'),
+    'fecha_nacimiento': ('fechaNacimiento', 'FECHA_NACIMIENTO', 'FECHA_NAC', 'BIRTH_DATE'),
+    'genero': ('sexo', 'GENERO', 'SEXO', 'GENDER'),
+    'notas': ('comentario', 'antecedentes', 'NOTAS', 'OBSERVACIONES', 'NOTES'),
+})
+
+ALIAS_CLIENTES_Y_BONOS_BONO = compilar_alias({
+    'pac_id': ('dni', 'PAC_ID', 'CLIENTE_ID', 'ID_PACIENTE', 'PATIENT_ID', 'PACIENTE_ID'),
+    'nombre': ('NOMBRE', 'DESCRIPCION', 'NOMBRE_BONO'),
+    'precio': ('PRECIO', 'IMPORTE', 'PRICE'),
+    'sesiones': ('SESIONES', 'NUM_SESIONES', 'SESIONES_TOTALES'),
+    'consumidas': ('SESIONES_CONSUMIDAS', 'USADAS', 'USOS'),
+    'caducidad': ('FECHA_CADUCIDAD', 'FECHA_VENC', 'EXPIRES'),
+    'notas': ('NOTAS', 'OBSERVACIONES', 'CONDICIONES'),
+})
+
+
+# Columnas de las filas que emite generar_clientes_y_bonos, en el orden de la plantilla
+COLUMNAS_CLIENTES_Y_BONOS = (
+    "Nombre",
+    "Apellidos",
+    "CIF/NIF",
+    "Direccion",
+    "Codigo Postal",
+    "Ciudad",
+    "Provincia",
+    "Pais",
+    "Email",
+    "Telefono",
+    "Tipo Cliente",
+    "Fecha Nacimiento",
+    "Genero",
+    "Notas Medicas",
+    "Fecha seguimiento",
+    "Tipo seguimiento",
+    "Descripción",
+    "Recomendaciones",
+    "Nombre Bono",
+    "Servicio",
+    "Precio",
+    "Sesiones Totales",
+    "Sesiones Consumidas",
+    "Fecha Caducidad",
+    "Notas Bono",
+)
+
+
+def _filas_clientes_y_bonos(datos: Dict) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla_clientes_y_bonos.csv, en el orden de COLUMNAS_CLIENTES_Y_BONOS."""
     pacientes = datos.get('pacientes', [])
     bonos = datos.get('bonos', [])
     
     # Crear índice de bonos por paciente
-    bonos_por_paciente = defaultdict(list)
-    for bono in bonos:
-        # Intentar encontrar ID de paciente en el bono
-        pac_id = _first_no_empty(
-            bono.get('dni'), bono.get('PAC_ID'), bono.get('CLIENTE_ID'), 
-            bono.get('ID_PACIENTE'), bono.get('PATIENT_ID'), bono.get('PACIENTE_ID')
-        )
-        if pac_id:
-            bonos_por_paciente[pac_id].append(bono)
+    with etapa("indice bonos_por_paciente") as e:
+        bonos_por_paciente = multidiccionario("bonos_por_paciente")
+        for bono in bonos:
+            # Intentar encontrar ID de paciente en el bono
+            b = ALIAS_CLIENTES_Y_BONOS_BONO(bono)
+            if b['pac_id']:
+                bonos_por_paciente[b['pac_id']].append(b)
+        e["filas"] = len(bonos_por_paciente)
     
-    rows_out: List[Dict[str, str]] = []
+    sin_bono = ALIAS_CLIENTES_Y_BONOS_BONO({})
     
     for paciente in pacientes:
-        pac_id = _first_no_empty(
-            paciente.get('dni'), paciente.get('id'), paciente.get('PAC_ID'), 
-            paciente.get('CLIENTE_ID'), paciente.get('ID'), paciente.get('ID_PACIENTE'), 
-            paciente.get('PATIENT_ID')
-        )
-        bonos_pac = bonos_por_paciente.get(pac_id, [])
-        bono = bonos_pac[0] if bonos_pac else {}
-        
         # Extraer campos comunes (normalizar nombres - CLINNI usa minúsculas)
-        nombre = _first_no_empty(
-            paciente.get('nombre'), paciente.get('NOMBRE'), paciente.get('PAC_NOMBRE'), 
-            paciente.get('NAME'), paciente.get('NOMBRE_CLIENTE'), paciente.get('CLIENTE_NOMBRE')
-        )
-        apellidos = _first_no_empty(
-            paciente.get('apellidos'), paciente.get('APELLIDOS'), paciente.get('PAC_APELLIDOS'), 
-            paciente.get('SURNAME'), paciente.get('APELLIDO'), paciente.get('LAST_NAME')
-        )
-        telefono = _first_no_empty(
-            paciente.get('movil'), paciente.get('TELEFONO'), paciente.get('PAC_TELEFONO1'), 
-            paciente.get('PHONE'), paciente.get('TEL'), paciente.get('TELEFONO1'), paciente.get('MOVIL')
-        )
+        p = ALIAS_CLIENTES_Y_BONOS_PACIENTE(paciente)
+        bonos_pac = bonos_por_paciente.get(p['id'], [])
+        b = bonos_pac[0] if bonos_pac else sin_bono
         
-        row = {
-            "Nombre": nombre,
-            "Apellidos": apellidos,
-            "CIF/NIF": _first_no_empty(
-                paciente.get('dni'), paciente.get('NIF'), paciente.get('DNI'), 
-                paciente.get('CIF'), paciente.get('ID_FISCAL')
-            ),
-            "Direccion": _first_no_empty(
-                paciente.get('direccionFacturacion'), paciente.get('DIRECCION'), 
-                paciente.get('DIR'), paciente.get('ADDRESS')
-            ),
-            "Codigo Postal": _first_no_empty(
-                paciente.get('cp'), paciente.get('CP'), paciente.get('COD_POSTAL'), 
-                paciente.get('POSTAL_CODE')
-            ),
-            "Ciudad": _first_no_empty(
-                paciente.get('localidad'), paciente.get('CIUDAD'), paciente.get('POBLACION'), 
-                paciente.get('CITY')
-            ),
-            "Provincia": _first_no_empty(
-                paciente.get('provincia'), paciente.get('PROVINCIA'), paciente.get('PROV'), 
-                paciente.get('PROVINCE')
-            ),
-            "Pais": _first_no_empty(
-                paciente.get('pais'), paciente.get('PAIS'), paciente.get('COUNTRY'), "España"
-            ),
-            "Email": _first_no_empty(
-                paciente.get('email'), paciente.get('EMAIL'), paciente.get('E_MAIL'), 
-                paciente.get('CORREO')
-            ),
-            "Telefono": telefono,
-            "Tipo Cliente": "",
-            "Fecha Nacimiento": formatear_fecha(_first_no_empty(
-                paciente.get('fechaNacimiento'), paciente.get('FECHA_NACIMIENTO'), 
-                paciente.get('FECHA_NAC'), paciente.get('BIRTH_DATE')
-            )),
-            "Genero": _first_no_empty(
-                paciente.get('sexo'), paciente.get('GENERO'), paciente.get('SEXO'), 
-                paciente.get('GENDER')
-            ),
-            "Notas Medicas": _first_no_empty(
-                paciente.get('comentario'), paciente.get('antecedentes'), paciente.get('NOTAS'), 
-                paciente.get('OBSERVACIONES'), paciente.get('NOTES')
-            ),
-            "Fecha seguimiento": "",
-            "Tipo seguimiento": "",
-            "Descripción": "",
-            "Recomendaciones": "",
-            "Nombre Bono": _first_no_empty(bono.get('NOMBRE'), bono.get('DESCRIPCION'), bono.get('NOMBRE_BONO')),
-            "Servicio": "",
-            "Precio": _first_no_empty(bono.get('PRECIO'), bono.get('IMPORTE'), bono.get('PRICE')),
-            "Sesiones Totales": _first_no_empty(bono.get('SESIONES'), bono.get('NUM_SESIONES'), bono.get('SESIONES_TOTALES')),
-            "Sesiones Consumidas": _first_no_empty(bono.get('SESIONES_CONSUMIDAS'), bono.get('USADAS'), bono.get('USOS')),
-            "Fecha Caducidad": formatear_fecha(_first_no_empty(
-                bono.get('FECHA_CADUCIDAD'), bono.get('FECHA_VENC'), bono.get('EXPIRES')
-            )),
-            "Notas Bono": _first_no_empty(bono.get('NOTAS'), bono.get('OBSERVACIONES'), bono.get('CONDICIONES')),
-        }
-        rows_out.append(row)
-    
-    _write_csv(output_path, headers, rows_out)
-    print(f"[OK] Generado {output_path} ({len(rows_out)} filas)")
+        row = (
+            p['nombre'],  # Nombre
+            p['apellidos'],  # Apellidos
+            p['nif'],  # CIF/NIF
+            p['direccion'],  # Direccion
+            p['cp'],  # Codigo Postal
+            p['ciudad'],  # Ciudad
+            p['provincia'],  # Provincia
+            p['pais'] or "España",  # Pais
+            p['email'],  # Email
+            p['telefono'],  # Telefono
+            "",  # Tipo Cliente
+            formatear_fecha(p['fecha_nacimiento']),  # Fecha Nacimiento
+            p['genero'],  # Genero
+            p['notas'],  # Notas Medicas
+            "",  # Fecha seguimiento
+            "",  # Tipo seguimiento
+            "",  # Descripción
+            "",  # Recomendaciones
+            b['nombre'],  # Nombre Bono
+            "",  # Servicio
+            b['precio'],  # Precio
+            b['sesiones'],  # Sesiones Totales
+            b['consumidas'],  # Sesiones Consumidas
+            formatear_fecha(b['caducidad']),  # Fecha Caducidad
+            b['notas'],  # Notas Bono
+        )
+        yield row
+
+
+def generar_clientes_y_bonos(datos: Dict, output_path: Path, plantilla_path: Path) -> None:
+    """Genera plantilla_clientes_y_bonos.csv desde datos de CLINNI."""
+    headers = leer_cabeceras(plantilla_path)
+    filas = escribir_csv(output_path, headers, _filas_clientes_y_bonos(datos), COLUMNAS_CLIENTES_Y_BONOS)
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
@@ -528,62 +912,97 @@ def generar_clientes_y_bonos(datos: Dict, output_path: Path, plantilla_path: Pat
 # ---------------------------------------------------------------------------
 
 
-def generar_bonos(datos: Dict, output_path: Path, plantilla_path: Path) -> None:
-    """Genera plantilla_bonos.csv desde datos de CLINNI."""
-    headers = _read_csv_headers(plantilla_path)
+FUENTES_BONOS = ('pacientes', 'bonos')
+
+
+ALIAS_PACIENTE_ID = compilar_alias({
+    'id': ('dni', 'id', 'PAC_ID', 'CLIENTE_ID', 'ID', 'ID_PACIENTE', 'PATIENT_ID'),
+})
+
+ALIAS_BONOS_PACIENTE = compilar_alias({
+    'nombre': ('nombre', 'NOMBRE', 'PAC_NOMBRE', 'NAME'),
+    'apellidos': ('apellidos', 'APELLIDOS', 'PAC_APELLIDOS', 'SURNAME'),
+    'telefono': ('movil', 'TELEFONO', 'PAC_TELEFONO1', 'PHONE'),
+})
+
+ALIAS_BONOS_BONO = compilar_alias({
+    'pac_id': ('dni', 'PAC_ID', 'CLIENTE_ID', 'ID_PACIENTE', 'PATIENT_ID', 'CLIENTE'),
+    'nombre': ('NOMBRE', 'DESCRIPCION', 'NOMBRE_BONO'),
+    'sesiones': ('SESIONES', 'NUM_SESIONES'),
+    'consumidas': ('SESIONES_CONSUMIDAS', 'USADAS'),
+    'precio': ('PRECIO', 'IMPORTE'),
+    'caducidad': ('FECHA_CADUCIDAD', 'FECHA_VENC'),
+})
+
+
+def _indexar_pacientes(
+    pacientes: List[Dict],
+    proyectar: Callable[[Dict], Dict[str, str]],
+    alias_id: Callable[[Dict], Dict[str, str]] = ALIAS_PACIENTE_ID,
+) -> Dict[str, Dict[str, str]]:
+    """
+    Índice por ID (CLINNI usa DNI como identificador común) de los campos de
+    cada paciente que lee la plantilla ('proyectar', uno de los ALIAS_*_PACIENTE).
+    El índice guarda solo esos campos y no el paciente con sus procesos y
+    citas, así que con --max-memory lo que pasa a disco es poco y propio.
+    """
+    with etapa("indice pacientes_dict") as e:
+        pacientes_dict = diccionario("pacientes_dict")
+        for p in pacientes:
+            pac_id = alias_id(p)['id']
+            if pac_id:
+                pacientes_dict[pac_id] = proyectar(p)
+        e["filas"] = len(pacientes_dict)
+    return pacientes_dict
+
+
+# Columnas de las filas que emite generar_bonos, en el orden de la plantilla
+COLUMNAS_BONOS = (
+    "Teléfono",
+    "Nombre Cliente",
+    "Nombre Bono",
+    "Servicio",
+    "Sesiones Totales",
+    "Sesiones Consumidas",
+    "Precio Total",
+    "Pagado",
+    "Importe Pagado",
+    "Fecha Caducidad",
+)
+
+
+def _filas_bonos(datos: Dict) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla_bonos.csv, en el orden de COLUMNAS_BONOS."""
     pacientes = datos.get('pacientes', [])
     bonos = datos.get('bonos', [])
     
-    # Crear índice de pacientes por ID (CLINNI usa DNI como identificador común)
-    pacientes_dict = {}
-    for p in pacientes:
-        pac_id = _first_no_empty(
-            p.get('dni'), p.get('id'), p.get('PAC_ID'), p.get('CLIENTE_ID'), 
-            p.get('ID'), p.get('ID_PACIENTE'), p.get('PATIENT_ID')
-        )
-        if pac_id:
-            pacientes_dict[pac_id] = p
-    
-    out_rows: List[Dict[str, str]] = []
+    pacientes_dict = _indexar_pacientes(pacientes, ALIAS_BONOS_PACIENTE)
+    sin_paciente = ALIAS_BONOS_PACIENTE({})
     
     for bono in bonos:
-        pac_id = _first_no_empty(
-            bono.get('dni'), bono.get('PAC_ID'), bono.get('CLIENTE_ID'), 
-            bono.get('ID_PACIENTE'), bono.get('PATIENT_ID'), bono.get('CLIENTE')
-        )
-        paciente = pacientes_dict.get(pac_id, {})
+        b = ALIAS_BONOS_BONO(bono)
+        p = pacientes_dict.get(b['pac_id'], sin_paciente)
         
-        nombre = _first_no_empty(
-            paciente.get('nombre'), paciente.get('NOMBRE'), paciente.get('PAC_NOMBRE'), 
-            paciente.get('NAME')
-        )
-        apellidos = _first_no_empty(
-            paciente.get('apellidos'), paciente.get('APELLIDOS'), paciente.get('PAC_APELLIDOS'), 
-            paciente.get('SURNAME')
-        )
-        telefono = _first_no_empty(
-            paciente.get('movil'), paciente.get('TELEFONO'), paciente.get('PAC_TELEFONO1'), 
-            paciente.get('PHONE')
+        row = (
+            p['telefono'],  # Teléfono
+            f"{p['nombre']} {p['apellidos']}".strip(),  # Nombre Cliente
+            b['nombre'],  # Nombre Bono
+            "",  # Servicio
+            b['sesiones'],  # Sesiones Totales
+            b['consumidas'],  # Sesiones Consumidas
+            b['precio'],  # Precio Total
+            "",  # Pagado
+            "",  # Importe Pagado
+            formatear_fecha(b['caducidad']),  # Fecha Caducidad
         )
-        
-        row = {
-            "Teléfono": telefono,
-            "Nombre Cliente": f"{nombre} {apellidos}".strip(),
-            "Nombre Bono": _first_no_empty(bono.get('NOMBRE'), bono.get('DESCRIPCION'), bono.get('NOMBRE_BONO')),
-            "Servicio": "",
-            "Sesiones Totales": _first_no_empty(bono.get('SESIONES'), bono.get('NUM_SESIONES')),
-            "Sesiones Consumidas": _first_no_empty(bono.get('SESIONES_CONSUMIDAS'), bono.get('USADAS')),
-            "Precio Total": _first_no_empty(bono.get('PRECIO'), bono.get('IMPORTE')),
-            "Pagado": "",
-            "Importe Pagado": "",
-            "Fecha Caducidad": formatear_fecha(_first_no_empty(
-                bono.get('FECHA_CADUCIDAD'), bono.get('FECHA_VENC')
-            )),
-        }
-        out_rows.append(row)
-    
-    _write_csv(output_path, headers, out_rows)
-    print(f"[OK] Generado {output_path} ({len(out_rows)} filas)")
+        yield row
+
+
+def generar_bonos(datos: Dict, output_path: Path, plantilla_path: Path) -> None:
+    """Genera plantilla_bonos.csv desde datos de CLINNI."""
+    headers = leer_cabeceras(plantilla_path)
+    filas = escribir_csv(output_path, headers, _filas_bonos(datos), COLUMNAS_BONOS)
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
@@ -591,98 +1010,101 @@ def generar_bonos(datos: Dict, output_path: Path, plantilla_path: Path) -> None:
 # ---------------------------------------------------------------------------
 
 
-def generar_historial_basica(datos: Dict, output_path: Path, plantilla_path: Path) -> None:
-    """Genera plantilla_historial_basica.csv desde datos de CLINNI."""
-    headers = _read_csv_headers(plantilla_path)
+FUENTES_HISTORIAL_BASICA = ('pacientes', 'historial')
+
+
+ALIAS_HISTORIAL_BASICA = compilar_alias({
+    'pac_id': ('PAC_ID', 'dni', 'CLIENTE_ID', 'ID_PACIENTE', 'PATIENT_ID', 'CLIENTE'),
+    'diagnostico': ('diagnostico', 'DIAGNOSTICO', 'DIAG'),
+    'motivo': ('MOTIVO', 'MOTIVO_CONSULTA'),
+    'descripcion': ('DESCRIPCION', 'DETALLES', 'contenido'),
+    'observaciones': ('OBSERVACIONES', 'NOTAS', 'OBS'),
+    'profesional': ('PROFESIONAL', 'DOCTOR', 'MEDICO'),
+    'recomendaciones': ('RECOMENDACIONES', 'RECOMENDACION'),
+})
+
+ALIAS_HISTORIAL_BASICA_PACIENTE = compilar_alias({
+    'telefono': ('movil', 'TELEFONO', 'PAC_TELEFONO1', 'PHONE'),
+    'antecedentes': ('antecedentes', 'ANTECEDENTES'),
+})
+
+
+# Columnas de las filas que emite generar_historial_basica, en el orden de la plantilla
+COLUMNAS_HISTORIAL_BASICA = (
+    "Teléfono",
+    "Profesional",
+    "Motivo Consulta",
+    "Tiempo Evolución",
+    "Descripción Detallada",
+    "Enfermedades Crónicas",
+    "Alergias Medicamentosas",
+    "Medicación Habitual",
+    "Diagnóstico",
+    "Recomendaciones",
+    "Observaciones",
+)
+
+
+def _filas_historial_basica(datos: Dict) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla_historial_basica.csv, en el orden de COLUMNAS_HISTORIAL_BASICA."""
     pacientes = datos.get('pacientes', [])
     historial = datos.get('historial', [])
     
-    pacientes_dict = {}
-    for p in pacientes:
-        pac_id = _first_no_empty(
-            p.get('dni'), p.get('id'), p.get('PAC_ID'), p.get('CLIENTE_ID'), 
-            p.get('ID'), p.get('ID_PACIENTE'), p.get('PATIENT_ID')
-        )
-        if pac_id:
-            pacientes_dict[pac_id] = p
-    
-    # Limpiar HTML de los textos si existen
-    def limpiar_html(texto):
-        if not texto:
-            return ""
-        # Remover tags HTML básicos
-        texto = re.sub(r'<[^>]+>', '', str(texto))
-        # Limpiar espacios múltiples
-        texto = re.sub(r'\s+', ' ', texto)
-        return texto.strip()
-    
-    out_rows: List[Dict[str, str]] = []
+    pacientes_dict = _indexar_pacientes(pacientes, ALIAS_HISTORIAL_BASICA_PACIENTE)
     
     for hist in historial:
         # En CLINNI, el historial puede venir con referencia al paciente
         paciente_ref = hist.get('PACIENTE', {})
-        pac_id = _first_no_empty(
-            hist.get('PAC_ID'), hist.get('dni'), hist.get('CLIENTE_ID'), 
-            hist.get('ID_PACIENTE'), hist.get('PATIENT_ID'), hist.get('CLIENTE')
-        )
+        h = ALIAS_HISTORIAL_BASICA(hist)
+        pac_id = h['pac_id']
         
         if not pac_id and paciente_ref:
             pac_id = paciente_ref.get('dni') or paciente_ref.get('id')
         
-        paciente = pacientes_dict.get(pac_id, paciente_ref) if pac_id else paciente_ref
-        
-        telefono = _first_no_empty(
-            paciente.get('movil'), paciente.get('TELEFONO'), paciente.get('PAC_TELEFONO1'), 
-            paciente.get('PHONE')
-        )
+        p = pacientes_dict.get(pac_id) if pac_id else None
+        if p is None:
+            p = ALIAS_HISTORIAL_BASICA_PACIENTE(paciente_ref)
+        telefono = p['telefono']
         
         # En CLINNI, el historial puede venir de procesos o evoluciones
         proceso = hist.get('PROCESO', {})
         
         # Diagnóstico: específicamente el diagnóstico médico (no el título del proceso)
-        diagnostico = _first_no_empty(
-            proceso.get('diagnostico'), hist.get('diagnostico'),
-            hist.get('DIAGNOSTICO'), hist.get('DIAG')
-        )
+        diagnostico = _first_no_empty(proceso.get('diagnostico'), h['diagnostico'])
         
         # Motivo Consulta: el título del proceso o motivo específico
-        motivo = _first_no_empty(
-            proceso.get('titulo'), hist.get('MOTIVO'), hist.get('MOTIVO_CONSULTA')
-        )
+        motivo = _first_no_empty(proceso.get('titulo'), h['motivo'])
         
         # Descripción Detallada: descripción amplia, notas, contenido de evoluciones
         # NO incluir diagnóstico ni título aquí para evitar duplicados
-        descripcion = _first_no_empty(
-            hist.get('DESCRIPCION'), hist.get('DETALLES'), hist.get('contenido'),
-            hist.get('DESCRIPCION'), hist.get('DETALLES')
-        )
+        descripcion = h['descripcion']
         
         # Observaciones: notas adicionales, pero no el título ni diagnóstico
-        observaciones = _first_no_empty(
-            hist.get('OBSERVACIONES'), hist.get('NOTAS'), hist.get('OBS')
-        )
+        observaciones = h['observaciones']
         
         # Solo agregar fila si hay algún dato relevante (no solo teléfono)
         if telefono or diagnostico or descripcion or motivo or observaciones:
-            row = {
-                "Teléfono": telefono,
-                "Profesional": _first_no_empty(hist.get('PROFESIONAL'), hist.get('DOCTOR'), hist.get('MEDICO')),
-                "Motivo Consulta": limpiar_html(motivo),
-                "Tiempo Evolución": "",
-                "Descripción Detallada": limpiar_html(descripcion),
-                "Enfermedades Crónicas": _first_no_empty(
-                    paciente.get('antecedentes'), paciente.get('ANTECEDENTES')
-                ),
-                "Alergias Medicamentosas": "",
-                "Medicación Habitual": "",
-                "Diagnóstico": limpiar_html(diagnostico),
-                "Recomendaciones": _first_no_empty(hist.get('RECOMENDACIONES'), hist.get('RECOMENDACION')),
-                "Observaciones": limpiar_html(observaciones),
-            }
-            out_rows.append(row)
-    
-    _write_csv(output_path, headers, out_rows)
-    print(f"[OK] Generado {output_path} ({len(out_rows)} filas)")
+            row = (
+                telefono,  # Teléfono
+                h['profesional'],  # Profesional
+                limpiar_html(motivo),  # Motivo Consulta
+                "",  # Tiempo Evolución
+                limpiar_html(descripcion),  # Descripción Detallada
+                p['antecedentes'],  # Enfermedades Crónicas
+                "",  # Alergias Medicamentosas
+                "",  # Medicación Habitual
+                limpiar_html(diagnostico),  # Diagnóstico
+                h['recomendaciones'],  # Recomendaciones
+                limpiar_html(observaciones),  # Observaciones
+            )
+            yield row
+
+
+def generar_historial_basica(datos: Dict, output_path: Path, plantilla_path: Path) -> None:
+    """Genera plantilla_historial_basica.csv desde datos de CLINNI."""
+    headers = leer_cabeceras(plantilla_path)
+    filas = escribir_csv(output_path, headers, _filas_historial_basica(datos), COLUMNAS_HISTORIAL_BASICA)
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
@@ -690,94 +1112,90 @@ def generar_historial_basica(datos: Dict, output_path: Path, plantilla_path: Pat
 # ---------------------------------------------------------------------------
 
 
-def generar_historial_completa(datos: Dict, output_path: Path, plantilla_path: Path) -> None:
-    """Genera plantilla_historial_completa.csv desde datos de CLINNI."""
-    headers = _read_csv_headers(plantilla_path)
+FUENTES_HISTORIAL_COMPLETA = ('pacientes', 'historial')
+
+
+ALIAS_HISTORIAL_COMPLETA = compilar_alias({
+    'pac_id': ('PAC_ID', 'dni', 'CLIENTE_ID', 'ID_PACIENTE', 'PATIENT_ID', 'CLIENTE'),
+    'diagnostico': ('diagnostico', 'DIAGNOSTICO', 'DIAG'),
+    'motivo': ('MOTIVO', 'MOTIVO_CONSULTA'),
+    'descripcion': ('DESCRIPCION', 'DETALLES', 'contenido'),
+    'observaciones': ('OBSERVACIONES', 'NOTAS', 'OBS'),
+    'profesional': ('PROFESIONAL', 'DOCTOR'),
+})
+
+ALIAS_HISTORIAL_COMPLETA_PACIENTE = compilar_alias({
+    'telefono': ('movil', 'TELEFONO', 'PAC_TELEFONO1', 'PHONE'),
+})
+
+
+# Columnas de las filas que emite generar_historial_completa (el resto de
+# columnas de la plantilla se escriben vacías)
+COLUMNAS_HISTORIAL_COMPLETA = (
+    "Teléfono Cliente",
+    "Profesional",
+    "Motivo Consulta",
+    "Descripción Detallada",
+    "Diagnóstico",
+    "Observaciones Adicionales",
+)
+
+
+def _filas_historial_completa(datos: Dict) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla_historial_completa.csv, en el orden de COLUMNAS_HISTORIAL_COMPLETA."""
     pacientes = datos.get('pacientes', [])
     historial = datos.get('historial', [])
     
-    pacientes_dict = {}
-    for p in pacientes:
-        pac_id = _first_no_empty(
-            p.get('dni'), p.get('id'), p.get('PAC_ID'), p.get('CLIENTE_ID'), 
-            p.get('ID'), p.get('ID_PACIENTE'), p.get('PATIENT_ID')
-        )
-        if pac_id:
-            pacientes_dict[pac_id] = p
-    
-    out_rows: List[Dict[str, str]] = []
-    
-    # Limpiar HTML de los textos si existen
-    def limpiar_html(texto):
-        if not texto:
-            return ""
-        # Remover tags HTML básicos
-        texto = re.sub(r'<[^>]+>', '', str(texto))
-        # Limpiar espacios múltiples
-        texto = re.sub(r'\s+', ' ', texto)
-        return texto.strip()
+    pacientes_dict = _indexar_pacientes(pacientes, ALIAS_HISTORIAL_COMPLETA_PACIENTE)
     
     for hist in historial:
         # En CLINNI, el historial puede venir con referencia al paciente
         paciente_ref = hist.get('PACIENTE', {})
-        pac_id = _first_no_empty(
-            hist.get('PAC_ID'), hist.get('dni'), hist.get('CLIENTE_ID'), 
-            hist.get('ID_PACIENTE'), hist.get('PATIENT_ID'), hist.get('CLIENTE')
-        )
+        h = ALIAS_HISTORIAL_COMPLETA(hist)
+        pac_id = h['pac_id']
         
         if not pac_id and paciente_ref:
             pac_id = paciente_ref.get('dni') or paciente_ref.get('id')
         
-        paciente = pacientes_dict.get(pac_id, paciente_ref) if pac_id else paciente_ref
-        
-        telefono = _first_no_empty(
-            paciente.get('movil'), paciente.get('TELEFONO'), paciente.get('PAC_TELEFONO1'), 
-            paciente.get('PHONE')
-        )
+        p = pacientes_dict.get(pac_id) if pac_id else None
+        if p is None:
+            p = ALIAS_HISTORIAL_COMPLETA_PACIENTE(paciente_ref)
+        telefono = p['telefono']
         
         # En CLINNI, el historial puede venir de procesos o evoluciones
         proceso = hist.get('PROCESO', {})
         
         # Diagnóstico: específicamente el diagnóstico médico (no el título del proceso)
-        diagnostico = _first_no_empty(
-            proceso.get('diagnostico'), hist.get('diagnostico'),
-            hist.get('DIAGNOSTICO'), hist.get('DIAG')
-        )
+        diagnostico = _first_no_empty(proceso.get('diagnostico'), h['diagnostico'])
         
         # Motivo Consulta: el título del proceso o motivo específico
-        motivo = _first_no_empty(
-            proceso.get('titulo'), hist.get('MOTIVO'), hist.get('MOTIVO_CONSULTA')
-        )
+        motivo = _first_no_empty(proceso.get('titulo'), h['motivo'])
         
         # Descripción Detallada: descripción amplia, notas, contenido de evoluciones
         # NO incluir diagnóstico ni título aquí para evitar duplicados
-        descripcion = _first_no_empty(
-            hist.get('DESCRIPCION'), hist.get('DETALLES'), hist.get('contenido'),
-            hist.get('DESCRIPCION'), hist.get('DETALLES')
-        )
+        descripcion = h['descripcion']
         
         # Observaciones: notas adicionales, pero no el título ni diagnóstico
-        observaciones = _first_no_empty(
-            hist.get('OBSERVACIONES'), hist.get('NOTAS'), hist.get('OBS')
-        )
-        
-        # Crear row con todos los campos inicializados
-        row = {}
-        for h in headers:
-            row[h] = ""
+        observaciones = h['observaciones']
         
-        # Llenar campos conocidos
-        row["Teléfono Cliente"] = telefono
-        row["Profesional"] = _first_no_empty(hist.get('PROFESIONAL'), hist.get('DOCTOR'))
-        row["Motivo Consulta"] = limpiar_html(motivo)
-        row["Diagnóstico"] = limpiar_html(diagnostico)
-        row["Descripción Detallada"] = limpiar_html(descripcion)
-        row["Observaciones Adicionales"] = limpiar_html(observaciones)
+        # Solo los campos conocidos; el resto de columnas de la plantilla quedan vacías
+        row = (
+            telefono,  # Teléfono Cliente
+            h['profesional'],  # Profesional
+            limpiar_html(motivo),  # Motivo Consulta
+            limpiar_html(descripcion),  # Descripción Detallada
+            limpiar_html(diagnostico),  # Diagnóstico
+            limpiar_html(observaciones),  # Observaciones Adicionales
+        )
         
-        out_rows.append(row)
-    
-    _write_csv(output_path, headers, out_rows)
-    print(f"[OK] Generado {output_path} ({len(out_rows)} filas)")
+        yield row
+
+
+def generar_historial_completa(datos: Dict, output_path: Path, plantilla_path: Path) -> None:
+    """Genera plantilla_historial_completa.csv desde datos de CLINNI."""
+    headers = leer_cabeceras(plantilla_path)
+    filas = escribir_csv(output_path, headers, _filas_historial_completa(datos), COLUMNAS_HISTORIAL_COMPLETA)
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
@@ -785,79 +1203,82 @@ def generar_historial_completa(datos: Dict, output_path: Path, plantilla_path: P
 # ---------------------------------------------------------------------------
 
 
-def generar_citas(datos: Dict, output_path: Path, plantilla_path: Path) -> None:
-    """Genera plantilla-citas.csv desde datos de CLINNI."""
-    headers = _read_csv_headers(plantilla_path)
+FUENTES_CITAS = ('pacientes', 'citas')
+
+
+ALIAS_CITAS_PACIENTE_ID = compilar_alias({
+    'id': ('PAC_ID', 'CLIENTE_ID', 'ID', 'ID_PACIENTE', 'PATIENT_ID'),
+})
+
+ALIAS_CITAS_PACIENTE = compilar_alias({
+    'nombre': ('nombre', 'NOMBRE', 'PAC_NOMBRE', 'NAME', 'NOMBRE_CLIENTE', 'CLIENTE_NOMBRE'),
+    'apellidos': ('apellidos', 'APELLIDOS', 'PAC_APELLIDOS', 'SURNAME', 'APELLIDO', 'LAST_NAME'),
+    'telefono': ('movil', 'TELEFONO', 'PAC_TELEFONO1', 'PHONE'),
+})
+
+ALIAS_CITAS_CITA = compilar_alias({
+    'pac_id': ('PAC_ID', 'CLIENTE_ID', 'ID_PACIENTE', 'PATIENT_ID', 'CLIENTE'),
+    'fecha': ('fecha', 'FECHA', 'DATE', 'FECHA_CITA'),
+    'inicio': ('inicio', 'HORA', 'TIME', 'HORA_CITA'),
+    'fin': ('fin', 'HORA_FIN', 'END_TIME'),
+    'estado': ('ESTADO', 'STATUS', 'ESTADO_CITA'),
+    'profesional': ('PROFESIONAL', 'DOCTOR', 'MEDICO'),
+    'servicio': ('SERVICIO', 'TIPO_CITA', 'TRATAMIENTO'),
+    'duracion': ('DURACION', 'DURATION', 'MINUTOS'),
+    'notas': ('NOTAS', 'OBSERVACIONES', 'NOTES'),
+})
+
+
+# Columnas de las filas que emite generar_citas, en el orden de la plantilla
+COLUMNAS_CITAS = (
+    "professional_name",
+    "client_name",
+    "client_phone",
+    "service_name",
+    "date",
+    "start_time",
+    "end_time",
+    "duration",
+    "status",
+    "notes",
+    "modalidad",
+)
+
+
+def _filas_citas(datos: Dict) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla-citas.csv, en el orden de COLUMNAS_CITAS."""
     pacientes = datos.get('pacientes', [])
     citas = datos.get('citas', [])
     
-    pacientes_dict = {}
-    for p in pacientes:
-        pac_id = _first_no_empty(
-            p.get('PAC_ID'), p.get('CLIENTE_ID'), p.get('ID'),
-            p.get('ID_PACIENTE'), p.get('PATIENT_ID')
-        )
-        if pac_id:
-            pacientes_dict[pac_id] = p
-    
-    out_rows: List[Dict[str, str]] = []
+    pacientes_dict = _indexar_pacientes(pacientes, ALIAS_CITAS_PACIENTE, ALIAS_CITAS_PACIENTE_ID)
     
     for cita in citas:
         # En CLINNI, las citas pueden venir con referencia al paciente
         paciente_ref = cita.get('PACIENTE', {})
-        pac_id = _first_no_empty(
-            cita.get('PAC_ID'), cita.get('CLIENTE_ID'), cita.get('ID_PACIENTE'),
-            cita.get('PATIENT_ID'), cita.get('CLIENTE')
-        )
+        c = ALIAS_CITAS_CITA(cita)
+        pac_id = c['pac_id']
         
         # Si no hay pac_id pero hay paciente_ref, usar el DNI del paciente
         if not pac_id and paciente_ref:
             pac_id = paciente_ref.get('dni') or paciente_ref.get('id')
         
-        paciente = pacientes_dict.get(pac_id, paciente_ref)
-        
-        nombre = _first_no_empty(
-            paciente.get('nombre'), paciente.get('NOMBRE'), paciente.get('PAC_NOMBRE'), 
-            paciente.get('NAME'), paciente.get('NOMBRE_CLIENTE'), paciente.get('CLIENTE_NOMBRE')
-        )
-        apellidos = _first_no_empty(
-            paciente.get('apellidos'), paciente.get('APELLIDOS'), paciente.get('PAC_APELLIDOS'), 
-            paciente.get('SURNAME'), paciente.get('APELLIDO'), paciente.get('LAST_NAME')
-        )
-        nombre_completo = f"{nombre} {apellidos}".strip()
-        
-        telefono = _first_no_empty(
-            paciente.get('movil'), paciente.get('TELEFONO'), paciente.get('PAC_TELEFONO1'), 
-            paciente.get('PHONE')
-        )
+        p = pacientes_dict.get(pac_id)
+        if p is None:
+            p = ALIAS_CITAS_PACIENTE(paciente_ref)
+        nombre_completo = f"{p['nombre']} {p['apellidos']}".strip()
+        telefono = p['telefono']
         
         # En CLINNI, las citas tienen fecha, inicio, fin
-        fecha = _first_no_empty(
-            cita.get('fecha'), cita.get('FECHA'), cita.get('DATE'), cita.get('FECHA_CITA')
-        )
-        hora_inicio = _first_no_empty(
-            cita.get('inicio'), cita.get('HORA'), cita.get('TIME'), cita.get('HORA_CITA')
-        )
-        hora_fin = _first_no_empty(
-            cita.get('fin'), cita.get('HORA_FIN'), cita.get('END_TIME')
-        )
+        fecha = c['fecha']
+        hora_inicio = c['inicio']
+        hora_fin = c['fin']
         
         # Calcular duración si tenemos inicio y fin
         duracion = ""
         if hora_inicio and hora_fin:
-            try:
-                # Intentar calcular diferencia (formato HH:MM:SS)
-                from datetime import datetime
-                inicio = datetime.strptime(hora_inicio, '%H:%M:%S')
-                fin = datetime.strptime(hora_fin, '%H:%M:%S')
-                diff = fin - inicio
-                duracion = str(int(diff.total_seconds() / 60))  # En minutos
-            except:
-                pass
+            duracion = duracion_minutos(hora_inicio, hora_fin)  # En minutos (formato HH:MM:SS)
         
-        estado = _first_no_empty(
-            cita.get('ESTADO'), cita.get('STATUS'), cita.get('ESTADO_CITA')
-        ).lower()
+        estado = c['estado'].lower()
         if 'confirm' in estado or 'realizad' in estado:
             status = "confirmed"
         elif 'cancel' in estado:
@@ -865,114 +1286,87 @@ def generar_citas(datos: Dict, output_path: Path, plantilla_path: Path) -> None:
         else:
             status = "pending"
         
-        row = {
-            "professional_name": _first_no_empty(cita.get('PROFESIONAL'), cita.get('DOCTOR'), cita.get('MEDICO')),
-            "client_name": nombre_completo,
-            "client_phone": telefono,
-            "service_name": _first_no_empty(cita.get('SERVICIO'), cita.get('TIPO_CITA'), cita.get('TRATAMIENTO')),
-            "date": formatear_fecha(fecha),
-            "start_time": formatear_hora(hora_inicio) or hora_inicio,
-            "end_time": formatear_hora(hora_fin) or hora_fin,
-            "duration": duracion or _first_no_empty(cita.get('DURACION'), cita.get('DURATION'), cita.get('MINUTOS')),
-            "status": status,
-            "notes": _first_no_empty(cita.get('NOTAS'), cita.get('OBSERVACIONES'), cita.get('NOTES')),
-            "modalidad": "presencial",
-        }
-        out_rows.append(row)
-    
-    _write_csv(output_path, headers, out_rows)
-    print(f"[OK] Generado {output_path} ({len(out_rows)} filas)")
+        row = (
+            c['profesional'],  # professional_name
+            nombre_completo,  # client_name
+            telefono,  # client_phone
+            c['servicio'],  # service_name
+            formatear_fecha(fecha),  # date
+            formatear_hora(hora_inicio) or hora_inicio,  # start_time
+            formatear_hora(hora_fin) or hora_fin,  # end_time
+            duracion or c['duracion'],  # duration
+            status,  # status
+            c['notas'],  # notes
+            "presencial",  # modalidad
+        )
+        yield row
+
+
+def generar_citas(datos: Dict, output_path: Path, plantilla_path: Path) -> None:
+    """Genera plantilla-citas.csv desde datos de CLINNI."""
+    headers = leer_cabeceras(plantilla_path)
+    filas = escribir_csv(output_path, headers, _filas_citas(datos), COLUMNAS_CITAS)
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
-# CLI
+# CONVERSIÓN DE UN ARCHIVO
 # ---------------------------------------------------------------------------
 
 
-def main(argv: Optional[List[str]] = None) -> None:
-    parser = argparse.ArgumentParser(
-        description=(
-            "Script genérico para mapear archivos de CLINNI hacia las plantillas "
-            "de bonos, clientes, historial y citas."
-        )
-    )
-    parser.add_argument(
-        "--input-file",
-        required=True,
-        help="Ruta al archivo de CLINNI (puede ser .gz, .json, .csv, .txt, .xml)",
-    )
-    parser.add_argument(
-        "--output-dir",
-        default=None,
-        help=(
-            "Carpeta donde se guardarán los CSV generados "
-            "(por defecto, la carpeta 'script' donde está este script)"
-        ),
-    )
-    parser.add_argument(
-        "--plantillas-dir",
-        default=None,
-        help=(
-            "Carpeta donde están las plantillas CSV "
-            "(por defecto, la raíz del proyecto)"
-        ),
-    )
-    parser.add_argument(
-        "--solo",
-        choices=[
-            "clientes_y_bonos",
-            "bonos",
-            "historial_basica",
-            "historial_completa",
-            "citas",
-        ],
-        help="Si se indica, solo genera ese tipo de plantilla.",
-    )
-    
-    args = parser.parse_args(argv)
-    
-    # Determinar rutas
+# Archivo de cada plantilla dentro de --plantillas-dir
+ARCHIVOS_PLANTILLA = {
+    "clientes_y_bonos": "plantilla_clientes_y_bonos.csv",
+    "bonos": "plantilla_bonos.csv",
+    "historial_basica": "plantilla_historial_basica.csv",
+    "historial_completa": "plantilla_historial_completa.csv",
+    "citas": "plantilla-citas.csv",
+}
+
+
+def _resolver_archivo(valor: str) -> Path:
+    """
+    Ruta de un archivo de entrada. Si es relativa y no existe desde el
+    directorio actual, se busca también desde la carpeta CLINNI y la raíz
+    del proyecto.
+    """
     script_dir = Path(__file__).parent
     proyecto_root = script_dir.parent.parent
     clinni_dir = script_dir.parent
     
-    input_file = Path(args.input_file)
+    input_file = Path(valor)
     if not input_file.is_absolute():
         # Buscar el archivo en varias ubicaciones
         if input_file.exists():
             pass  # Ya está bien
-        elif (clinni_dir / args.input_file).exists():
-            input_file = clinni_dir / args.input_file
-        elif (proyecto_root / "CLINNI" / args.input_file).exists():
-            input_file = proyecto_root / "CLINNI" / args.input_file
-        elif (proyecto_root / args.input_file).exists():
-            input_file = proyecto_root / args.input_file
-    
-    if not input_file.exists():
-        parser.error(f"El archivo no existe: {input_file}")
-    
-    if args.output_dir is None:
-        output_dir = script_dir
-    else:
-        output_dir = Path(args.output_dir)
-    
-    if args.plantillas_dir is None:
-        plantillas_dir = proyecto_root
-    else:
-        plantillas_dir = Path(args.plantillas_dir)
+        elif (clinni_dir / valor).exists():
+            input_file = clinni_dir / valor
+        elif (proyecto_root / "CLINNI" / valor).exists():
+            input_file = proyecto_root / "CLINNI" / valor
+        elif (proyecto_root / valor).exists():
+            input_file = proyecto_root / valor
+    return input_file
+
+
+def convertir_archivo(
+    input_file: Path,
+    args: argparse.Namespace,
+    output_dir: Path,
+    plantillas_dir: Path,
+    jobs: int,
+) -> None:
+    """Genera en output_dir las plantillas pedidas en 'args' a partir de un archivo de CLINNI."""
+    global DICCIONARIOS
+    # Cada archivo empieza con sus propios diccionarios de valores
+    DICCIONARIOS = Diccionarios()
+    fijar_entrada(input_file.name)
     
     # Rutas de plantillas
-    plantilla_clientes_y_bonos = plantillas_dir / "plantilla_clientes_y_bonos.csv"
-    plantilla_bonos = plantillas_dir / "plantilla_bonos.csv"
-    plantilla_historial_basica = plantillas_dir / "plantilla_historial_basica.csv"
-    plantilla_historial_completa = plantillas_dir / "plantilla_historial_completa.csv"
-    plantilla_citas = plantillas_dir / "plantilla-citas.csv"
-    
-    # Verificar que las plantillas existan
-    for p in [plantilla_clientes_y_bonos, plantilla_bonos, plantilla_historial_basica, 
-              plantilla_historial_completa, plantilla_citas]:
-        if not p.exists():
-            print(f"[AVISO] Plantilla no encontrada: {p}", file=sys.stderr)
+    plantilla_clientes_y_bonos = plantillas_dir / ARCHIVOS_PLANTILLA["clientes_y_bonos"]
+    plantilla_bonos = plantillas_dir / ARCHIVOS_PLANTILLA["bonos"]
+    plantilla_historial_basica = plantillas_dir / ARCHIVOS_PLANTILLA["historial_basica"]
+    plantilla_historial_completa = plantillas_dir / ARCHIVOS_PLANTILLA["historial_completa"]
+    plantilla_citas = plantillas_dir / ARCHIVOS_PLANTILLA["citas"]
     
     # Extraer sufijo del nombre del archivo
     file_suffix = _sanitize_filename(input_file.name)
@@ -981,13 +1375,19 @@ def main(argv: Optional[List[str]] = None) -> None:
     print(f"[INFO] Sufijo para archivos de salida: {file_suffix}")
     
     # Leer y estructurar datos
-    datos_estructurados = leer_archivo_clinni(input_file)
+    # Construir solo las colecciones que leen las plantillas a generar
+    plantillas = [args.solo] if args.solo else list(FUENTES_POR_PLANTILLA)
+    colecciones = {c for p in plantillas for c in FUENTES_POR_PLANTILLA[p]}
+    with etapa("carga"):
+        datos_estructurados = leer_archivo_clinni(
+            input_file, args.xml_parser, colecciones, json_workers=args.json_workers
+        )
     
     tasks = []
     
     def add_task(name: str, func):
         if args.solo is None or args.solo == name:
-            tasks.append(func)
+            tasks.append((name, func))
     
     add_task(
         "clientes_y_bonos",
@@ -1032,10 +1432,159 @@ def main(argv: Optional[List[str]] = None) -> None:
         )
         return
     
-    for t in tasks:
-        t()
+    ejecutar_tareas(tasks, jobs)
+    DICCIONARIOS.imprimir_resumen()
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+
+FUENTES_POR_PLANTILLA = {
+    "clientes_y_bonos": FUENTES_CLIENTES_Y_BONOS,
+    "bonos": FUENTES_BONOS,
+    "historial_basica": FUENTES_HISTORIAL_BASICA,
+    "historial_completa": FUENTES_HISTORIAL_COMPLETA,
+    "citas": FUENTES_CITAS,
+}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Script genérico para mapear archivos de CLINNI hacia las plantillas "
+            "de bonos, clientes, historial y citas."
+        )
+    )
+    parser.add_argument(
+        "--input-file",
+        required=True,
+        nargs="+",
+        help=(
+            "Ruta al archivo de CLINNI (puede ser .gz, .json, .csv, .txt, .xml). "
+            "Admite varios archivos, carpetas o patrones glob ('exports/*.gz'); "
+            "cada uno genera sus propias plantillas."
+        ),
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help=(
+            "Carpeta donde se guardarán los CSV generados "
+            "(por defecto, la carpeta 'script' donde está este script)"
+        ),
+    )
+    parser.add_argument(
+        "--plantillas-dir",
+        default=None,
+        help=(
+            "Carpeta donde están las plantillas CSV "
+            "(por defecto, la raíz del proyecto)"
+        ),
+    )
+    parser.add_argument(
+        "--solo",
+        choices=[
+            "clientes_y_bonos",
+            "bonos",
+            "historial_basica",
+            "historial_completa",
+            "citas",
+        ],
+        help="Si se indica, solo genera ese tipo de plantilla.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help=(
+            "Con un archivo, número de plantillas a generar en paralelo (procesos "
+            "hijos que comparten los datos ya cargados). Con varios, número de "
+            "archivos a convertir en paralelo, empezando por los más grandes. "
+            "Por defecto 1, en serie."
+        ),
+    )
+    parser.add_argument(
+        "--xml-parser",
+        choices=["regex", "iterparse"],
+        default="regex",
+        help=(
+            "Forma de leer archivos XML: 'regex' (por defecto, tolera XML mal formado) o "
+            "'iterparse' (parser XML incremental; resuelve entidades, CDATA, "
+            "atributos y espacios de nombres)."
+        ),
+    )
+    
+    parser.add_argument(
+        "--json-workers",
+        type=int,
+        default=1,
+        help=(
+            "Procesos para parsear un JSON grande: la lista de pacientes se divide "
+            "en trozos que se procesan en paralelo. Por defecto 1."
+        ),
+    )
+    anadir_opciones_comunes(
+        parser,
+        etapas=(
+            "detección de formato, lectura, aplanado, índices, "
+            "generación y escritura de cada plantilla"
+        ),
+        desborde="los índices de pacientes y bonos",
+    )
+    
+    args = parser.parse_args(argv)
+    comprobar_opciones_comunes(parser, args)
+    if args.json_workers < 1:
+        parser.error("--json-workers debe ser 1 o mayor")
+    
+    # Determinar rutas
+    script_dir = Path(__file__).parent
+    proyecto_root = script_dir.parent.parent
+    
+    try:
+        entradas = expandir_entradas(args.input_file, _resolver_archivo)
+        comprobar_sufijos(entradas, lambda p: _sanitize_filename(p.name))
+    except ValueError as e:
+        parser.error(str(e))
+    
+    if args.zip_output is not None:
+        output_dir = Path(args.zip_output)
+    elif args.output_dir is None:
+        output_dir = script_dir
+    else:
+        output_dir = Path(args.output_dir)
+    
+    if args.plantillas_dir is None:
+        plantillas_dir = proyecto_root
+    else:
+        plantillas_dir = Path(args.plantillas_dir)
     
-    print(f"\n[OK] Proceso completado. Archivos generados en: {output_dir}")
+    # Verificar que las plantillas existan
+    for nombre in ARCHIVOS_PLANTILLA.values():
+        if not (plantillas_dir / nombre).exists():
+            print(f"[AVISO] Plantilla no encontrada: {plantillas_dir / nombre}", file=sys.stderr)
+    
+    # Con varios archivos, --jobs reparte los archivos entre procesos y cada uno genera sus plantillas en serie
+    convertir = partial(
+        convertir_archivo, args=args, output_dir=output_dir, plantillas_dir=plantillas_dir,
+        jobs=args.jobs if len(entradas) == 1 else 1,
+    )
+    perfil = (
+        perfilar(Path(args.profile), Path(args.profile_pstats) if args.profile_pstats else None)
+        if args.profile is not None else nullcontext()
+    )
+    memoria = limitar_memoria(args.max_memory) if args.max_memory is not None else nullcontext()
+    eventos = eventos_por_stdout() if args.events == "jsonl" else nullcontext()
+    with eventos:
+        with perfil, memoria, SalidaZip(output_dir) if args.zip_output is not None else nullcontext():
+            if len(entradas) == 1:
+                convertir(entradas[0])
+            else:
+                convertir_en_lote(entradas, convertir, args.jobs)
+        
+        print(f"\n[OK] Proceso completado. Archivos generados en: {output_dir}")
 
 
 if __name__ == "__main__":
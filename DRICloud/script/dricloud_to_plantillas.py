@@ -11,12 +11,31 @@ Los CSV se generarán en la carpeta script con el nombre:
 - etc.
 """
 import argparse
-import csv
+import base64
+import hashlib
+import json
+import os
 import re
 import sys
+from contextlib import nullcontext
+from functools import partial
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional
-from collections import defaultdict
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# Utilidades compartidas entre conversores (carpeta comun/ en la raíz del proyecto)
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from comun.fechas import formatear_fecha, formatear_hora
+from comun.lotes import comprobar_sufijos, convertir_en_lote, ejecutar_tareas, expandir_entradas
+from comun.registros import Diccionarios, Registro, compactar
+from comun.eventos import eventos_por_stdout, evento, seguir_lectura
+from comun.memoria import diccionario, indexar, limitar_memoria, lista, multidiccionario
+from comun.perfil import etapa, fijar_entrada, perfilar, repartir_bucle
+from comun.opciones import anadir_opciones_comunes, comprobar_opciones_comunes
+from comun.salida_csv import SalidaZip, escribir_csv, leer_cabeceras
+from comun.xml_elementos import decodificar_elemento, iterar_elementos_iterparse, iterar_elementos_xml
 
 
 # ---------------------------------------------------------------------------
@@ -24,24 +43,6 @@ from collections import defaultdict
 # ---------------------------------------------------------------------------
 
 
-def _read_csv_headers(plantilla_path: Path) -> List[str]:
-    """Lee las cabeceras de una plantilla CSV."""
-    with plantilla_path.open("r", encoding="utf-8-sig", errors="replace") as f:
-        reader = csv.reader(f)
-        headers = next(reader)
-        return [h.strip() for h in headers if h.strip()]
-
-
-def _write_csv(path: Path, fieldnames: List[str], rows: Iterable[Dict[str, str]]) -> None:
-    """Escribe un CSV en UTF‑8 con BOM para que Excel lo abra bien."""
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8-sig", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow({k: row.get(k, "") for k in fieldnames})
-
-
 def _first_no_empty(*values: Optional[str]) -> str:
     """Devuelve el primer valor no vacío."""
     for v in values:
@@ -63,197 +64,331 @@ def _sanitize_filename(name: str) -> str:
     return name
 
 
-def formatear_fecha(fecha_str: str) -> str:
-    """Convierte fecha de formato XML a formato DD/MM/YYYY."""
-    if not fecha_str:
-        return ""
-    
-    # Intentar parsear formato ISO: 2019-03-15T14:30:00
-    match = re.match(r'(\d{4})-(\d{2})-(\d{2})', fecha_str)
-    if match:
-        return f"{match.group(3)}/{match.group(2)}/{match.group(1)}"
-    
-    return fecha_str
+# ---------------------------------------------------------------------------
+# Extracción de datos del XML
+# ---------------------------------------------------------------------------
 
 
-def formatear_fecha_hora(fecha_str: str) -> str:
-    """Convierte fecha/hora de formato XML a formato DD/MM/YYYY."""
-    if not fecha_str:
-        return ""
-    
-    match = re.match(r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})', fecha_str)
-    if match:
-        return f"{match.group(3)}/{match.group(2)}/{match.group(1)}"
-    
-    return formatear_fecha(fecha_str)
+# Tablas del XML que se cargan en memoria: tag -> (campo por el que se indexa,
+# mensaje de carga). Las tablas sin campo de indexado se guardan como lista.
+TABLAS_XML = {
+    'PACIENTE': ('PAC_ID', 'pacientes cargados'),
+    'PACIENTE_BONOS': (None, 'bonos cargados'),
+    'CITA_PACIENTE': (None, 'citas cargadas'),
+    'CITA_PACIENTE_CONSULTA': ('CPA_ID', 'consultas cargadas'),
+    'TURNO_CITA': ('TCO_ID', 'turnos cargados'),
+    'TIPO_CITA': ('TCI_ID', 'tipos de cita cargados'),
+    'USUARIO': ('USU_ID', 'usuarios cargados'),
+    'USUARIO_DOCTOR': ('USU_ID', 'doctores cargados'),
+    'TRATAMIENTO': ('TRA_ID', 'tratamientos cargados'),
+    'PACIENTE_DATOS_PREVIOS': ('PAC_ID', 'datos previos cargados'),
+}
+
+
+# Columnas a conservar de cada tabla (None = todas)
+Columnas = Dict[str, Optional[frozenset]]
 
+# Valores compartidos de las columnas con pocos valores distintos (ver _proyectar)
+DICCIONARIOS = Diccionarios()
+
+
+def _proyectar(campos: Dict[str, str], columnas: Optional[frozenset], tabla: Optional[str] = None) -> Registro:
+    """
+    Se queda solo con las columnas indicadas (None = todas) y guarda la fila
+    como Registro compacto, que es lo que reciben los generadores.
+    Si se indica la tabla, los valores repetidos de sus columnas con pocos
+    valores distintos se comparten (ver DICCIONARIOS).
+    """
+    if columnas is not None:
+        campos = {k: v for k, v in campos.items() if k in columnas}
+    if tabla is not None:
+        DICCIONARIOS.codificar(tabla, campos)
+    return compactar(campos)
 
-def formatear_hora(fecha_str: str) -> str:
-    """Extrae la hora de un datetime ISO."""
-    if not fecha_str:
-        return ""
+
+def _lista_tabla(tag: str) -> List[Registro]:
+    """Lista para los elementos de 'tag' (con límite de memoria, se puede indexar en disco por su clave)."""
+    clave = TABLAS_XML[tag][0] if tag in TABLAS_XML else None
+    return lista(tag, clave)
+
+
+def extraer_tablas_xml(
+    xml_path: Path,
+    tag_names: Iterable[str],
+    parser: str = "regex",
+    columnas: Optional[Columnas] = None,
+) -> Dict[str, List[Registro]]:
+    """
+    Extrae en una sola pasada todos los elementos de varios tags del XML.
+    Retorna un diccionario tag -> lista de Registro con los campos de cada elemento.
+    Si se indica 'columnas', de cada tag solo se conservan esas columnas.
     
-    match = re.match(r'\d{4}-\d{2}-\d{2}T(\d{2}):(\d{2}):(\d{2})', fecha_str)
-    if match:
-        return f"{match.group(1)}:{match.group(2)}:00"
+    parser:
+    - 'regex': busca los elementos con expresiones regulares (ver iterar_elementos_xml);
+      tolera XML mal formado.
+    - 'iterparse': usa un parser XML incremental (ver iterar_elementos_iterparse).
+    """
+    tags = list(tag_names)
+    elementos: Dict[str, List[Registro]] = {tag: _lista_tabla(tag) for tag in tags}
+    columnas = columnas or {}
     
-    return ""
+    if parser == "iterparse":
+        try:
+            filas = seguir_lectura(
+                iterar_elementos_iterparse(xml_path, tags), xml_path.name, xml_path.stat().st_size,
+                tabla=itemgetter(0),
+            )
+            for tag, campos in repartir_bucle(filas, "carga", itemgetter(0)):
+                elementos[tag].append(_proyectar(campos, columnas.get(tag), tag))
+        except Exception as e:
+            print(f"[ERROR] Error leyendo XML: {e}", file=sys.stderr)
+        return elementos
+    
+    try:
+        filas = seguir_lectura(
+            iterar_elementos_xml(xml_path, tags), xml_path.name, xml_path.stat().st_size,
+            posicion=itemgetter(2), tabla=itemgetter(0),
+        )
+        for tag, _inicio, _fin, campos in repartir_bucle(filas, "carga", itemgetter(0)):
+            elementos[tag].append(_proyectar(campos, columnas.get(tag), tag))
+    except Exception as e:
+        print(f"[ERROR] Error leyendo XML: {e}", file=sys.stderr)
+    
+    return elementos
+
+
+def extraer_elementos_xml(xml_path: Path, tag_name: str, parser: str = "regex") -> List[Registro]:
+    """
+    Extrae todos los elementos de un tag del XML.
+    Retorna una lista de Registro con los campos de cada elemento.
+    """
+    return extraer_tablas_xml(xml_path, [tag_name], parser)[tag_name]
 
 
 # ---------------------------------------------------------------------------
-# Extracción de datos del XML
+# Índice de offsets del XML
 # ---------------------------------------------------------------------------
 
 
-def extraer_elementos_xml(xml_path: Path, tag_name: str) -> List[Dict[str, str]]:
+INDICE_VERSION = 1
+# Bytes del principio y del final del XML que entran en el hash de la firma
+INDICE_MUESTRA_HASH = 1024 * 1024
+# Tamaño mínimo de cada lectura al cargar elementos desde el índice
+INDICE_BLOQUE_LECTURA = 4 * 1024 * 1024
+
+
+def _ruta_indice(xml_path: Path) -> Path:
+    """Ruta del índice que acompaña al XML (ej: 'Completa_2536.xml.indice.json')."""
+    return xml_path.with_name(xml_path.name + ".indice.json")
+
+
+def _firma_xml(xml_path: Path) -> Dict:
     """
-    Extrae todos los elementos de un tag del XML usando regex.
-    Retorna una lista de diccionarios con los campos de cada elemento.
+    Firma con la que se valida que el índice corresponde al XML: tamaño, mtime y
+    un hash SHA-1 del primer y último MB (hashear el archivo entero costaría
+    una lectura completa, que es justo lo que el índice quiere evitar).
     """
-    elementos = []
-    pattern = re.compile(
-        rf'<{re.escape(tag_name)}>(.*?)</{re.escape(tag_name)}>',
-        re.DOTALL | re.IGNORECASE
-    )
+    stat = xml_path.stat()
+    h = hashlib.sha1()
+    with xml_path.open('rb') as f:
+        h.update(f.read(INDICE_MUESTRA_HASH))
+        if stat.st_size > INDICE_MUESTRA_HASH:
+            f.seek(max(INDICE_MUESTRA_HASH, stat.st_size - INDICE_MUESTRA_HASH))
+            h.update(f.read())
+    return {"tamano": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": h.hexdigest()}
+
+
+def cargar_indice_xml(xml_path: Path) -> Optional[Dict[str, array]]:
+    """
+    Lee el índice del XML si existe y sigue siendo válido.
+    Retorna un dict tag -> array plano [inicio0, fin0, inicio1, fin1, ...] o None.
+    """
+    ruta = _ruta_indice(xml_path)
+    if not ruta.exists():
+        return None
+    try:
+        with ruta.open('r', encoding='utf-8') as f:
+            indice = json.load(f)
+        if (
+            indice.get("version") != INDICE_VERSION
+            or indice.get("byteorder") != sys.byteorder
+            or indice.get("firma") != _firma_xml(xml_path)
+        ):
+            print(f"[INFO] Índice desactualizado, se regenerará: {ruta.name}")
+            return None
+        rangos = {}
+        for tag, datos in indice["tablas"].items():
+            offsets = array('q')
+            offsets.frombytes(base64.b64decode(datos))
+            rangos[tag] = offsets
+        return rangos
+    except Exception as e:
+        print(f"[AVISO] No se pudo leer el índice {ruta}: {e}", file=sys.stderr)
+        return None
+
+
+def guardar_indice_xml(xml_path: Path, rangos: Dict[str, array]) -> None:
+    """Guarda junto al XML los rangos de bytes de los elementos de cada tag."""
+    ruta = _ruta_indice(xml_path)
+    indice = {
+        "version": INDICE_VERSION,
+        "byteorder": sys.byteorder,
+        "firma": _firma_xml(xml_path),
+        "tablas": {
+            tag: base64.b64encode(offsets.tobytes()).decode('ascii')
+            for tag, offsets in rangos.items()
+        },
+    }
+    try:
+        with ruta.open('w', encoding='utf-8') as f:
+            json.dump(indice, f)
+        print(f"[INFO] Índice guardado en: {ruta}")
+    except OSError as e:
+        print(f"[AVISO] No se pudo guardar el índice {ruta}: {e}", file=sys.stderr)
+
+
+def leer_elementos_indexados(
+    xml_path: Path, offsets: array, columnas: Optional[frozenset] = None, tabla: Optional[str] = None
+) -> List[Registro]:
+    """
+    Decodifica los elementos cuyos rangos de bytes están en 'offsets'
+    (conservando solo 'columnas', si se indican; 'tabla' como en _proyectar).
+    Los rangos vienen en orden de archivo, así que se leen en bloques grandes
+    consecutivos en lugar de hacer un seek por elemento.
+    """
+    elementos = _lista_tabla(tabla) if tabla is not None else lista(xml_path.name)
+    bloque = b""
+    bloque_inicio = 0
+    with xml_path.open('rb') as f:
+        for i in range(0, len(offsets), 2):
+            inicio, fin = offsets[i], offsets[i + 1]
+            if inicio < bloque_inicio or fin > bloque_inicio + len(bloque):
+                f.seek(inicio)
+                bloque = f.read(max(INDICE_BLOQUE_LECTURA, fin - inicio))
+                bloque_inicio = inicio
+            campos = decodificar_elemento(bloque[inicio - bloque_inicio:fin - bloque_inicio])
+            elementos.append(_proyectar(campos, columnas, tabla))
+    return elementos
+
+
+def _extraer_tablas_con_indice(xml_path: Path, columnas: Columnas) -> Dict[str, List[Registro]]:
+    """
+    Extrae los elementos de los tags pedidos (las claves de 'columnas') usando
+    el índice del XML. Si no hay índice válido, recorre el XML una vez (para
+    todas las tablas de TABLAS_XML), guarda el índice y se queda solo con los
+    tags pedidos. Si la carpeta del XML no admite escritura, avisa y lee solo
+    los tags pedidos, sin índice.
+    """
+    with etapa("lectura del indice"):
+        rangos = cargar_indice_xml(xml_path)
+    if rangos is not None and all(tag in rangos for tag in columnas):
+        print(f"[INFO] Usando índice: {_ruta_indice(xml_path).name}")
+        elementos = {}
+        for tag, cols in columnas.items():
+            with etapa(f"carga {tag}") as e:
+                elementos[tag] = leer_elementos_indexados(xml_path, rangos[tag], cols, tag)
+                e["filas"] = len(elementos[tag])
+            evento(
+                "lectura", archivo=xml_path.name,
+                registros={t: len(v) for t, v in elementos.items()}, terminado=False,
+            )
+        return elementos
     
-    chunk_size = 10 * 1024 * 1024  # 10MB chunks
-    buffer = ""
+    if not os.access(xml_path.parent, os.W_OK):
+        print(
+            f"[AVISO] No se puede escribir en {xml_path.parent}; se convierte sin índice.",
+            file=sys.stderr,
+        )
+        return extraer_tablas_xml(xml_path, list(columnas), "regex", columnas)
     
+    elementos: Dict[str, List[Registro]] = {tag: _lista_tabla(tag) for tag in columnas}
+    rangos = {tag: array('q') for tag in TABLAS_XML}
     try:
-        with xml_path.open('r', encoding='utf-8', errors='replace') as f:
-            while True:
-                chunk = f.read(chunk_size)
-                if not chunk:
-                    break
-                
-                buffer += chunk
-                
-                # Buscar matches en el buffer
-                matches = list(pattern.finditer(buffer))
-                for match in matches:
-                    contenido = match.group(1)
-                    
-                    # Extraer campos (sub-elementos)
-                    campos_pattern = re.compile(r'<([A-Z_][A-Z0-9_]*)>(.*?)</\1>', re.DOTALL)
-                    campos = {}
-                    for campo_match in campos_pattern.finditer(contenido):
-                        campo_nombre = campo_match.group(1)
-                        campo_valor = campo_match.group(2).strip()
-                        campos[campo_nombre] = campo_valor
-                    
-                    if campos:  # Solo agregar si tiene campos
-                        elementos.append(campos)
-                
-                # Mantener solo el último 1MB del buffer para el siguiente chunk
-                if len(buffer) > 1024 * 1024:
-                    buffer = buffer[-1024 * 1024:]
+        filas = seguir_lectura(
+            iterar_elementos_xml(xml_path, TABLAS_XML.keys()), xml_path.name, xml_path.stat().st_size,
+            posicion=itemgetter(2), tabla=itemgetter(0),
+        )
+        for tag, inicio, fin, campos in repartir_bucle(filas, "carga", itemgetter(0)):
+            rangos[tag].append(inicio)
+            rangos[tag].append(fin)
+            if tag in elementos:
+                elementos[tag].append(_proyectar(campos, columnas[tag], tag))
     except Exception as e:
         print(f"[ERROR] Error leyendo XML: {e}", file=sys.stderr)
+        return elementos
     
+    with etapa("escritura del indice"):
+        guardar_indice_xml(xml_path, rangos)
     return elementos
 
 
-def cargar_tablas_relacionadas(xml_path: Path) -> Dict:
+def unir_fuentes(*fuentes: Dict[str, Optional[Iterable[str]]]) -> Dict[str, Optional[frozenset]]:
+    """
+    Une las declaraciones FUENTES_* de varias plantillas: para cada tabla, la
+    unión de sus columnas (None si alguna plantilla necesita todas).
     """
-    Carga todas las tablas necesarias en memoria para hacer joins.
+    union: Dict[str, Optional[frozenset]] = {}
+    for f in fuentes:
+        for tag, cols in f.items():
+            if cols is None or (tag in union and union[tag] is None):
+                union[tag] = None
+            else:
+                union[tag] = union.get(tag, frozenset()) | frozenset(cols)
+    return union
+
+
+def cargar_tablas_relacionadas(
+    xml_path: Path,
+    parser: str = "regex",
+    fuentes: Optional[Dict[str, Optional[Iterable[str]]]] = None,
+    usar_indice: bool = False,
+) -> Dict:
+    """
+    Carga las tablas necesarias en memoria para hacer joins.
     Retorna un diccionario con las tablas indexadas por ID.
+    
+    - fuentes: tablas y columnas a cargar, tal como las declaran las plantillas
+      (ver FUENTES_* y unir_fuentes). Por defecto, todas las tablas de
+      TABLAS_XML con todas sus columnas. Las tablas no pedidas quedan vacías.
+    - usar_indice: con parser 'regex', lee y mantiene el índice de offsets que
+      se guarda junto al XML, para decodificar solo las tablas pedidas.
+    
+    El XML se recorre como mucho una vez y cada elemento se reparte a su tabla.
     """
     print("[INFO] Cargando tablas relacionadas del XML...")
     
-    tablas = {
-        'PACIENTE': {},
-        'PACIENTE_BONOS': [],
-        'CITA_PACIENTE': [],
-        'CITA_PACIENTE_CONSULTA': {},
-        'TURNO_CITA': {},
-        'TIPO_CITA': {},
-        'USUARIO': {},
-        'USUARIO_DOCTOR': {},
-        'TRATAMIENTO': {},
-        'PACIENTE_DATOS_PREVIOS': {},
-    }
+    if fuentes is None:
+        fuentes = {tag: None for tag in TABLAS_XML}
+    columnas: Columnas = {}
+    for tag, (clave, _descripcion) in TABLAS_XML.items():
+        if tag not in fuentes:
+            continue
+        cols = fuentes[tag]
+        if cols is not None:
+            cols = frozenset(cols)
+            if clave:
+                # El campo por el que se indexa la tabla siempre se conserva
+                cols = cols | {clave}
+        columnas[tag] = cols
+    tags_cargar = list(columnas)
     
-    # Cargar PACIENTE (indexado por PAC_ID)
-    print("  Cargando PACIENTE...")
-    pacientes = extraer_elementos_xml(xml_path, "PACIENTE")
-    for p in pacientes:
-        pac_id = p.get("PAC_ID", "")
-        if pac_id:
-            tablas['PACIENTE'][pac_id] = p
-    print(f"    {len(tablas['PACIENTE'])} pacientes cargados")
-    
-    # Cargar PACIENTE_BONOS (lista)
-    print("  Cargando PACIENTE_BONOS...")
-    tablas['PACIENTE_BONOS'] = extraer_elementos_xml(xml_path, "PACIENTE_BONOS")
-    print(f"    {len(tablas['PACIENTE_BONOS'])} bonos cargados")
-    
-    # Cargar CITA_PACIENTE (lista)
-    print("  Cargando CITA_PACIENTE...")
-    tablas['CITA_PACIENTE'] = extraer_elementos_xml(xml_path, "CITA_PACIENTE")
-    print(f"    {len(tablas['CITA_PACIENTE'])} citas cargadas")
-    
-    # Cargar CITA_PACIENTE_CONSULTA (indexado por CPA_ID)
-    print("  Cargando CITA_PACIENTE_CONSULTA...")
-    consultas = extraer_elementos_xml(xml_path, "CITA_PACIENTE_CONSULTA")
-    for c in consultas:
-        cpa_id = c.get("CPA_ID", "")
-        if cpa_id:
-            tablas['CITA_PACIENTE_CONSULTA'][cpa_id] = c
-    print(f"    {len(tablas['CITA_PACIENTE_CONSULTA'])} consultas cargadas")
-    
-    # Cargar TURNO_CITA (indexado por TCO_ID)
-    print("  Cargando TURNO_CITA...")
-    turnos = extraer_elementos_xml(xml_path, "TURNO_CITA")
-    for t in turnos:
-        tco_id = t.get("TCO_ID", "")
-        if tco_id:
-            tablas['TURNO_CITA'][tco_id] = t
-    print(f"    {len(tablas['TURNO_CITA'])} turnos cargados")
-    
-    # Cargar TIPO_CITA (indexado por TCI_ID)
-    print("  Cargando TIPO_CITA...")
-    tipos = extraer_elementos_xml(xml_path, "TIPO_CITA")
-    for t in tipos:
-        tci_id = t.get("TCI_ID", "")
-        if tci_id:
-            tablas['TIPO_CITA'][tci_id] = t
-    print(f"    {len(tablas['TIPO_CITA'])} tipos de cita cargados")
-    
-    # Cargar USUARIO (indexado por USU_ID)
-    print("  Cargando USUARIO...")
-    usuarios = extraer_elementos_xml(xml_path, "USUARIO")
-    for u in usuarios:
-        usu_id = u.get("USU_ID", "")
-        if usu_id:
-            tablas['USUARIO'][usu_id] = u
-    print(f"    {len(tablas['USUARIO'])} usuarios cargados")
-    
-    # Cargar USUARIO_DOCTOR (indexado por USU_ID)
-    print("  Cargando USUARIO_DOCTOR...")
-    doctores = extraer_elementos_xml(xml_path, "USUARIO_DOCTOR")
-    for d in doctores:
-        usu_id = d.get("USU_ID", "")
-        if usu_id:
-            tablas['USUARIO_DOCTOR'][usu_id] = d
-    print(f"    {len(tablas['USUARIO_DOCTOR'])} doctores cargados")
-    
-    # Cargar TRATAMIENTO (indexado por TRA_ID)
-    print("  Cargando TRATAMIENTO...")
-    tratamientos = extraer_elementos_xml(xml_path, "TRATAMIENTO")
-    for t in tratamientos:
-        tra_id = t.get("TRA_ID", "")
-        if tra_id:
-            tablas['TRATAMIENTO'][tra_id] = t
-    print(f"    {len(tablas['TRATAMIENTO'])} tratamientos cargados")
-    
-    # Cargar PACIENTE_DATOS_PREVIOS (indexado por PAC_ID)
-    print("  Cargando PACIENTE_DATOS_PREVIOS...")
-    datos_previos = extraer_elementos_xml(xml_path, "PACIENTE_DATOS_PREVIOS")
-    for d in datos_previos:
-        pac_id = d.get("PAC_ID", "")
-        if pac_id:
-            tablas['PACIENTE_DATOS_PREVIOS'][pac_id] = d
-    print(f"    {len(tablas['PACIENTE_DATOS_PREVIOS'])} datos previos cargados")
+    if usar_indice and parser == "regex":
+        elementos = _extraer_tablas_con_indice(xml_path, columnas)
+    else:
+        elementos = extraer_tablas_xml(xml_path, tags_cargar, parser, columnas)
+    
+    tablas: Dict = {}
+    for tag, (clave, descripcion) in TABLAS_XML.items():
+        if clave is None:
+            tablas[tag] = elementos.get(tag, [])
+        else:
+            with etapa(f"indice {tag}") if tag in tags_cargar else nullcontext({}) as registro:
+                indexada = indexar(elementos.get(tag, []), clave)
+                tablas[tag] = indexada
+                registro["filas"] = len(indexada)
+        if tag in tags_cargar:
+            print(f"  {tag}: {len(tablas[tag])} {descripcion}")
+    evento("carga", archivo=xml_path.name, registros={tag: len(tablas[tag]) for tag in tags_cargar})
     
     return tablas
 
@@ -294,20 +429,61 @@ def calcular_sesiones_consumidas(bono: Dict) -> str:
 # ---------------------------------------------------------------------------
 
 
-def generar_clientes_y_bonos(xml_path: Path, tablas: Dict, output_path: Path, plantilla_path: Path) -> None:
-    """Genera plantilla_clientes_y_bonos.csv desde XML de DRICloud."""
-    headers = _read_csv_headers(plantilla_path)
+# Tablas y columnas del XML que lee esta plantilla (None = todas las columnas;
+# calcular_sesiones_consumidas recorre todas las del bono)
+FUENTES_CLIENTES_Y_BONOS = {
+    'PACIENTE': (
+        'PAC_ID', 'PAC_NOMBRE', 'PAC_APELLIDOS', 'PAC_TELEFONO1', 'PAC_NIF',
+        'PAC_DIRECCION', 'PAC_COD_POSTAL', 'PAC_POBLACION', 'PAC_PROVINCIA',
+        'PAC_PAIS', 'PAC_EMAIL', 'PAC_FECHA_NACIMIENTO', 'SEX_ID', 'PAC_ANOTACIONES',
+    ),
+    'PACIENTE_BONOS': None,
+}
+
+
+# Columnas de las filas que emite generar_clientes_y_bonos, en el orden de la plantilla
+COLUMNAS_CLIENTES_Y_BONOS = (
+    "Nombre",
+    "Apellidos",
+    "CIF/NIF",
+    "Direccion",
+    "Codigo Postal",
+    "Ciudad",
+    "Provincia",
+    "Pais",
+    "Email",
+    "Telefono",
+    "Tipo Cliente",
+    "Fecha Nacimiento",
+    "Genero",
+    "Notas Medicas",
+    "Fecha seguimiento",
+    "Tipo seguimiento",
+    "Descripción",
+    "Recomendaciones",
+    "Nombre Bono",
+    "Servicio",
+    "Precio",
+    "Sesiones Totales",
+    "Sesiones Consumidas",
+    "Fecha Caducidad",
+    "Notas Bono",
+)
+
+
+def _filas_clientes_y_bonos(tablas: Dict) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla_clientes_y_bonos.csv, en el orden de COLUMNAS_CLIENTES_Y_BONOS."""
     pacientes = tablas['PACIENTE']
     bonos = tablas['PACIENTE_BONOS']
     
-    rows_out: List[Dict[str, str]] = []
-    
     # Crear un índice de bonos por PAC_ID
-    bonos_por_paciente = defaultdict(list)
-    for b in bonos:
-        pac_id = b.get("PAC_ID", "")
-        if pac_id:
-            bonos_por_paciente[pac_id].append(b)
+    with etapa("indice bonos_por_paciente") as e:
+        bonos_por_paciente = multidiccionario("bonos_por_paciente")
+        for b in bonos:
+            pac_id = b.get("PAC_ID", "")
+            if pac_id:
+                bonos_por_paciente[pac_id].append(b)
+        e["filas"] = len(bonos_por_paciente)
     
     # Generar una fila por cada paciente (con su primer bono si tiene)
     for pac_id, paciente in pacientes.items():
@@ -318,37 +494,41 @@ def generar_clientes_y_bonos(xml_path: Path, tablas: Dict, output_path: Path, pl
         apellidos = paciente.get("PAC_APELLIDOS", "")
         telefono = paciente.get("PAC_TELEFONO1", "")
         
-        row = {
-            "Nombre": nombre,
-            "Apellidos": apellidos,
-            "CIF/NIF": paciente.get("PAC_NIF", ""),
-            "Direccion": paciente.get("PAC_DIRECCION", ""),
-            "Codigo Postal": paciente.get("PAC_COD_POSTAL", ""),
-            "Ciudad": paciente.get("PAC_POBLACION", ""),
-            "Provincia": paciente.get("PAC_PROVINCIA", ""),
-            "Pais": paciente.get("PAC_PAIS", ""),
-            "Email": paciente.get("PAC_EMAIL", ""),
-            "Telefono": telefono,
-            "Tipo Cliente": "",
-            "Fecha Nacimiento": formatear_fecha(paciente.get("PAC_FECHA_NACIMIENTO", "")),
-            "Genero": "male" if paciente.get("SEX_ID") == "1" else "female" if paciente.get("SEX_ID") == "2" else "",
-            "Notas Medicas": paciente.get("PAC_ANOTACIONES", ""),
-            "Fecha seguimiento": "",
-            "Tipo seguimiento": "",
-            "Descripción": "",
-            "Recomendaciones": "",
-            "Nombre Bono": bono.get("PAC_BON_CABECERA", ""),
-            "Servicio": "",
-            "Precio": bono.get("PAC_BON_PRECIO", ""),
-            "Sesiones Totales": bono.get("PAC_BON_NUM_SESIONES", ""),
-            "Sesiones Consumidas": calcular_sesiones_consumidas(bono),
-            "Fecha Caducidad": formatear_fecha(bono.get("PAC_BON_FECHA_VENCIMIENTO", "")),
-            "Notas Bono": bono.get("PAC_BON_CONDICIONES", ""),
-        }
-        rows_out.append(row)
-    
-    _write_csv(output_path, headers, rows_out)
-    print(f"[OK] Generado {output_path} ({len(rows_out)} filas)")
+        row = (
+            nombre,  # Nombre
+            apellidos,  # Apellidos
+            paciente.get("PAC_NIF", ""),  # CIF/NIF
+            paciente.get("PAC_DIRECCION", ""),  # Direccion
+            paciente.get("PAC_COD_POSTAL", ""),  # Codigo Postal
+            paciente.get("PAC_POBLACION", ""),  # Ciudad
+            paciente.get("PAC_PROVINCIA", ""),  # Provincia
+            paciente.get("PAC_PAIS", ""),  # Pais
+            paciente.get("PAC_EMAIL", ""),  # Email
+            telefono,  # Telefono
+            "",  # Tipo Cliente
+            formatear_fecha(paciente.get("PAC_FECHA_NACIMIENTO", "")),  # Fecha Nacimiento
+            "male" if paciente.get("SEX_ID") == "1" else "female" if paciente.get("SEX_ID") == "2" else "",  # Genero
+            paciente.get("PAC_ANOTACIONES", ""),  # Notas Medicas
+            "",  # Fecha seguimiento
+            "",  # Tipo seguimiento
+            "",  # Descripción
+            "",  # Recomendaciones
+            bono.get("PAC_BON_CABECERA", ""),  # Nombre Bono
+            "",  # Servicio
+            bono.get("PAC_BON_PRECIO", ""),  # Precio
+            bono.get("PAC_BON_NUM_SESIONES", ""),  # Sesiones Totales
+            calcular_sesiones_consumidas(bono),  # Sesiones Consumidas
+            formatear_fecha(bono.get("PAC_BON_FECHA_VENCIMIENTO", "")),  # Fecha Caducidad
+            bono.get("PAC_BON_CONDICIONES", ""),  # Notas Bono
+        )
+        yield row
+
+
+def generar_clientes_y_bonos(xml_path: Path, tablas: Dict, output_path: Path, plantilla_path: Path) -> None:
+    """Genera plantilla_clientes_y_bonos.csv desde XML de DRICloud."""
+    headers = leer_cabeceras(plantilla_path)
+    filas = escribir_csv(output_path, headers, _filas_clientes_y_bonos(tablas), COLUMNAS_CLIENTES_Y_BONOS)
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
@@ -356,14 +536,32 @@ def generar_clientes_y_bonos(xml_path: Path, tablas: Dict, output_path: Path, pl
 # ---------------------------------------------------------------------------
 
 
-def generar_bonos(xml_path: Path, tablas: Dict, output_path: Path, plantilla_path: Path) -> None:
-    """Genera plantilla_bonos.csv desde XML de DRICloud."""
-    headers = _read_csv_headers(plantilla_path)
+FUENTES_BONOS = {
+    'PACIENTE': ('PAC_ID', 'PAC_NOMBRE', 'PAC_APELLIDOS', 'PAC_TELEFONO1'),
+    'PACIENTE_BONOS': None,
+}
+
+
+# Columnas de las filas que emite generar_bonos, en el orden de la plantilla
+COLUMNAS_BONOS = (
+    "Teléfono",
+    "Nombre Cliente",
+    "Nombre Bono",
+    "Servicio",
+    "Sesiones Totales",
+    "Sesiones Consumidas",
+    "Precio Total",
+    "Pagado",
+    "Importe Pagado",
+    "Fecha Caducidad",
+)
+
+
+def _filas_bonos(tablas: Dict) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla_bonos.csv, en el orden de COLUMNAS_BONOS."""
     pacientes = tablas['PACIENTE']
     bonos = tablas['PACIENTE_BONOS']
     
-    out_rows: List[Dict[str, str]] = []
-    
     for b in bonos:
         pac_id = b.get("PAC_ID", "")
         paciente = pacientes.get(pac_id, {})
@@ -387,22 +585,26 @@ def generar_bonos(xml_path: Path, tablas: Dict, output_path: Path, plantilla_pat
             pagado_str = ""
             importe_pagado = ""
         
-        row = {
-            "Teléfono": telefono,
-            "Nombre Cliente": f"{nombre} {apellidos}".strip(),
-            "Nombre Bono": b.get("PAC_BON_CABECERA", ""),
-            "Servicio": "",
-            "Sesiones Totales": b.get("PAC_BON_NUM_SESIONES", ""),
-            "Sesiones Consumidas": calcular_sesiones_consumidas(b),
-            "Precio Total": precio,
-            "Pagado": pagado_str,
-            "Importe Pagado": importe_pagado,
-            "Fecha Caducidad": formatear_fecha(b.get("PAC_BON_FECHA_VENCIMIENTO", "")),
-        }
-        out_rows.append(row)
-    
-    _write_csv(output_path, headers, out_rows)
-    print(f"[OK] Generado {output_path} ({len(out_rows)} filas)")
+        row = (
+            telefono,  # Teléfono
+            f"{nombre} {apellidos}".strip(),  # Nombre Cliente
+            b.get("PAC_BON_CABECERA", ""),  # Nombre Bono
+            "",  # Servicio
+            b.get("PAC_BON_NUM_SESIONES", ""),  # Sesiones Totales
+            calcular_sesiones_consumidas(b),  # Sesiones Consumidas
+            precio,  # Precio Total
+            pagado_str,  # Pagado
+            importe_pagado,  # Importe Pagado
+            formatear_fecha(b.get("PAC_BON_FECHA_VENCIMIENTO", "")),  # Fecha Caducidad
+        )
+        yield row
+
+
+def generar_bonos(xml_path: Path, tablas: Dict, output_path: Path, plantilla_path: Path) -> None:
+    """Genera plantilla_bonos.csv desde XML de DRICloud."""
+    headers = leer_cabeceras(plantilla_path)
+    filas = escribir_csv(output_path, headers, _filas_bonos(tablas), COLUMNAS_BONOS)
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
@@ -410,21 +612,43 @@ def generar_bonos(xml_path: Path, tablas: Dict, output_path: Path, plantilla_pat
 # ---------------------------------------------------------------------------
 
 
-def generar_historial_basica(xml_path: Path, tablas: Dict, output_path: Path, plantilla_path: Path) -> None:
-    """Genera plantilla_historial_basica.csv desde XML de DRICloud."""
-    headers = _read_csv_headers(plantilla_path)
+FUENTES_HISTORIAL_BASICA = {
+    'PACIENTE': ('PAC_ID', 'PAC_TELEFONO1'),
+    'CITA_PACIENTE': ('CPA_ID', 'PAC_ID'),
+    'CITA_PACIENTE_CONSULTA': ('CPA_ID', 'CPA_DIAGNOSTICO', 'CPA_NOTAS_ODONTOGRAMA'),
+}
+
+
+# Columnas de las filas que emite generar_historial_basica, en el orden de la plantilla
+COLUMNAS_HISTORIAL_BASICA = (
+    "Teléfono",
+    "Profesional",
+    "Motivo Consulta",
+    "Tiempo Evolución",
+    "Descripción Detallada",
+    "Enfermedades Crónicas",
+    "Alergias Medicamentosas",
+    "Medicación Habitual",
+    "Diagnóstico",
+    "Recomendaciones",
+    "Observaciones",
+)
+
+
+def _filas_historial_basica(tablas: Dict) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla_historial_basica.csv, en el orden de COLUMNAS_HISTORIAL_BASICA."""
     pacientes = tablas['PACIENTE']
     consultas = tablas['CITA_PACIENTE_CONSULTA']
     citas = tablas['CITA_PACIENTE']
     
     # Crear índice de citas por CPA_ID
-    citas_por_consulta = {}
-    for cita in citas:
-        cpa_id = cita.get("CPA_ID", "")
-        if cpa_id:
-            citas_por_consulta[cpa_id] = cita
-    
-    out_rows: List[Dict[str, str]] = []
+    with etapa("indice citas_por_consulta") as e:
+        citas_por_consulta = diccionario("citas_por_consulta")
+        for cita in citas:
+            cpa_id = cita.get("CPA_ID", "")
+            if cpa_id:
+                citas_por_consulta[cpa_id] = cita
+        e["filas"] = len(citas_por_consulta)
     
     for cpa_id, consulta in consultas.items():
         cita = citas_por_consulta.get(cpa_id, {})
@@ -433,23 +657,27 @@ def generar_historial_basica(xml_path: Path, tablas: Dict, output_path: Path, pl
         
         telefono = paciente.get("PAC_TELEFONO1", "")
         
-        row = {
-            "Teléfono": telefono,
-            "Profesional": "",
-            "Motivo Consulta": "",
-            "Tiempo Evolución": "",
-            "Descripción Detallada": consulta.get("CPA_DIAGNOSTICO", ""),
-            "Enfermedades Crónicas": "",
-            "Alergias Medicamentosas": "",
-            "Medicación Habitual": "",
-            "Diagnóstico": consulta.get("CPA_DIAGNOSTICO", ""),
-            "Recomendaciones": "",
-            "Observaciones": consulta.get("CPA_NOTAS_ODONTOGRAMA", ""),
-        }
-        out_rows.append(row)
-    
-    _write_csv(output_path, headers, out_rows)
-    print(f"[OK] Generado {output_path} ({len(out_rows)} filas)")
+        row = (
+            telefono,  # Teléfono
+            "",  # Profesional
+            "",  # Motivo Consulta
+            "",  # Tiempo Evolución
+            consulta.get("CPA_DIAGNOSTICO", ""),  # Descripción Detallada
+            "",  # Enfermedades Crónicas
+            "",  # Alergias Medicamentosas
+            "",  # Medicación Habitual
+            consulta.get("CPA_DIAGNOSTICO", ""),  # Diagnóstico
+            "",  # Recomendaciones
+            consulta.get("CPA_NOTAS_ODONTOGRAMA", ""),  # Observaciones
+        )
+        yield row
+
+
+def generar_historial_basica(xml_path: Path, tablas: Dict, output_path: Path, plantilla_path: Path) -> None:
+    """Genera plantilla_historial_basica.csv desde XML de DRICloud."""
+    headers = leer_cabeceras(plantilla_path)
+    filas = escribir_csv(output_path, headers, _filas_historial_basica(tablas), COLUMNAS_HISTORIAL_BASICA)
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
@@ -457,21 +685,38 @@ def generar_historial_basica(xml_path: Path, tablas: Dict, output_path: Path, pl
 # ---------------------------------------------------------------------------
 
 
-def generar_historial_completa(xml_path: Path, tablas: Dict, output_path: Path, plantilla_path: Path) -> None:
-    """Genera plantilla_historial_completa.csv desde XML de DRICloud."""
-    headers = _read_csv_headers(plantilla_path)
+FUENTES_HISTORIAL_COMPLETA = {
+    'PACIENTE': ('PAC_ID', 'PAC_TELEFONO1'),
+    'CITA_PACIENTE': ('CPA_ID', 'PAC_ID'),
+    'CITA_PACIENTE_CONSULTA': ('CPA_ID', 'CPA_DIAGNOSTICO', 'CPA_NOTAS_ODONTOGRAMA'),
+    'PACIENTE_DATOS_PREVIOS': ('PAC_ID',),
+}
+
+
+# Columnas de las filas que emite generar_historial_completa (el resto de
+# columnas de la plantilla se escriben vacías)
+COLUMNAS_HISTORIAL_COMPLETA = (
+    "Teléfono Cliente",
+    "Descripción Detallada",
+    "Diagnóstico",
+    "Observaciones Adicionales",
+)
+
+
+def _filas_historial_completa(tablas: Dict) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla_historial_completa.csv, en el orden de COLUMNAS_HISTORIAL_COMPLETA."""
     pacientes = tablas['PACIENTE']
     consultas = tablas['CITA_PACIENTE_CONSULTA']
     citas = tablas['CITA_PACIENTE']
     datos_previos = tablas['PACIENTE_DATOS_PREVIOS']
     
-    citas_por_consulta = {}
-    for cita in citas:
-        cpa_id = cita.get("CPA_ID", "")
-        if cpa_id:
-            citas_por_consulta[cpa_id] = cita
-    
-    out_rows: List[Dict[str, str]] = []
+    with etapa("indice citas_por_consulta") as e:
+        citas_por_consulta = diccionario("citas_por_consulta")
+        for cita in citas:
+            cpa_id = cita.get("CPA_ID", "")
+            if cpa_id:
+                citas_por_consulta[cpa_id] = cita
+        e["filas"] = len(citas_por_consulta)
     
     for cpa_id, consulta in consultas.items():
         cita = citas_por_consulta.get(cpa_id, {})
@@ -482,16 +727,21 @@ def generar_historial_completa(xml_path: Path, tablas: Dict, output_path: Path,
         telefono = paciente.get("PAC_TELEFONO1", "")
         diagnostico = consulta.get("CPA_DIAGNOSTICO", "")
         
-        row = {h: "" for h in headers}
-        row["Teléfono Cliente"] = telefono
-        row["Diagnóstico"] = diagnostico
-        row["Descripción Detallada"] = diagnostico
-        row["Observaciones Adicionales"] = consulta.get("CPA_NOTAS_ODONTOGRAMA", "")
+        row = (
+            telefono,  # Teléfono Cliente
+            diagnostico,  # Descripción Detallada
+            diagnostico,  # Diagnóstico
+            consulta.get("CPA_NOTAS_ODONTOGRAMA", ""),  # Observaciones Adicionales
+        )
         
-        out_rows.append(row)
-    
-    _write_csv(output_path, headers, out_rows)
-    print(f"[OK] Generado {output_path} ({len(out_rows)} filas)")
+        yield row
+
+
+def generar_historial_completa(xml_path: Path, tablas: Dict, output_path: Path, plantilla_path: Path) -> None:
+    """Genera plantilla_historial_completa.csv desde XML de DRICloud."""
+    headers = leer_cabeceras(plantilla_path)
+    filas = escribir_csv(output_path, headers, _filas_historial_completa(tablas), COLUMNAS_HISTORIAL_COMPLETA)
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
@@ -499,17 +749,41 @@ def generar_historial_completa(xml_path: Path, tablas: Dict, output_path: Path,
 # ---------------------------------------------------------------------------
 
 
-def generar_citas(xml_path: Path, tablas: Dict, output_path: Path, plantilla_path: Path) -> None:
-    """Genera plantilla-citas.csv desde XML de DRICloud."""
-    headers = _read_csv_headers(plantilla_path)
+FUENTES_CITAS = {
+    'PACIENTE': ('PAC_ID', 'PAC_NOMBRE', 'PAC_APELLIDOS', 'PAC_TELEFONO1'),
+    'CITA_PACIENTE': (
+        'PAC_ID', 'TCO_ID', 'TCI_ID', 'CPA_FECHA_INICIO', 'CPA_MINUTOS_CITA', 'CPA_ESTADO',
+    ),
+    'TURNO_CITA': ('TCO_ID', 'USU_ID'),
+    'TIPO_CITA': ('TCI_ID', 'TCI_NOMBRE'),
+    'USUARIO': ('USU_ID', 'USU_NOMBRE', 'USU_APELLIDOS', 'USU_USUARIO'),
+}
+
+
+# Columnas de las filas que emite generar_citas, en el orden de la plantilla
+COLUMNAS_CITAS = (
+    "professional_name",
+    "client_name",
+    "client_phone",
+    "service_name",
+    "date",
+    "start_time",
+    "end_time",
+    "duration",
+    "status",
+    "notes",
+    "modalidad",
+)
+
+
+def _filas_citas(tablas: Dict) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla-citas.csv, en el orden de COLUMNAS_CITAS."""
     pacientes = tablas['PACIENTE']
     citas = tablas['CITA_PACIENTE']
     turnos = tablas['TURNO_CITA']
     tipos_cita = tablas['TIPO_CITA']
     usuarios = tablas['USUARIO']
     
-    out_rows: List[Dict[str, str]] = []
-    
     for cita in citas:
         pac_id = cita.get("PAC_ID", "")
         paciente = pacientes.get(pac_id, {})
@@ -546,78 +820,54 @@ def generar_citas(xml_path: Path, tablas: Dict, output_path: Path, plantilla_pat
         else:
             status = "pending"
         
-        row = {
-            "professional_name": profesional,
-            "client_name": nombre_completo,
-            "client_phone": telefono,
-            "service_name": tipo_cita.get("TCI_NOMBRE", ""),
-            "date": formatear_fecha_hora(fecha_inicio),
-            "start_time": formatear_hora(fecha_inicio),
-            "end_time": "",
-            "duration": duracion,
-            "status": status,
-            "notes": "",
-            "modalidad": "presencial",
-        }
-        out_rows.append(row)
-    
-    _write_csv(output_path, headers, out_rows)
-    print(f"[OK] Generado {output_path} ({len(out_rows)} filas)")
+        row = (
+            profesional,  # professional_name
+            nombre_completo,  # client_name
+            telefono,  # client_phone
+            tipo_cita.get("TCI_NOMBRE", ""),  # service_name
+            formatear_fecha(fecha_inicio),  # date
+            formatear_hora(fecha_inicio),  # start_time
+            "",  # end_time
+            duracion,  # duration
+            status,  # status
+            "",  # notes
+            "presencial",  # modalidad
+        )
+        yield row
+
+
+def generar_citas(xml_path: Path, tablas: Dict, output_path: Path, plantilla_path: Path) -> None:
+    """Genera plantilla-citas.csv desde XML de DRICloud."""
+    headers = leer_cabeceras(plantilla_path)
+    filas = escribir_csv(output_path, headers, _filas_citas(tablas), COLUMNAS_CITAS)
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
-# CLI
+# CONVERSIÓN DE UN XML
 # ---------------------------------------------------------------------------
 
 
-def main(argv: Optional[List[str]] = None) -> None:
-    parser = argparse.ArgumentParser(
-        description=(
-            "Script genérico para mapear XML de DRICloud hacia las plantillas "
-            "de bonos, clientes, historial y citas."
-        )
-    )
-    parser.add_argument(
-        "--input-xml",
-        required=True,
-        help="Ruta al archivo XML de DRICloud (ej: 'Completa_2536.xml')",
-    )
-    parser.add_argument(
-        "--output-dir",
-        default=None,
-        help=(
-            "Carpeta donde se guardarán los CSV generados "
-            "(por defecto, la carpeta 'script' donde está este script)"
-        ),
-    )
-    parser.add_argument(
-        "--plantillas-dir",
-        default=None,
-        help=(
-            "Carpeta donde están las plantillas CSV "
-            "(por defecto, la raíz del proyecto)"
-        ),
-    )
-    parser.add_argument(
-        "--solo",
-        choices=[
-            "clientes_y_bonos",
-            "bonos",
-            "historial_basica",
-            "historial_completa",
-            "citas",
-        ],
-        help="Si se indica, solo genera ese tipo de plantilla.",
-    )
-    
-    args = parser.parse_args(argv)
-    
-    # Determinar rutas
+# Archivo de cada plantilla dentro de --plantillas-dir
+ARCHIVOS_PLANTILLA = {
+    "clientes_y_bonos": "plantilla_clientes_y_bonos.csv",
+    "bonos": "plantilla_bonos.csv",
+    "historial_basica": "plantilla_historial_basica.csv",
+    "historial_completa": "plantilla_historial_completa.csv",
+    "citas": "plantilla-citas.csv",
+}
+
+
+def _resolver_xml(valor: str) -> Path:
+    """
+    Ruta de un XML de entrada. Si es relativa y no existe desde el directorio
+    actual, se busca también desde la carpeta DRICloud y la raíz del proyecto.
+    """
     script_dir = Path(__file__).parent
     proyecto_root = script_dir.parent.parent
     dricloud_dir = script_dir.parent
     
-    input_xml = Path(args.input_xml)
+    input_xml = Path(valor)
     if not input_xml.is_absolute():
         # Si es relativo, intentar varias ubicaciones
         # 1. Desde donde se ejecuta el script (directorio actual de trabajo)
@@ -625,7 +875,7 @@ def main(argv: Optional[List[str]] = None) -> None:
             pass  # Ya está bien
         else:
             # 2. Si el path ya incluye "DRICloud/", buscar desde proyecto_root
-            path_str = str(args.input_xml)
+            path_str = str(valor)
             if "DRICloud" in path_str:
                 # Ya tiene DRICloud en el path, buscar desde proyecto_root
                 posible_path = proyecto_root / path_str
@@ -639,40 +889,36 @@ def main(argv: Optional[List[str]] = None) -> None:
                         input_xml = posible_path
             else:
                 # 3. Buscar desde la carpeta DRICloud directamente
-                posible_path = dricloud_dir / args.input_xml
+                posible_path = dricloud_dir / valor
                 if posible_path.exists():
                     input_xml = posible_path
                 else:
                     # 4. Último intento: desde proyecto_root
-                    posible_path = proyecto_root / args.input_xml
+                    posible_path = proyecto_root / valor
                     if posible_path.exists():
                         input_xml = posible_path
-    
-    if not input_xml.exists():
-        parser.error(f"El archivo XML no existe: {input_xml}")
-    
-    if args.output_dir is None:
-        output_dir = script_dir
-    else:
-        output_dir = Path(args.output_dir)
-    
-    if args.plantillas_dir is None:
-        plantillas_dir = proyecto_root
-    else:
-        plantillas_dir = Path(args.plantillas_dir)
+    return input_xml
+
+
+def convertir_xml(
+    input_xml: Path,
+    args: argparse.Namespace,
+    output_dir: Path,
+    plantillas_dir: Path,
+    jobs: int,
+) -> None:
+    """Genera en output_dir las plantillas pedidas en 'args' a partir de un XML."""
+    global DICCIONARIOS
+    # Cada XML empieza con sus propios diccionarios de valores
+    DICCIONARIOS = Diccionarios()
+    fijar_entrada(input_xml.name)
     
     # Rutas de plantillas
-    plantilla_clientes_y_bonos = plantillas_dir / "plantilla_clientes_y_bonos.csv"
-    plantilla_bonos = plantillas_dir / "plantilla_bonos.csv"
-    plantilla_historial_basica = plantillas_dir / "plantilla_historial_basica.csv"
-    plantilla_historial_completa = plantillas_dir / "plantilla_historial_completa.csv"
-    plantilla_citas = plantillas_dir / "plantilla-citas.csv"
-    
-    # Verificar que las plantillas existan
-    for p in [plantilla_clientes_y_bonos, plantilla_bonos, plantilla_historial_basica, 
-              plantilla_historial_completa, plantilla_citas]:
-        if not p.exists():
-            print(f"[AVISO] Plantilla no encontrada: {p}", file=sys.stderr)
+    plantilla_clientes_y_bonos = plantillas_dir / ARCHIVOS_PLANTILLA["clientes_y_bonos"]
+    plantilla_bonos = plantillas_dir / ARCHIVOS_PLANTILLA["bonos"]
+    plantilla_historial_basica = plantillas_dir / ARCHIVOS_PLANTILLA["historial_basica"]
+    plantilla_historial_completa = plantillas_dir / ARCHIVOS_PLANTILLA["historial_completa"]
+    plantilla_citas = plantillas_dir / ARCHIVOS_PLANTILLA["citas"]
     
     # Extraer sufijo del nombre del archivo XML
     xml_suffix = _sanitize_filename(input_xml.name)
@@ -680,14 +926,19 @@ def main(argv: Optional[List[str]] = None) -> None:
     print(f"[INFO] Procesando XML: {input_xml.name}")
     print(f"[INFO] Sufijo para archivos de salida: {xml_suffix}")
     
-    # Cargar tablas del XML
-    tablas = cargar_tablas_relacionadas(input_xml)
+    # Cargar del XML solo las tablas y columnas que declaran las plantillas a generar
+    plantillas = [args.solo] if args.solo else list(FUENTES_POR_PLANTILLA)
+    fuentes = unir_fuentes(*(FUENTES_POR_PLANTILLA[p] for p in plantillas))
+    with etapa("carga"):
+        tablas = cargar_tablas_relacionadas(
+            input_xml, args.xml_parser, fuentes, usar_indice=args.indice
+        )
     
     tasks = []
     
     def add_task(name: str, func):
         if args.solo is None or args.solo == name:
-            tasks.append(func)
+            tasks.append((name, func))
     
     add_task(
         "clientes_y_bonos",
@@ -732,12 +983,155 @@ def main(argv: Optional[List[str]] = None) -> None:
         )
         return
     
-    for t in tasks:
-        t()
+    ejecutar_tareas(tasks, jobs)
+    DICCIONARIOS.imprimir_resumen()
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+
+FUENTES_POR_PLANTILLA = {
+    "clientes_y_bonos": FUENTES_CLIENTES_Y_BONOS,
+    "bonos": FUENTES_BONOS,
+    "historial_basica": FUENTES_HISTORIAL_BASICA,
+    "historial_completa": FUENTES_HISTORIAL_COMPLETA,
+    "citas": FUENTES_CITAS,
+}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Script genérico para mapear XML de DRICloud hacia las plantillas "
+            "de bonos, clientes, historial y citas."
+        )
+    )
+    parser.add_argument(
+        "--input-xml",
+        required=True,
+        nargs="+",
+        help=(
+            "Ruta al archivo XML de DRICloud (ej: 'Completa_2536.xml'). Admite "
+            "varios archivos, carpetas (se toman sus .xml) o patrones glob "
+            "('exportaciones/*.xml'); cada uno genera sus propios CSV."
+        ),
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help=(
+            "Carpeta donde se guardarán los CSV generados "
+            "(por defecto, la carpeta 'script' donde está este script)"
+        ),
+    )
+    parser.add_argument(
+        "--plantillas-dir",
+        default=None,
+        help=(
+            "Carpeta donde están las plantillas CSV "
+            "(por defecto, la raíz del proyecto)"
+        ),
+    )
+    parser.add_argument(
+        "--solo",
+        choices=[
+            "clientes_y_bonos",
+            "bonos",
+            "historial_basica",
+            "historial_completa",
+            "citas",
+        ],
+        help="Si se indica, solo genera ese tipo de plantilla.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help=(
+            "Con un XML, número de plantillas a generar en paralelo (procesos "
+            "hijos que comparten los datos ya cargados). Con varios, número de "
+            "XML que se convierten a la vez, empezando por los más grandes. "
+            "Por defecto 1, en serie."
+        ),
+    )
+    parser.add_argument(
+        "--xml-parser",
+        choices=["regex", "iterparse"],
+        default="regex",
+        help=(
+            "Forma de leer el XML: 'regex' (por defecto, tolera XML mal formado) o "
+            "'iterparse' (parser XML incremental; resuelve entidades, CDATA, "
+            "atributos y espacios de nombres)."
+        ),
+    )
+    parser.add_argument(
+        "--indice",
+        action="store_true",
+        help=(
+            "Usar y mantener un índice de offsets junto al XML "
+            "('<xml>.indice.json'). Con el índice, las siguientes ejecuciones solo "
+            "decodifican las tablas que necesita la plantilla pedida. Si la carpeta "
+            "del XML no admite escritura, se avisa y se convierte sin guardarlo."
+        ),
+    )
+    anadir_opciones_comunes(
+        parser,
+        etapas="carga de cada tabla, índices, generación y escritura de cada plantilla",
+        desborde="las tablas del XML y los índices de citas y bonos",
+    )
+    
+    args = parser.parse_args(argv)
+    comprobar_opciones_comunes(parser, args)
+    
+    # Determinar rutas
+    script_dir = Path(__file__).parent
+    proyecto_root = script_dir.parent.parent
     
-    print(f"\n[OK] Proceso completado. Archivos generados en: {output_dir}")
+    try:
+        entradas = expandir_entradas(args.input_xml, _resolver_xml, (".xml",))
+        comprobar_sufijos(entradas, lambda p: _sanitize_filename(p.name))
+    except ValueError as e:
+        parser.error(str(e))
+    
+    if args.zip_output is not None:
+        output_dir = Path(args.zip_output)
+    elif args.output_dir is None:
+        output_dir = script_dir
+    else:
+        output_dir = Path(args.output_dir)
+    
+    if args.plantillas_dir is None:
+        plantillas_dir = proyecto_root
+    else:
+        plantillas_dir = Path(args.plantillas_dir)
+    
+    # Verificar que las plantillas existan
+    for nombre in ARCHIVOS_PLANTILLA.values():
+        if not (plantillas_dir / nombre).exists():
+            print(f"[AVISO] Plantilla no encontrada: {plantillas_dir / nombre}", file=sys.stderr)
+    
+    # Con varios XML, --jobs reparte los XML entre procesos y cada uno genera sus plantillas en serie
+    convertir = partial(
+        convertir_xml, args=args, output_dir=output_dir, plantillas_dir=plantillas_dir,
+        jobs=args.jobs if len(entradas) == 1 else 1,
+    )
+    perfil = (
+        perfilar(Path(args.profile), Path(args.profile_pstats) if args.profile_pstats else None)
+        if args.profile is not None else nullcontext()
+    )
+    memoria = limitar_memoria(args.max_memory) if args.max_memory is not None else nullcontext()
+    eventos = eventos_por_stdout() if args.events == "jsonl" else nullcontext()
+    with eventos:
+        with perfil, memoria, SalidaZip(output_dir) if args.zip_output is not None else nullcontext():
+            if len(entradas) == 1:
+                convertir(entradas[0])
+            else:
+                convertir_en_lote(entradas, convertir, args.jobs)
+        
+        print(f"\n[OK] Proceso completado. Archivos generados en: {output_dir}")
 
 
 if __name__ == "__main__":
     main()
-
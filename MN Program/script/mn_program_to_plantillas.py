@@ -1,66 +1,209 @@
 import argparse
+import codecs
 import csv
+import json
+import os
 import re
+import sqlite3
 import sys
+from contextlib import nullcontext
+from functools import partial
+from operator import itemgetter
+from itertools import chain
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+
+# Utilidades compartidas entre conversores (carpeta comun/ en la raíz del proyecto)
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from comun.fechas import fecha_sin_hora, separar_fecha_hora
+from comun.lotes import ejecutar_tareas
+from comun.registros import Diccionarios, Registro, esquema
+from comun.eventos import eventos_por_stdout, seguir_lectura
+from comun.memoria import diccionario, limitar_memoria
+from comun.perfil import etapa, medir_iterador, perfilar
+from comun.opciones import anadir_opciones_comunes, comprobar_opciones_comunes
+from comun.salida_csv import SalidaZip, escribir_csv
 
 
 # ---------------------------------------------------------------------------
-# Utilidades básicas
+# Detección de codificación
 # ---------------------------------------------------------------------------
 
 
-def _read_csv(path: Path, encoding: str = "latin-1") -> Iterable[Dict[str, str]]:
+# Bytes leídos al principio, a mitad y al final del fichero para decidir la codificación
+MUESTRA_ENCODING = 64 * 1024
+
+# Manejador de errores de decodificación: en un fichero detectado como UTF-8,
+# los bytes sueltos que no lo son se interpretan como latin-1 en lugar de
+# obligar a releer el fichero entero.
+ERRORES_LATIN1 = "mnprogram-latin1"
+
+_encodings_detectados: Dict[Tuple[str, int, int, bool], str] = {}
+_bytes_latin1 = 0
+
+
+class CodificacionMixtaError(ValueError):
+    """Un CSV mezcla líneas UTF-8 con líneas en otra codificación (modo estricto)."""
+
+
+def _decodificar_como_latin1(exc: UnicodeError):
+    global _bytes_latin1
+    if not isinstance(exc, UnicodeDecodeError):
+        raise exc
+    _bytes_latin1 += exc.end - exc.start
+    return exc.object[exc.start:exc.end].decode("latin-1"), exc.end
+
+
+codecs.register_error(ERRORES_LATIN1, _decodificar_como_latin1)
+
+
+def _es_utf8(bloque: bytes) -> bool:
+    # El bloque puede empezar o acabar a mitad de un carácter multibyte
+    i = 0
+    while i < 3 and i < len(bloque) and 0x80 <= bloque[i] < 0xC0:
+        i += 1
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(bloque[i:], final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def _muestrear_encoding(path: Path, fallback: str) -> str:
+    tamano = path.stat().st_size
+    with path.open("rb") as f:
+        inicio = f.read(MUESTRA_ENCODING)
+        if inicio.startswith(codecs.BOM_UTF8):
+            return "utf-8-sig"
+        muestras = [inicio]
+        for pos in (tamano // 2, tamano - MUESTRA_ENCODING):
+            if pos > MUESTRA_ENCODING:
+                f.seek(pos)
+                muestras.append(f.read(MUESTRA_ENCODING))
+    if all(_es_utf8(m) for m in muestras):
+        return "utf-8-sig"
+    return fallback
+
+
+def _verificar_encoding(path: Path, fallback: str) -> str:
+    primera_utf8: Optional[int] = None
+    primera_otra: Optional[int] = None
+    with path.open("rb") as f:
+        for n, linea in enumerate(f, 1):
+            if linea.isascii():
+                continue
+            try:
+                linea.decode("utf-8")
+                if primera_utf8 is None:
+                    primera_utf8 = n
+            except UnicodeDecodeError:
+                if primera_otra is None:
+                    primera_otra = n
+            if primera_utf8 is not None and primera_otra is not None:
+                raise CodificacionMixtaError(
+                    f"{path.name}: codificaciones mezcladas; la línea {primera_otra} "
+                    f"no es UTF-8 válido y la línea {primera_utf8} sí lo es"
+                )
+    return fallback if primera_otra is not None else "utf-8-sig"
+
+
+def _detectar_encoding(path: Path, fallback: str = "latin-1", estricto: bool = False) -> str:
     """
-    Lee un CSV de MN Program y devuelve diccionarios por fila.
+    Decide la codificación de un CSV una sola vez por fichero.
 
-    - Intenta primero con utf-8-sig (que maneja BOM automáticamente).
-    - Si falla, usa latin-1 para acentos típicos de MN Program.
-    - Si el fichero no existe, devuelve lista vacía y saca aviso por stderr.
-    - Limpia el BOM (Byte Order Mark) de las claves del diccionario si existe.
+    - Por defecto mira solo unas muestras del fichero: si son UTF-8 (o hay
+      BOM) usa utf-8-sig; si no, 'fallback' (latin-1 en MN Program).
+    - En modo estricto recorre el fichero entero por líneas y lanza
+      CodificacionMixtaError con la línea concreta si mezcla codificaciones.
+    - El resultado se cachea por ruta, tamaño y fecha de modificación.
     """
-    if not path.exists():
-        print(f"[AVISO] No se encontró el fichero: {path}", file=sys.stderr)
-        return []
+    st = path.stat()
+    clave = (str(path.resolve()), st.st_size, st.st_mtime_ns, estricto)
+    enc = _encodings_detectados.get(clave)
+    if enc is None:
+        if estricto:
+            enc = _verificar_encoding(path, fallback)
+        else:
+            enc = _muestrear_encoding(path, fallback)
+        _encodings_detectados[clave] = enc
+    return enc
 
-    encodings_to_try = ["utf-8-sig", encoding]
-    rows = []
-    
-    for enc in encodings_to_try:
-        try:
-            with path.open("r", encoding=enc, newline="") as f:
-                reader = csv.DictReader(f)
-                rows = list(reader)
-                break
-        except (UnicodeDecodeError, UnicodeError):
-            continue
-    
-    if rows:
-        bom = '\ufeff'
-        cleaned_rows = []
-        for row in rows:
-            cleaned_row = {}
-            for key, value in row.items():
-                # Eliminar BOM del inicio de la clave
-                clean_key = key.lstrip(bom).strip()
-                cleaned_row[clean_key] = value
-            cleaned_rows.append(cleaned_row)
-        return cleaned_rows
-    
-    return rows
 
+# ---------------------------------------------------------------------------
+# Utilidades básicas
+# ---------------------------------------------------------------------------
 
-def _write_csv(path: Path, fieldnames: List[str], rows: Iterable[Dict[str, str]]) -> None:
+
+def _read_csv(
+    path: Path,
+    encoding: str = "latin-1",
+    columnas: Optional[Sequence[str]] = None,
+    estricto: bool = False,
+) -> Iterator[Registro]:
     """
-    Escribe un CSV en UTF‑8 con BOM para que Excel lo abra bien.
+    Lee un CSV de MN Program y va devolviendo un Registro por fila (se lee
+    como un dict; los nombres de columna se comparten entre todas las filas).
+
+    - La codificación se decide antes de leer (ver _detectar_encoding):
+      utf-8-sig si el fichero es UTF-8, 'encoding' (latin-1) si no.
+    - Si un fichero UTF-8 trae bytes sueltos en latin-1, esos bytes se
+      decodifican como latin-1 sin releer el fichero (salvo en modo estricto).
+    - Si el fichero no existe, no devuelve filas y saca aviso por stderr.
+    - Limpia el BOM (Byte Order Mark) y los espacios de la cabecera una sola vez.
+    - Si se indica 'columnas', cada fila conserva solo esas columnas.
+
+    Es un generador: las filas no se acumulan en memoria, así que cada
+    tabla solo se puede recorrer una vez.
     """
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8-sig", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow({k: row.get(k, "") for k in fieldnames})
+    if not path.exists():
+        print(f"[AVISO] No se encontró el fichero: {path}", file=sys.stderr)
+        return
+
+    bom = '\ufeff'
+    wanted = set(columnas) if columnas is not None else None
+    with etapa(f"deteccion de codificacion {path.name}"):
+        enc = _detectar_encoding(path, encoding, estricto)
+    errores = "strict" if estricto else ERRORES_LATIN1
+    latin1_antes = _bytes_latin1
+
+    with path.open("r", encoding=enc, errors=errores, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        # Columna -> índice en la fila (si una columna se repite, vale la última)
+        posiciones: Dict[str, int] = {}
+        for i, clean_key in enumerate(k.lstrip(bom).strip() for k in header):
+            if wanted is None or clean_key in wanted:
+                posiciones[clean_key] = i
+        columnas_fila = esquema(posiciones)
+        indices = tuple(posiciones.values())
+        ancho = max(indices) + 1 if indices else 0
+        if len(indices) > 1:
+            tomar = itemgetter(*indices)
+        elif indices:
+            unico = indices[0]
+            tomar = lambda v: (v[unico],)
+        else:
+            tomar = lambda v: ()
+
+        filas = seguir_lectura(reader, path.name, path.stat().st_size, posicion=lambda _: f.buffer.tell())
+        for valores in filas:
+            if not valores:
+                continue
+            if len(valores) < ancho:
+                # Fila corta: las columnas que faltan quedan a None
+                valores += [None] * (ancho - len(valores))
+            yield Registro(columnas_fila, tomar(valores))
+
+    if _bytes_latin1 > latin1_antes:
+        print(
+            f"[AVISO] {path.name} mezcla UTF-8 y latin-1; "
+            "usa --encoding-estricto para localizar la línea.",
+            file=sys.stderr,
+        )
 
 
 def _first_no_empty(*values: Optional[str]) -> str:
@@ -107,25 +250,75 @@ def _extract_folder_suffix(input_dir: Path) -> str:
 # ---------------------------------------------------------------------------
 
 
-def load_clientes(input_dir: Path) -> Dict[str, Dict[str, str]]:
+class ClienteMN(NamedTuple):
+    """
+    Registro compacto de un cliente: solo las columnas de 'clientes.csv'
+    que leen las plantillas.
+    """
+
+    nombre: str            # snombrecli
+    nombre_alt: str        # nombre / name
+    apellidos: str         # sapellidoscli / apellidos / surname
+    telefono: str          # smovilcli, si no stelefonocli
+    nif: str               # snifcli
+    direccion: str         # sdomiciliocli
+    codigo_postal: str     # scodpostalcli
+    ciudad: str            # spoblacioncli
+    provincia: str         # sprovinciacli
+    pais: str              # sNombrePais
+    email: str             # email
+    tipo: str              # NaturJuridica
+    fecha_nacimiento: str  # fechanacimiento
+    sexo: str              # sexo
+    notas_medicas: str     # textoalerta
+
+
+CLIENTE_VACIO = ClienteMN(*([""] * len(ClienteMN._fields)))
+
+# Valores compartidos de las columnas de clientes con pocos valores distintos
+# (provincia, país, sexo, tipo...), ya que los clientes se guardan en memoria
+DICCIONARIOS = Diccionarios()
+
+
+def _cliente_desde_fila(r: Dict[str, str]) -> ClienteMN:
+    return ClienteMN(
+        nombre=r.get("snombrecli") or "",
+        nombre_alt=_first_no_empty(r.get("nombre"), r.get("name")),
+        apellidos=_first_no_empty(r.get("sapellidoscli"), r.get("apellidos"), r.get("surname")),
+        telefono=_first_no_empty(r.get("smovilcli"), r.get("stelefonocli")),
+        nif=r.get("snifcli") or "",
+        direccion=r.get("sdomiciliocli") or "",
+        codigo_postal=r.get("scodpostalcli") or "",
+        ciudad=r.get("spoblacioncli") or "",
+        provincia=r.get("sprovinciacli") or "",
+        pais=r.get("sNombrePais") or "",
+        email=r.get("email") or "",
+        tipo=r.get("NaturJuridica") or "",
+        fecha_nacimiento=r.get("fechanacimiento") or "",
+        sexo=r.get("sexo") or "",
+        notas_medicas=r.get("textoalerta") or "",
+    )
+
+
+def _leer_clientes(input_dir: Path, estricto: bool = False) -> Tuple[Optional[str], Iterator[Tuple[str, ClienteMN]]]:
     """
-    Carga 'clientes.csv' y devuelve un dict indexado por la columna de ID.
+    Abre 'clientes.csv' y devuelve la columna que se usa como ID (None si no
+    hay filas) y un iterador de (ID, ClienteMN) de las filas que lo tienen.
 
     - Intenta usar 'icodcli' (nombre típico en MN Program).
     - Si no existe exactamente así (BOM, mayúsculas, espacios, etc.),
       toma la primera columna como identificador.
     """
-    rows = _read_csv(input_dir / "clientes.csv")
-    clientes: Dict[str, Dict[str, str]] = {}
+    rows = _read_csv(input_dir / "clientes.csv", estricto=estricto)
 
-    if not rows:
+    sample = next(rows, None)
+    if sample is None:
         print(
             "[AVISO] 'clientes.csv' no tiene filas de datos o no se pudo leer correctamente.",
             file=sys.stderr,
         )
-        return clientes
+        return None, iter(())
 
-    sample = rows[0]
     bom = '\ufeff'
     possible_keys = ["icodcli", "ICODCLI", "IdCliente", "idcliente", "id"]
     key_field: Optional[str] = None
@@ -149,16 +342,91 @@ def load_clientes(input_dir: Path) -> Dict[str, Dict[str, str]]:
     else:
         key_field_clean = key_field.lstrip(bom).strip()
 
-    for r in rows:
-        key = r.get(key_field)
-        if not key:
-            continue
-        clientes[str(key)] = r
+    def clientes() -> Iterator[Tuple[str, ClienteMN]]:
+        for r in chain([sample], rows):
+            key = r.get(key_field)
+            if key:
+                yield str(key), _cliente_desde_fila(r)
+
+    return key_field_clean, clientes()
+
+
+def load_clientes(input_dir: Path, estricto: bool = False) -> Dict[str, ClienteMN]:
+    """
+    Carga 'clientes.csv' y devuelve un dict indexado por la columna de ID
+    (ver _leer_clientes).
+
+    Cada cliente se guarda como ClienteMN, sin el resto de columnas, y los
+    valores repetidos de sus columnas se comparten (ver DICCIONARIOS).
+    """
+    key_field_clean, filas = _leer_clientes(input_dir, estricto)
+    clientes: Dict[str, ClienteMN] = diccionario("clientes")
+    if key_field_clean is None:
+        return clientes
+
+    for key, cliente in filas:
+        clientes[key] = ClienteMN._make(DICCIONARIOS.codificar_valores("clientes", ClienteMN._fields, cliente))
 
     print(f"[INFO] Cargados {len(clientes)} clientes desde clientes.csv (clave: '{key_field_clean}')")
     return clientes
 
 
+class ContextoMN:
+    """
+    Datos compartidos por todos los generadores de una ejecución.
+
+    'clientes.csv' se lee e indexa una sola vez, la primera vez que una
+    plantilla lo necesita; el resto de generadores reutiliza el índice.
+    """
+
+    def __init__(self, input_dir: Path, estricto: bool = False) -> None:
+        self.input_dir = input_dir
+        self.estricto = estricto
+        self._clientes: Optional[Dict[str, ClienteMN]] = None
+
+    @property
+    def clientes(self) -> Dict[str, ClienteMN]:
+        if self._clientes is None:
+            with etapa("carga clientes.csv") as e:
+                self._clientes = load_clientes(self.input_dir, self.estricto)
+                e["filas"] = len(self._clientes)
+        return self._clientes
+
+    def leer_csv(self, nombre: str, columnas: Optional[Sequence[str]] = None) -> Iterator[Registro]:
+        """Lee un CSV de la carpeta de entrada con las opciones de la ejecución."""
+        filas = _read_csv(self.input_dir / nombre, columnas=columnas, estricto=self.estricto)
+        return medir_iterador(filas, f"lectura {nombre}")
+
+    def cliente(self, icodcli: Optional[str]) -> ClienteMN:
+        """Devuelve el cliente con ese ID o un registro vacío si no existe."""
+        if not icodcli:
+            return CLIENTE_VACIO
+        return self.clientes.get(icodcli, CLIENTE_VACIO)
+
+    def leer_con_cliente(
+        self, nombre: str, columnas: Sequence[str], claves: Sequence[str]
+    ) -> Iterator[Tuple[Registro, ClienteMN]]:
+        """
+        Lee un CSV y devuelve cada fila con su cliente. El ID del cliente es la
+        columna 'claves[0]' o, con varias, la primera de ellas que no esté vacía.
+        """
+        for fila in self.leer_csv(nombre, columnas):
+            if len(claves) == 1:
+                icodcli = fila.get(claves[0], "")
+            else:
+                icodcli = _first_no_empty(*(fila.get(c) for c in claves))
+            yield fila, self.cliente(icodcli)
+
+    def preparar(self, plantillas: Sequence[str]) -> None:
+        """
+        Carga lo que comparten las plantillas antes de generarlas; en paralelo,
+        lo heredan los procesos hijos. Aquí solo se cargan los clientes, que
+        usan todas, así que 'plantillas' no se usa (ContextoMNStaging carga
+        además las tablas de cada plantilla).
+        """
+        _ = self.clientes  # carga el índice para que lo hereden los hijos
+
+
 # ---------------------------------------------------------------------------
 # GENERACIÓN: plantilla_clientes_y_bonos.csv
 # ---------------------------------------------------------------------------
@@ -193,7 +461,43 @@ PLANTILLA_CLIENTES_Y_BONOS_HEADERS = [
 ]
 
 
-def generar_clientes_y_bonos(input_dir: Path, output_path: Path) -> None:
+def _filas_clientes_y_bonos(ctx: ContextoMN) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla_clientes_y_bonos.csv, en el orden de PLANTILLA_CLIENTES_Y_BONOS_HEADERS."""
+    for cli in ctx.clientes.values():
+        nombre_completo = cli.nombre.strip()
+
+        # Versión genérica: dejamos todo el nombre en "Nombre" y vaciamos "Apellidos".
+        row = (
+            nombre_completo,  # Nombre
+            "",  # Apellidos
+            cli.nif,  # CIF/NIF
+            cli.direccion,  # Direccion
+            cli.codigo_postal,  # Codigo Postal
+            cli.ciudad,  # Ciudad
+            cli.provincia,  # Provincia
+            _first_no_empty(cli.pais, "España"),  # Pais
+            cli.email,  # Email
+            cli.telefono,  # Telefono
+            cli.tipo,  # Tipo Cliente
+            cli.fecha_nacimiento,  # Fecha Nacimiento
+            cli.sexo,  # Genero
+            cli.notas_medicas,  # Notas Medicas
+            "",  # Fecha seguimiento
+            "",  # Tipo seguimiento
+            "",  # Descripción
+            "",  # Recomendaciones
+            "",  # Nombre Bono
+            "",  # Servicio
+            "",  # Precio
+            "",  # Sesiones Totales
+            "",  # Sesiones Consumidas
+            "",  # Fecha Caducidad
+            "",  # Notas Bono
+        )
+        yield row
+
+
+def generar_clientes_y_bonos(ctx: ContextoMN, output_path: Path) -> None:
     """
     Mapea MN Program -> plantilla_clientes_y_bonos.
 
@@ -201,45 +505,8 @@ def generar_clientes_y_bonos(input_dir: Path, output_path: Path) -> None:
     - Rellena solo la parte de CLIENTE desde 'clientes.csv'.
     - Deja vacíos los campos de seguimiento y bono (se pueden completar luego).
     """
-    clientes = load_clientes(input_dir)
-
-    rows_out: List[Dict[str, str]] = []
-
-    for cli in clientes.values():
-        nombre_completo = cli.get("snombrecli", "").strip()
-
-        # Versión genérica: dejamos todo el nombre en "Nombre" y vaciamos "Apellidos".
-        row = {
-            "Nombre": nombre_completo,
-            "Apellidos": "",
-            "CIF/NIF": cli.get("snifcli", ""),
-            "Direccion": cli.get("sdomiciliocli", ""),
-            "Codigo Postal": cli.get("scodpostalcli", ""),
-            "Ciudad": cli.get("spoblacioncli", ""),
-            "Provincia": cli.get("sprovinciacli", ""),
-            "Pais": _first_no_empty(cli.get("sNombrePais"), "España"),
-            "Email": cli.get("email", ""),
-            "Telefono": _first_no_empty(cli.get("smovilcli"), cli.get("stelefonocli")),
-            "Tipo Cliente": cli.get("NaturJuridica", ""),
-            "Fecha Nacimiento": cli.get("fechanacimiento", ""),
-            "Genero": cli.get("sexo", ""),
-            "Notas Medicas": cli.get("textoalerta", ""),
-            "Fecha seguimiento": "",
-            "Tipo seguimiento": "",
-            "Descripción": "",
-            "Recomendaciones": "",
-            "Nombre Bono": "",
-            "Servicio": "",
-            "Precio": "",
-            "Sesiones Totales": "",
-            "Sesiones Consumidas": "",
-            "Fecha Caducidad": "",
-            "Notas Bono": "",
-        }
-        rows_out.append(row)
-
-    _write_csv(output_path, PLANTILLA_CLIENTES_Y_BONOS_HEADERS, rows_out)
-    print(f"[OK] Generado {output_path} ({len(rows_out)} filas)")
+    filas = escribir_csv(output_path, PLANTILLA_CLIENTES_Y_BONOS_HEADERS, _filas_clientes_y_bonos(ctx))
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
@@ -261,7 +528,36 @@ PLANTILLA_BONOS_HEADERS = [
 ]
 
 
-def generar_bonos(input_dir: Path, output_path: Path) -> None:
+# CSV y columnas de MN Program que lee esta plantilla (además de ClienteMN)
+FUENTES_BONOS = {
+    "Bonos.csv": ("icodcliClientes", "Descripcion", "unidades", "Importe", "FechaCaducidad"),
+}
+
+
+def _filas_bonos(ctx: ContextoMN) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla_bonos.csv, en el orden de PLANTILLA_BONOS_HEADERS."""
+    bonos_rows = ctx.leer_con_cliente("Bonos.csv", FUENTES_BONOS["Bonos.csv"], ("icodcliClientes",))
+    
+    for b, cli in bonos_rows:
+        telefono = cli.telefono
+        nombre_cliente = cli.nombre
+
+        row = (
+            telefono,  # Teléfono
+            nombre_cliente,  # Nombre Cliente
+            b.get("Descripcion", ""),  # Nombre Bono
+            "",  # Servicio
+            b.get("unidades", ""),  # Sesiones Totales
+            "",  # Sesiones Consumidas
+            b.get("Importe", ""),  # Precio Total
+            "",  # Pagado
+            "",  # Importe Pagado
+            b.get("FechaCaducidad", ""),  # Fecha Caducidad
+        )
+        yield row
+
+
+def generar_bonos(ctx: ContextoMN, output_path: Path) -> None:
     """
     Mapea Bonos de MN Program -> plantilla_bonos.csv.
 
@@ -269,34 +565,8 @@ def generar_bonos(input_dir: Path, output_path: Path) -> None:
     - Une por Bonos.icodcliClientes = clientes.icodcli.
     - Servicio, sesiones consumidas, pagado… se dejan lo más genérico posible.
     """
-    clientes = load_clientes(input_dir)
-    bonos_rows = _read_csv(input_dir / "Bonos.csv")
-
-    out_rows: List[Dict[str, str]] = []
-
-    for b in bonos_rows:
-        icodcli = b.get("icodcliClientes", "")
-        cli = clientes.get(icodcli, {})
-
-        telefono = _first_no_empty(cli.get("smovilcli"), cli.get("stelefonocli"))
-        nombre_cliente = cli.get("snombrecli", "")
-
-        row = {
-            "Teléfono": telefono,
-            "Nombre Cliente": nombre_cliente,
-            "Nombre Bono": b.get("Descripcion", ""),
-            "Servicio": "",
-            "Sesiones Totales": b.get("unidades", ""),
-            "Sesiones Consumidas": "",
-            "Precio Total": b.get("Importe", ""),
-            "Pagado": "",
-            "Importe Pagado": "",
-            "Fecha Caducidad": b.get("FechaCaducidad", ""),
-        }
-        out_rows.append(row)
-
-    _write_csv(output_path, PLANTILLA_BONOS_HEADERS, out_rows)
-    print(f"[OK] Generado {output_path} ({len(out_rows)} filas)")
+    filas = escribir_csv(output_path, PLANTILLA_BONOS_HEADERS, _filas_bonos(ctx))
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
@@ -319,48 +589,46 @@ PLANTILLA_HISTORIAL_BASICA_HEADERS = [
 ]
 
 
-def generar_historial_basica(input_dir: Path, output_path: Path) -> None:
+FUENTES_HISTORIAL_BASICA = {
+    "diagnosticoPac.csv": ("icodcli", "dfecha", "diagnostico", "tipo"),
+}
+
+
+def _filas_historial_basica(ctx: ContextoMN) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla_historial_basica.csv, en el orden de PLANTILLA_HISTORIAL_BASICA_HEADERS."""
+    diagnostico_rows = ctx.leer_con_cliente(
+        "diagnosticoPac.csv", FUENTES_HISTORIAL_BASICA["diagnosticoPac.csv"], ("icodcli",)
+    )
+    
+    for diag, cli in diagnostico_rows:
+        telefono = cli.telefono
+        
+        fecha = fecha_sin_hora(diag.get("dfecha", ""))
+        
+        row = (
+            telefono,  # Teléfono
+            "",  # Profesional
+            "",  # Motivo Consulta
+            "",  # Tiempo Evolución
+            diag.get("diagnostico", ""),  # Descripción Detallada
+            "",  # Enfermedades Crónicas
+            "",  # Alergias Medicamentosas
+            "",  # Medicación Habitual
+            diag.get("diagnostico", ""),  # Diagnóstico
+            "",  # Recomendaciones
+            f"Tipo: {diag.get('tipo', '')} | Fecha: {fecha}",  # Observaciones
+        )
+        yield row
+
+
+def generar_historial_basica(ctx: ContextoMN, output_path: Path) -> None:
     """
     Mapea historial de MN Program -> plantilla_historial_basica.csv.
     
     Usa diagnosticoPac.csv que contiene diagnósticos de pacientes.
     """
-    clientes = load_clientes(input_dir)
-    diagnostico_rows = _read_csv(input_dir / "diagnosticoPac.csv")
-    
-    out_rows: List[Dict[str, str]] = []
-    
-    for diag in diagnostico_rows:
-        icodcli = diag.get("icodcli", "")
-        cli = clientes.get(icodcli, {})
-        
-        telefono = _first_no_empty(cli.get("smovilcli"), cli.get("stelefonocli"))
-        
-        fecha = diag.get("dfecha", "")
-        if fecha and len(fecha) >= 10:
-            try:
-                fecha_parts = fecha.split()[0] 
-                fecha = fecha_parts
-            except:
-                pass
-        
-        row = {
-            "Teléfono": telefono,
-            "Profesional": "",  
-            "Motivo Consulta": "",
-            "Tiempo Evolución": "",
-            "Descripción Detallada": diag.get("diagnostico", ""),
-            "Enfermedades Crónicas": "",
-            "Alergias Medicamentosas": "",
-            "Medicación Habitual": "",
-            "Diagnóstico": diag.get("diagnostico", ""),
-            "Recomendaciones": "",
-            "Observaciones": f"Tipo: {diag.get('tipo', '')} | Fecha: {fecha}",
-        }
-        out_rows.append(row)
-    
-    _write_csv(output_path, PLANTILLA_HISTORIAL_BASICA_HEADERS, out_rows)
-    print(f"[OK] Generado {output_path} ({len(out_rows)} filas)")
+    filas = escribir_csv(output_path, PLANTILLA_HISTORIAL_BASICA_HEADERS, _filas_historial_basica(ctx))
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
@@ -461,31 +729,34 @@ PLANTILLA_HISTORIAL_COMPLETA_HEADERS = [
 ]
 
 
-def generar_historial_completa(input_dir: Path, output_path: Path) -> None:
-    """
-    Mapea historial completo de MN Program -> plantilla_historial_completa.csv.
-    
-    Usa diagnosticoPac.csv como base y rellena los campos disponibles.
-    Los campos más detallados se dejan vacíos si no están en la fuente.
-    """
-    clientes = load_clientes(input_dir)
-    diagnostico_rows = _read_csv(input_dir / "diagnosticoPac.csv")
-    
-    out_rows: List[Dict[str, str]] = []
+FUENTES_HISTORIAL_COMPLETA = {
+    "diagnosticoPac.csv": (
+        "icodcli", "dfecha", "diagnostico", "tipo", "principal", "codigocie9", "estado",
+    ),
+}
+
+
+# Columnas de las filas que emite generar_historial_completa (el resto de
+# columnas de la plantilla se escriben vacías)
+COLUMNAS_HISTORIAL_COMPLETA = (
+    "Teléfono Cliente",
+    "Descripción Detallada",
+    "Observaciones Clínicas",
+    "Diagnóstico",
+    "Observaciones Adicionales",
+)
+
+
+def _filas_historial_completa(ctx: ContextoMN) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla_historial_completa.csv, en el orden de COLUMNAS_HISTORIAL_COMPLETA."""
+    diagnostico_rows = ctx.leer_con_cliente(
+        "diagnosticoPac.csv", FUENTES_HISTORIAL_COMPLETA["diagnosticoPac.csv"], ("icodcli",)
+    )
     
-    for diag in diagnostico_rows:
-        icodcli = diag.get("icodcli", "")
-        cli = clientes.get(icodcli, {})
+    for diag, cli in diagnostico_rows:
+        telefono = cli.telefono
         
-        telefono = _first_no_empty(cli.get("smovilcli"), cli.get("stelefonocli"))
-        
-        fecha = diag.get("dfecha", "")
-        if fecha and len(fecha) >= 10:
-            try:
-                fecha_parts = fecha.split()[0]
-                fecha = fecha_parts
-            except:
-                pass
+        fecha = fecha_sin_hora(diag.get("dfecha", ""))
         
         observaciones = []
         if diag.get("tipo"):
@@ -496,101 +767,27 @@ def generar_historial_completa(input_dir: Path, output_path: Path) -> None:
             observaciones.append(f"CIE-9: {diag.get('codigocie9')}")
         observaciones_text = " | ".join(observaciones) if observaciones else ""
         
-        row = {
-            "Teléfono Cliente": telefono,
-            "Profesional": "",  
-            "Motivo Consulta": "",
-            "Tiempo Evolución": "",
-            "Descripción Detallada": diag.get("diagnostico", ""),
-            "Inicio Evolución": "",
-            "Factores Agravantes": "",
-            "Factores Atenuantes": "",
-            "Intensidad Síntomas": "",
-            "Frecuencia Síntomas": "",
-            "Localización": "",
-            "Impacto Vida Diaria": "",
-            "Enfermedades Crónicas": "",
-            "Enfermedades Agudas": "",
-            "Cirugías Previas": "",
-            "Alergias Medicamentosas": "",
-            "Alergias Alimentarias": "",
-            "Alergias Ambientales": "",
-            "Medicación Habitual": "",
-            "Hospitalizaciones Previas": "",
-            "Accidentes/Traumatismos": "",
-            "Enfermedades Hereditarias": "",
-            "Patologías Padres": "",
-            "Patologías Hermanos": "",
-            "Patologías Abuelos": "",
-            "Alimentación": "",
-            "Actividad Física": "",
-            "Consumo Tabaco": "",
-            "Cantidad Tabaco": "",
-            "Tiempo Tabaco": "",
-            "Consumo Alcohol": "",
-            "Cantidad Alcohol": "",
-            "Frecuencia Alcohol": "",
-            "Otras Sustancias": "",
-            "Calidad Sueño": "",
-            "Horas Sueño": "",
-            "Nivel Estrés": "",
-            "Apetito": "",
-            "Digestión": "",
-            "Evacuaciones": "",
-            "Frecuencia Evacuaciones": "",
-            "Consistencia Evacuaciones": "",
-            "Cambios Evacuaciones": "",
-            "Náuseas/Vómitos": "",
-            "Reflujo": "",
-            "Frecuencia Urinaria": "",
-            "Dolor al Urinar": "",
-            "Incontinencia": "",
-            "Cambios Color Orina": "",
-            "Cambios Olor Orina": "",
-            "Palpitaciones": "",
-            "Disnea": "",
-            "Dolor Torácico": "",
-            "Tos": "",
-            "Esputo": "",
-            "Dolor Articular": "",
-            "Dolor Muscular": "",
-            "Limitaciones Movimiento": "",
-            "Debilidad/Fatiga": "",
-            "Mareos/Vértigo": "",
-            "Pérdida Sensibilidad": "",
-            "Pérdida Fuerza": "",
-            "Cefaleas": "",
-            "Alteraciones Visuales": "",
-            "Alteraciones Auditivas": "",
-            "Estado Ánimo": "",
-            "Ansiedad": "",
-            "Depresión": "",
-            "Cambios Conducta": "",
-            "Trastornos Sueño": "",
-            "Sistema Cutáneo": "",
-            "Sistema Endocrino": "",
-            "Sistema Hematológico": "",
-            "Tensión Arterial": "",
-            "Frecuencia Cardíaca": "",
-            "Frecuencia Respiratoria": "",
-            "Temperatura": "",
-            "Saturación O2": "",
-            "Peso": "",
-            "Talla": "",
-            "IMC": "",
-            "Observaciones Clínicas": observaciones_text,
-            "Pruebas Complementarias": "",
-            "Diagnóstico": diag.get("diagnostico", ""),
-            "Medicación Prescrita": "",
-            "Recomendaciones": "",
-            "Derivaciones": "",
-            "Seguimiento": "",
-            "Observaciones Adicionales": f"Fecha: {fecha} | Estado: {diag.get('estado', '')}",
-        }
-        out_rows.append(row)
+        row = (
+            telefono,  # Teléfono Cliente
+            diag.get("diagnostico", ""),  # Descripción Detallada
+            observaciones_text,  # Observaciones Clínicas
+            diag.get("diagnostico", ""),  # Diagnóstico
+            f"Fecha: {fecha} | Estado: {diag.get('estado', '')}",  # Observaciones Adicionales
+        )
+        yield row
+
+
+def generar_historial_completa(ctx: ContextoMN, output_path: Path) -> None:
+    """
+    Mapea historial completo de MN Program -> plantilla_historial_completa.csv.
     
-    _write_csv(output_path, PLANTILLA_HISTORIAL_COMPLETA_HEADERS, out_rows)
-    print(f"[OK] Generado {output_path} ({len(out_rows)} filas)")
+    Usa diagnosticoPac.csv como base y rellena los campos disponibles.
+    Los campos más detallados se dejan vacíos si no están en la fuente.
+    """
+    filas = escribir_csv(
+        output_path, PLANTILLA_HISTORIAL_COMPLETA_HEADERS, _filas_historial_completa(ctx), COLUMNAS_HISTORIAL_COMPLETA
+    )
+    print(f"[OK] Generado {output_path} ({filas} filas)")
 
 
 # ---------------------------------------------------------------------------
@@ -612,44 +809,23 @@ PLANTILLA_CITAS_HEADERS = [
 ]
 
 
-def generar_citas(input_dir: Path, output_path: Path) -> None:
-    """
-    Mapea 'events.csv' de MN Program -> plantilla-citas.csv.
+FUENTES_CITAS = {
+    "events.csv": (
+        "eventid", "contactid", "contact", "icodcli", "resourceid", "subject",
+        "startdate", "starttime", "endtime", "startdatetime", "durationminutes",
+        "status", "done", "location", "notes",
+    ),
+}
 
-    Intenta relacionar eventos con clientes usando:
-    - contactid (si existe)
-    - icodcli (si está en campos relacionados con expedientes)
-    - También busca en eventsit.csv que puede tener relaciones adicionales
-    """
-    clientes = load_clientes(input_dir)
-    events_rows = _read_csv(input_dir / "events.csv")
-    eventsit_rows = _read_csv(input_dir / "eventsit.csv")
+
+def _filas_citas(ctx: ContextoMN) -> Iterator[Tuple[str, ...]]:
+    """Filas de plantilla-citas.csv, en el orden de PLANTILLA_CITAS_HEADERS."""
+    events_rows = ctx.leer_con_cliente(
+        "events.csv", FUENTES_CITAS["events.csv"], ("contactid", "contact", "icodcli")
+    )
     
-    eventsit_by_eventid = {}
-    for eit in eventsit_rows:
-        eventid = eit.get("eventid", "")
-        if eventid:
-            eventsit_by_eventid[eventid] = eit
-
-    out_rows: List[Dict[str, str]] = []
-
-    for ev in events_rows:
-        contact_id = _first_no_empty(
-            ev.get("contactid"), 
-            ev.get("contact"),
-            ev.get("icodcli")  
-        )
-        
-        if not contact_id:
-            eventid = ev.get("eventid", "")
-            if eventid and eventid in eventsit_by_eventid:
-                eit = eventsit_by_eventid[eventid]
-        
-        cli = clientes.get(contact_id, {}) if contact_id else {}
-        nombre_cli = _first_no_empty(cli.get("snombrecli"), cli.get("nombre"), cli.get("name"))
-        apellidos_cli = _first_no_empty(cli.get("sapellidoscli"), cli.get("apellidos"), cli.get("surname"))
-        nombre_completo = f"{nombre_cli} {apellidos_cli}".strip()
-        telefono = _first_no_empty(cli.get("smovilcli"), cli.get("stelefonocli"))
+    for ev, cli in events_rows:
+        telefono = cli.telefono
 
         start_date = ev.get("startdate", "")
         start_time = ev.get("starttime", "")
@@ -657,14 +833,11 @@ def generar_citas(input_dir: Path, output_path: Path) -> None:
         
         start_datetime = ev.get("startdatetime", "")
         if start_datetime and not start_date:
-            try:
-                parts = start_datetime.split()
-                if len(parts) >= 2:
-                    start_date = parts[0]
-                    if not start_time:
-                        start_time = parts[1][:8] 
-            except:
-                pass
+            fecha_dt, hora_dt = separar_fecha_hora(start_datetime)
+            if fecha_dt:
+                start_date = fecha_dt
+                if not start_time:
+                    start_time = hora_dt
         
         duration = ev.get("durationminutes", "")
         if not duration and start_time and end_time:
@@ -688,24 +861,282 @@ def generar_citas(input_dir: Path, output_path: Path) -> None:
         if "online" in location or "virtual" in location or "tele" in location:
             modalidad = "online"
 
-        row = {
-            "professional_name": f"Prof_{ev.get('resourceid', '').strip()}" if ev.get("resourceid") else "",
-            "client_name": nombre_completo,
-            "client_phone": telefono,
-            "service_name": ev.get("subject", ""),
-            "date": start_date,
-            "start_time": start_time,
-            "end_time": end_time,
-            "duration": duration,
-            "status": status,
-            "notes": ev.get("notes", ""),
-            "modalidad": modalidad,
+        row = (
+            f"Prof_{ev.get('resourceid', '').strip()}" if ev.get("resourceid") else "",  # professional_name
+            telefono,  # client_phone
+            ev.get("subject", ""),  # service_name
+            start_date,  # date
+            start_time,  # start_time
+            end_time,  # end_time
+            duration,  # duration
+            status,  # status
+            ev.get("notes", ""),  # notes
+            modalidad,  # modalidad
+        )
+        yield row
+
+
+def generar_citas(ctx: ContextoMN, output_path: Path) -> None:
+    """
+    Mapea 'events.csv' de MN Program -> plantilla-citas.csv.
+
+    Intenta relacionar eventos con clientes usando:
+    - contactid (si existe)
+    - icodcli (si está en campos relacionados con expedientes)
+    """
+    filas = escribir_csv(output_path, PLANTILLA_CITAS_HEADERS, _filas_citas(ctx))
+    print(f"[OK] Generado {output_path} ({filas} filas)")
+
+
+# ---------------------------------------------------------------------------
+# Base intermedia SQLite (--staging)
+# ---------------------------------------------------------------------------
+
+
+STAGING_VERSION = 1
+
+# CSV que se cargan en la base intermedia para cada plantilla ('clientes.csv' se carga siempre)
+CSV_STAGING = {
+    "clientes_y_bonos": (),
+    "bonos": ("Bonos.csv",),
+    "historial_basica": ("diagnosticoPac.csv",),
+    "historial_completa": ("diagnosticoPac.csv",),
+    "citas": ("events.csv",),
+}
+
+
+def _columnas_staging() -> Dict[str, Tuple[str, ...]]:
+    """
+    Columnas de cada CSV que se cargan en la base intermedia: las que lee
+    cualquiera de las plantillas, para que la misma base sirva con y sin --solo.
+    """
+    columnas: Dict[str, Dict[str, None]] = {}
+    for fuentes in (FUENTES_BONOS, FUENTES_HISTORIAL_BASICA, FUENTES_HISTORIAL_COMPLETA, FUENTES_CITAS):
+        for nombre, cols in fuentes.items():
+            columnas.setdefault(nombre, {}).update(dict.fromkeys(cols))
+    return {nombre: tuple(cols) for nombre, cols in columnas.items()}
+
+
+COLUMNAS_STAGING = _columnas_staging()
+
+
+def _ruta_staging(input_dir: Path) -> Path:
+    """Ruta de la base intermedia, junto a la carpeta de entrada (ej: 'csv desde sql de bkprogram1.staging.sqlite3')."""
+    return input_dir.with_name(input_dir.name + ".staging.sqlite3")
+
+
+def _sql_nombre(nombre: str) -> str:
+    """Nombre de tabla o columna entre comillas para SQLite."""
+    return '"' + nombre.replace('"', '""') + '"'
+
+
+class _IndiceSQLite(Mapping):
+    """Tabla de la base intermedia con una fila por clave, leída como un dict de solo lectura."""
+
+    def __init__(self, ctx: "ContextoMNStaging", tabla: str, columnas: Sequence[str], convertir: Callable) -> None:
+        self._ctx = ctx
+        self._tabla = _sql_nombre(tabla)
+        self._columnas = ", ".join(_sql_nombre(c) for c in columnas) if columnas else "NULL"
+        self._convertir = convertir
+
+    def get(self, clave: str, defecto=None):
+        fila = self._ctx.conexion().execute(
+            f"SELECT {self._columnas} FROM {self._tabla} WHERE _clave = ?", (clave,)
+        ).fetchone()
+        return defecto if fila is None else self._convertir(fila)
+
+    def __getitem__(self, clave: str):
+        valor = self.get(clave, self)
+        if valor is self:
+            raise KeyError(clave)
+        return valor
+
+    def __contains__(self, clave: object) -> bool:
+        return self.get(clave) is not None
+
+    def __len__(self) -> int:
+        return self._ctx.conexion().execute(f"SELECT COUNT(*) FROM {self._tabla}").fetchone()[0]
+
+    def __iter__(self) -> Iterator[str]:
+        return (fila[0] for fila in self._ctx.conexion().execute(f"SELECT _clave FROM {self._tabla} ORDER BY rowid"))
+
+    def values(self):
+        convertir = self._convertir
+        consulta = f"SELECT {self._columnas} FROM {self._tabla} ORDER BY rowid"
+        return (convertir(fila) for fila in self._ctx.conexion().execute(consulta))
+
+
+class ContextoMNStaging(ContextoMN):
+    """
+    ContextoMN que, en vez de leer los CSV e indexar los clientes en memoria,
+    los carga una vez en una base SQLite intermedia y genera cada plantilla
+    con una consulta que une sus filas con los clientes por la clave primaria.
+
+    - Cada CSV se carga en una tabla con las columnas que usan las plantillas
+      (COLUMNAS_STAGING), en una sola transacción con executemany.
+    - 'clientes.csv' se guarda ya como ClienteMN, con el ID como clave
+      primaria.
+    - Junto a cada tabla se guarda la firma del CSV (tamaño y fecha de
+      modificación); en la siguiente ejecución las tablas con la misma firma
+      se reutilizan sin leer el CSV.
+    - Las filas se leen de la base a medida que se escriben las plantillas,
+      así que la memoria no crece con el tamaño de los CSV.
+
+    Con --jobs, cada proceso hijo abre su propia conexión a la base.
+    """
+
+    def __init__(self, input_dir: Path, ruta: Path, estricto: bool = False) -> None:
+        super().__init__(input_dir, estricto)
+        self.ruta = ruta
+        self._conexion: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._columnas: Dict[str, Tuple[str, ...]] = {}
+        try:
+            self._abrir()
+        except sqlite3.DatabaseError:
+            if not ruta.exists():
+                raise
+            print(f"[INFO] Base intermedia no válida, se regenerará: {ruta.name}")
+            self._conexion.close()
+            ruta.unlink()
+            self._abrir()
+
+    def _abrir(self) -> None:
+        self._conexion = sqlite3.connect(str(self.ruta), isolation_level=None)
+        self._pid = os.getpid()
+        self._conexion.execute("PRAGMA synchronous=OFF")
+        self._conexion.create_function("primero_no_vacio", -1, _first_no_empty, deterministic=True)
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS _firmas (tabla TEXT PRIMARY KEY, firma TEXT, columnas TEXT)"
+        )
+
+    def conexion(self) -> sqlite3.Connection:
+        """Conexión a la base de este proceso (la del padre no se puede usar tras un fork)."""
+        if self._pid != os.getpid():
+            self._abrir()
+        return self._conexion
+
+    def _firma(self, nombre: str, columnas: Optional[Sequence[str]]) -> Dict:
+        path = self.input_dir / nombre
+        try:
+            stat = path.stat()
+            tamano, mtime_ns = stat.st_size, stat.st_mtime_ns
+        except OSError:
+            tamano = mtime_ns = None
+        return {
+            "version": STAGING_VERSION,
+            "tamano": tamano,
+            "mtime_ns": mtime_ns,
+            "columnas": list(columnas) if columnas is not None else None,
+            "estricto": self.estricto,
         }
-        out_rows.append(row)
 
-    _write_csv(output_path, PLANTILLA_CITAS_HEADERS, out_rows)
-    print(f"[OK] Generado {output_path} ({len(out_rows)} filas)")
+    def _tabla(self, nombre: str) -> Tuple[str, ...]:
+        """Columnas de la tabla de 'nombre' en la base, que se carga antes si no está o el CSV ha cambiado."""
+        columnas = self._columnas.get(nombre)
+        if columnas is not None:
+            return columnas
+        firma = json.dumps(self._firma(nombre, COLUMNAS_STAGING.get(nombre)), sort_keys=True)
+        guardada = self.conexion().execute(
+            "SELECT firma, columnas FROM _firmas WHERE tabla = ?", (nombre,)
+        ).fetchone()
+        if guardada is not None and guardada[0] == firma:
+            columnas = tuple(json.loads(guardada[1]))
+            print(f"[INFO] Usando base intermedia para {nombre}: {self.ruta.name}")
+        else:
+            with etapa(f"staging {nombre}") as e:
+                columnas, e["filas"] = self._cargar(nombre, firma)
+        self._columnas[nombre] = columnas
+        return columnas
+
+    def _cargar(self, nombre: str, firma: str) -> Tuple[Tuple[str, ...], int]:
+        """Carga el CSV 'nombre' en su tabla, en una transacción. Devuelve las columnas y las filas."""
+        if nombre == "clientes.csv":
+            key_field, clientes = _leer_clientes(self.input_dir, self.estricto)
+            columnas: Tuple[str, ...] = ClienteMN._fields
+            filas: Iterable[Tuple] = ((clave,) + tuple(cliente) for clave, cliente in clientes)
+            con_clave = True
+        else:
+            leidas = _read_csv(self.input_dir / nombre, columnas=COLUMNAS_STAGING.get(nombre), estricto=self.estricto)
+            primera = next(leidas, None)
+            columnas = tuple(primera.keys()) if primera is not None else ()
+            filas = (r.valores() for r in chain([primera], leidas)) if primera is not None else ()
+            con_clave = False
+
+        conexion = self.conexion()
+        tabla = _sql_nombre(nombre)
+        definicion = [f"{_sql_nombre(c)} TEXT" for c in columnas]
+        if con_clave:
+            definicion.insert(0, "_clave TEXT PRIMARY KEY")
+        insertar = f"INSERT INTO {tabla} VALUES ({', '.join('?' * len(definicion))})"
+
+        conexion.execute("BEGIN")
+        try:
+            conexion.execute("DELETE FROM _firmas WHERE tabla = ?", (nombre,))
+            conexion.execute(f"DROP TABLE IF EXISTS {tabla}")
+            total = 0
+            if definicion:
+                conexion.execute(f"CREATE TABLE {tabla} ({', '.join(definicion)})")
+                conexion.executemany(insertar, filas)
+                total = conexion.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+            conexion.execute(
+                "INSERT INTO _firmas VALUES (?, ?, ?)", (nombre, firma, json.dumps(list(columnas)))
+            )
+            conexion.execute("COMMIT")
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+
+        if nombre == "clientes.csv" and key_field is not None:
+            print(f"[INFO] Cargados {total} clientes desde clientes.csv (clave: '{key_field}')")
+        print(f"[INFO] {nombre} cargado en la base intermedia ({total} filas): {self.ruta.name}")
+        return columnas, total
+
+    @property
+    def clientes(self) -> Mapping:
+        if self._clientes is None:
+            self._tabla("clientes.csv")
+            self._clientes = _IndiceSQLite(self, "clientes.csv", ClienteMN._fields, ClienteMN._make)
+        return self._clientes
+
+    def leer_con_cliente(
+        self, nombre: str, columnas: Sequence[str], claves: Sequence[str]
+    ) -> Iterator[Tuple[Registro, ClienteMN]]:
+        """Como ContextoMN.leer_con_cliente, con una consulta que une la tabla del CSV con la de clientes."""
+        self.clientes
+        guardadas = self._tabla(nombre)
+        if not guardadas:
+            return
+        leidas = [c for c in guardadas if c in columnas]
+        posiciones = esquema(leidas)
+        disponibles = [f"t.{_sql_nombre(c)}" if c in guardadas else "NULL" for c in claves]
+        clave = disponibles[0] if len(claves) == 1 else f"primero_no_vacio({', '.join(disponibles)})"
+        consulta = (
+            f"SELECT {', '.join(['c._clave'] + [f't.{_sql_nombre(c)}' for c in leidas])}, "
+            f"{', '.join(f'c.{_sql_nombre(c)}' for c in ClienteMN._fields)} "
+            f"FROM {_sql_nombre(nombre)} t LEFT JOIN {_sql_nombre('clientes.csv')} c ON c._clave = {clave} "
+            "ORDER BY t.rowid"
+        )
+        n = len(leidas) + 1
+        filas = medir_iterador(self.conexion().execute(consulta), f"consulta {nombre}")
+        for fila in filas:
+            cliente = CLIENTE_VACIO if fila[0] is None else ClienteMN._make(fila[n:])
+            yield Registro(posiciones, fila[1:n]), cliente
+
+    def preparar(self, plantillas: Sequence[str]) -> None:
+        """Carga en la base (o valida) los clientes y las tablas de 'plantillas' antes de generarlas."""
+        _ = self.clientes  # carga o valida la tabla de clientes
+        for plantilla in plantillas:
+            for nombre in CSV_STAGING[plantilla]:
+                self._tabla(nombre)
+
 
+def _generar_plantilla(func: Callable[[], None]) -> None:
+    try:
+        func()
+    except CodificacionMixtaError as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        sys.exit(1)
 
 
 def main(argv: Optional[List[str]] = None) -> None:
@@ -739,11 +1170,49 @@ def main(argv: Optional[List[str]] = None) -> None:
         ],
         help="Si se indica, solo genera ese tipo de plantilla.",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help=(
+            "Número de plantillas a generar en paralelo (procesos hijos que "
+            "comparten los datos ya cargados). Por defecto 1, en serie."
+        ),
+    )
+    parser.add_argument(
+        "--encoding-estricto",
+        action="store_true",
+        help=(
+            "Comprueba la codificación de cada CSV línea a línea y se detiene "
+            "indicando la línea si un fichero mezcla UTF-8 con otra codificación"
+        ),
+    )
+    anadir_opciones_comunes(
+        parser,
+        etapas=(
+            "detección de codificación y lectura de cada CSV, índices, "
+            "generación y escritura de cada plantilla"
+        ),
+        desborde="los clientes",
+    )
+    parser.add_argument(
+        "--staging",
+        action="store_true",
+        help=(
+            "Carga los CSV que usan las plantillas en una base SQLite intermedia junto a la "
+            "carpeta de entrada ('<carpeta>.staging.sqlite3') y genera cada plantilla con "
+            "una consulta que la une con los clientes, sin guardar los CSV en memoria. Las "
+            "siguientes ejecuciones reutilizan la base mientras los CSV no cambien."
+        ),
+    )
 
     args = parser.parse_args(argv)
+    comprobar_opciones_comunes(parser, args)
 
     input_dir = Path(args.input_dir)
-    if args.output_dir is None:
+    if args.zip_output is not None:
+        output_dir = Path(args.zip_output)
+    elif args.output_dir is None:
         script_dir = Path(__file__).parent
         output_dir = script_dir
     else:
@@ -753,38 +1222,48 @@ def main(argv: Optional[List[str]] = None) -> None:
         parser.error(f"La carpeta de entrada no existe: {input_dir}")
 
     folder_suffix = _extract_folder_suffix(input_dir)
+    ctx = ContextoMN(input_dir, estricto=args.encoding_estricto)
+    if args.staging:
+        ruta_staging = _ruta_staging(input_dir)
+        try:
+            ctx = ContextoMNStaging(input_dir, ruta_staging, estricto=args.encoding_estricto)
+        except (OSError, sqlite3.Error) as e:
+            print(
+                f"[AVISO] No se pudo abrir la base intermedia {ruta_staging}: {e}. Se leen los CSV directamente.",
+                file=sys.stderr,
+            )
     
     tasks = []
 
     def add_task(name: str, func):
         if args.solo is None or args.solo == name:
-            tasks.append(func)
+            tasks.append((name, partial(_generar_plantilla, func)))
 
     add_task(
         "clientes_y_bonos",
         lambda: generar_clientes_y_bonos(
-            input_dir, output_dir / f"clientes_y_bonos_{folder_suffix}.csv"
+            ctx, output_dir / f"clientes_y_bonos_{folder_suffix}.csv"
         ),
     )
     add_task(
         "bonos",
-        lambda: generar_bonos(input_dir, output_dir / f"bonos_{folder_suffix}.csv"),
+        lambda: generar_bonos(ctx, output_dir / f"bonos_{folder_suffix}.csv"),
     )
     add_task(
         "historial_basica",
         lambda: generar_historial_basica(
-            input_dir, output_dir / f"historial_basica_{folder_suffix}.csv"
+            ctx, output_dir / f"historial_basica_{folder_suffix}.csv"
         ),
     )
     add_task(
         "historial_completa",
         lambda: generar_historial_completa(
-            input_dir, output_dir / f"historial_completa_{folder_suffix}.csv"
+            ctx, output_dir / f"historial_completa_{folder_suffix}.csv"
         ),
     )
     add_task(
         "citas",
-        lambda: generar_citas(input_dir, output_dir / f"citas_{folder_suffix}.csv"),
+        lambda: generar_citas(ctx, output_dir / f"citas_{folder_suffix}.csv"),
     )
 
     if not tasks:
@@ -794,8 +1273,20 @@ def main(argv: Optional[List[str]] = None) -> None:
         )
         return
 
-    for t in tasks:
-        t()
+    perfil = (
+        perfilar(Path(args.profile), Path(args.profile_pstats) if args.profile_pstats else None)
+        if args.profile is not None else nullcontext()
+    )
+    memoria = limitar_memoria(args.max_memory) if args.max_memory is not None else nullcontext()
+    eventos = eventos_por_stdout() if args.events == "jsonl" else nullcontext()
+    with eventos:
+        with perfil, memoria, SalidaZip(output_dir) if args.zip_output is not None else nullcontext():
+            if args.jobs > 1 or args.staging:
+                # Cargar clientes (y la base intermedia) antes de repartir las plantillas
+                # para que los procesos hijos lo hereden
+                _generar_plantilla(partial(ctx.preparar, [name for name, _ in tasks]))
+            ejecutar_tareas(tasks, args.jobs)
+        DICCIONARIOS.imprimir_resumen()
 
 
 if __name__ == "__main__":
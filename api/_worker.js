@@ -0,0 +1,75 @@
+const path = require('path');
+const { spawn } = require('child_process');
+
+// Describe el último evento de progreso del conversor para los mensajes de error
+function describeEvent(event) {
+  if (!event) return '';
+  const where = event.archivo ? ` ${event.archivo}` : '';
+  return ` (último progreso: ${event.evento}${where} a los ${event.t} s, ${event.rss_mb} MB)`;
+}
+
+// Ejecuta trabajos de conversión en un único proceso Python (comun/trabajador.py):
+// recibe un trabajo por línea JSON y devuelve una línea JSON con cada resultado,
+// precedida de los eventos de progreso del trabajo (líneas con "evento")
+function runConverterWorker(pythonCmd, cwd, jobs, timeout) {
+  return new Promise((resolve, reject) => {
+    const worker = spawn(pythonCmd, [path.join(cwd, 'comun', 'trabajador.py')], { cwd });
+    const results = [];
+    let lastEvent = null;
+    let pending = '';
+    let stderr = '';
+    let failed = false;
+    const fail = (err) => {
+      if (!failed) {
+        failed = true;
+        clearTimeout(timer);
+        worker.kill();
+        reject(err);
+      }
+    };
+    const timer = setTimeout(
+      () => fail(new Error(`Tiempo de procesamiento agotado${describeEvent(lastEvent)}`)),
+      timeout
+    );
+
+    worker.stdout.setEncoding('utf8');
+    worker.stdout.on('data', chunk => {
+      pending += chunk;
+      let newline;
+      while ((newline = pending.indexOf('\n')) >= 0) {
+        const line = pending.slice(0, newline).trim();
+        pending = pending.slice(newline + 1);
+        if (!line) continue;
+        try {
+          const message = JSON.parse(line);
+          if (message.evento) {
+            lastEvent = message;
+          } else {
+            results.push(message);
+          }
+        } catch (e) {
+          fail(new Error(`Respuesta no válida del conversor: ${line}`));
+        }
+      }
+    });
+    worker.stderr.setEncoding('utf8');
+    worker.stderr.on('data', chunk => {
+      stderr = (stderr + chunk).slice(-10000);
+    });
+    worker.on('error', fail);
+    worker.on('close', code => {
+      if (failed) return;
+      clearTimeout(timer);
+      if (results.length < jobs.length) {
+        console.error('Salida del conversor:', stderr);
+        reject(new Error(`El conversor terminó sin completar los trabajos (código ${code})${describeEvent(lastEvent)}`));
+      } else {
+        resolve(results);
+      }
+    });
+
+    worker.stdin.end(jobs.map(job => JSON.stringify({ ...job, eventos: true })).join('\n') + '\n');
+  });
+}
+
+module.exports = { describeEvent, runConverterWorker };
@@ -1,8 +1,6 @@
 const fs = require('fs');
 const path = require('path');
-const { exec } = require('child_process');
-const { promisify } = require('util');
-const execAsync = promisify(exec);
+const { runConverterWorker } = require('./_worker');
 
 // Función auxiliar para encontrar archivos recursivamente
 function findFiles(dir, extensions) {
@@ -108,54 +106,71 @@ module.exports = async function handler(req, res) {
 
     // Procesar con Python
     const pythonCmd = process.env.VERCEL ? 'python3' : (process.platform === 'win32' ? 'python' : 'python3');
-    let scriptPath = '';
-    let command = '';
+
+    const zipFileName = `resultados_${selectedPage}_${new Date().toISOString().replace(/[:.]/g, '-').slice(0, -5)}.zip`;
+    const zipPath = path.join(tmpDir, zipFileName);
+    // Con un solo archivo de entrada el conversor escribe el ZIP directamente (zip_output),
+    // sin pasar por resultsDir; con varios, cada trabajo deja sus CSV en resultsDir
+    let zipDirect = false;
+    const output = () => (zipDirect ? { zip_output: zipPath } : { output_dir: resultsDir });
+    const jobs = [];
 
     switch (selectedPage) {
       case 'clinni':
-        scriptPath = path.join(baseDir, 'CLINNI', 'script', 'clinni_to_plantillas.py');
         const csvFiles = findFiles(inputPath, ['csv', 'txt', '']);
+        zipDirect = csvFiles.length === 1;
         for (const csvFile of csvFiles) {
-          command = `${pythonCmd} "${scriptPath}" --input-file "${csvFile}" --output-dir "${resultsDir}" --plantillas-dir "${baseDir}"`;
-          await execAsync(command, { cwd: baseDir, timeout: 50000 });
+          jobs.push({ origen: 'clinni', entrada: csvFile, plantillas_dir: baseDir, ...output() });
         }
         break;
       case 'dricloud':
-        scriptPath = path.join(baseDir, 'DRICloud', 'script', 'dricloud_to_plantillas.py');
         const xmlFiles = findFiles(inputPath, ['xml']);
+        zipDirect = xmlFiles.length === 1;
         for (const xmlFile of xmlFiles) {
-          command = `${pythonCmd} "${scriptPath}" --input-xml "${xmlFile}" --output-dir "${resultsDir}" --plantillas-dir "${baseDir}"`;
-          await execAsync(command, { cwd: baseDir, timeout: 50000 });
+          jobs.push({ origen: 'dricloud', entrada: xmlFile, plantillas_dir: baseDir, ...output() });
         }
         break;
       case 'mnprogram':
-        scriptPath = path.join(baseDir, 'MN Program', 'script', 'mn_program_to_plantillas.py');
-        command = `${pythonCmd} "${scriptPath}" --input-dir "${inputPath}" --output-dir "${resultsDir}"`;
-        await execAsync(command, { cwd: baseDir, timeout: 50000 });
+        zipDirect = true;
+        jobs.push({ origen: 'mnprogram', entrada: inputPath, ...output() });
         break;
     }
 
-    // Buscar CSV generados
-    const generatedCsvFiles = findFiles(resultsDir, ['csv']);
-    
-    if (generatedCsvFiles.length === 0) {
-      throw new Error('No se generaron archivos CSV');
+    // Todos los archivos se convierten en un mismo proceso Python
+    const results = jobs.length ? await runConverterWorker(pythonCmd, baseDir, jobs, 50000) : [];
+    const failedJob = results.find(r => !r.ok);
+    if (failedJob) {
+      throw new Error(failedJob.error);
     }
 
-    // Crear ZIP
-    const zipFileName = `resultados_${selectedPage}_${new Date().toISOString().replace(/[:.]/g, '-').slice(0, -5)}.zip`;
-    const zipPath = path.join(tmpDir, zipFileName);
-    
-    const zipCreated = createZip(generatedCsvFiles, zipPath);
-    
-    if (!zipCreated) {
-      return res.json({
-        success: true,
-        message: `Archivos procesados. ${generatedCsvFiles.length} archivo(s) generado(s).`,
-        individual_files: generatedCsvFiles.map(f => path.basename(f)),
-        files_count: generatedCsvFiles.length,
-        zip_created: false
-      });
+    let filesCount = 0;
+    if (zipDirect) {
+      // El conversor ya ha escrito el ZIP (CSV comprimidos y manifiesto SHA256SUMS)
+      filesCount = results.reduce((n, r) => n + r.plantillas.length, 0);
+      if (filesCount === 0 || !fs.existsSync(zipPath)) {
+        throw new Error('No se generaron archivos CSV');
+      }
+    } else {
+      // Buscar CSV generados
+      const generatedCsvFiles = findFiles(resultsDir, ['csv']);
+      
+      if (generatedCsvFiles.length === 0) {
+        throw new Error('No se generaron archivos CSV');
+      }
+
+      // Crear ZIP
+      const zipCreated = createZip(generatedCsvFiles, zipPath);
+      
+      if (!zipCreated) {
+        return res.json({
+          success: true,
+          message: `Archivos procesados. ${generatedCsvFiles.length} archivo(s) generado(s).`,
+          individual_files: generatedCsvFiles.map(f => path.basename(f)),
+          files_count: generatedCsvFiles.length,
+          zip_created: false
+        });
+      }
+      filesCount = generatedCsvFiles.length;
     }
 
     // Leer ZIP y devolver como base64
@@ -172,10 +187,10 @@ module.exports = async function handler(req, res) {
 
     return res.json({
       success: true,
-      message: `Archivos procesados exitosamente. ${generatedCsvFiles.length} archivo(s) generado(s).`,
+      message: `Archivos procesados exitosamente. ${filesCount} archivo(s) generado(s).`,
       zip_base64: zipBase64,
       filename: zipFileName,
-      files_count: generatedCsvFiles.length,
+      files_count: filesCount,
       zip_created: true
     });
 
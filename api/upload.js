@@ -3,6 +3,7 @@ const fs = require('fs');
 const path = require('path');
 const { exec } = require('child_process');
 const { promisify } = require('util');
+const { runConverterWorker } = require('./_worker');
 const execAsync = promisify(exec);
 
 // Configuración
@@ -211,15 +212,28 @@ module.exports = async function handler(req, res) {
       }
     }
 
-    // Determinar script Python según la base de datos
-    let scriptPath = '';
-    let command = '';
     const projectRoot = baseDir;
 
+    // Crear directorio downloads si no existe
+    // En Vercel, guardar en /tmp/downloads temporalmente
+    const downloadsBase = process.env.VERCEL ? '/tmp' : projectRoot;
+    const downloadsDir = path.join(downloadsBase, 'downloads');
+    if (!fs.existsSync(downloadsDir)) {
+      fs.mkdirSync(downloadsDir, { recursive: true });
+    }
+
+    const zipFileName = `resultados_${selectedPage}_${new Date().toISOString().replace(/[:.]/g, '-').slice(0, -5)}.zip`;
+    const zipPath = path.join(downloadsDir, zipFileName);
+    // Con un solo archivo de entrada el conversor escribe el ZIP directamente (zip_output),
+    // sin pasar por resultsDir; con varios, cada trabajo deja sus CSV en resultsDir
+    let zipDirect = false;
+    const output = () => (zipDirect ? { zip_output: zipPath } : { output_dir: resultsDir });
+
+    // Trabajos para el conversor Python según la base de datos
+    const jobs = [];
+
     switch (selectedPage) {
       case 'clinni':
-        scriptPath = path.join(projectRoot, 'CLINNI', 'script', 'clinni_to_plantillas.py');
-        
         // Buscar archivos CSV/TXT en el directorio
         const csvFiles = findFiles(inputPath, ['csv', 'txt', '']);
         
@@ -227,29 +241,14 @@ module.exports = async function handler(req, res) {
           throw new Error('No se encontraron archivos CSV válidos');
         }
 
-        // Procesar cada archivo CSV
+        // Un trabajo por archivo CSV
+        zipDirect = csvFiles.length === 1;
         for (const csvFile of csvFiles) {
-          const inputPathEscaped = `"${csvFile}"`;
-          const resultsDirEscaped = `"${resultsDir}"`;
-          const projectRootEscaped = `"${projectRoot}"`;
-          
-          command = `${pythonCmd} "${scriptPath}" --input-file ${inputPathEscaped} --output-dir ${resultsDirEscaped} --plantillas-dir ${projectRootEscaped}`;
-          
-          const { stdout, stderr } = await execAsync(command, {
-            cwd: projectRoot,
-            maxBuffer: 10 * 1024 * 1024, // 10MB
-            timeout: MAX_EXECUTION_TIME
-          });
-          
-          if (stderr && !stderr.includes('[INFO]') && !stderr.includes('[OK]')) {
-            console.error('Error al procesar:', stderr);
-          }
+          jobs.push({ origen: 'clinni', entrada: csvFile, plantillas_dir: projectRoot, ...output() });
         }
         break;
 
       case 'dricloud':
-        scriptPath = path.join(projectRoot, 'DRICloud', 'script', 'dricloud_to_plantillas.py');
-        
         // Buscar archivos XML
         const xmlFiles = findFiles(inputPath, ['xml']);
         
@@ -257,89 +256,69 @@ module.exports = async function handler(req, res) {
           throw new Error('No se encontraron archivos XML válidos');
         }
 
-        // Procesar cada archivo XML
+        // Un trabajo por archivo XML
+        zipDirect = xmlFiles.length === 1;
         for (const xmlFile of xmlFiles) {
-          const inputPathEscaped = `"${xmlFile}"`;
-          const resultsDirEscaped = `"${resultsDir}"`;
-          const projectRootEscaped = `"${projectRoot}"`;
-          
-          command = `${pythonCmd} "${scriptPath}" --input-xml ${inputPathEscaped} --output-dir ${resultsDirEscaped} --plantillas-dir ${projectRootEscaped}`;
-          
-          const { stdout, stderr } = await execAsync(command, {
-            cwd: projectRoot,
-            maxBuffer: 10 * 1024 * 1024,
-            timeout: MAX_EXECUTION_TIME
-          });
-          
-          if (stderr && !stderr.includes('[INFO]') && !stderr.includes('[OK]')) {
-            console.error('Error al procesar:', stderr);
-          }
+          jobs.push({ origen: 'dricloud', entrada: xmlFile, plantillas_dir: projectRoot, ...output() });
         }
         break;
 
       case 'mnprogram':
-        scriptPath = path.join(projectRoot, 'MN Program', 'script', 'mn_program_to_plantillas.py');
-        const inputDirEscaped = `"${inputPath}"`;
-        const resultsDirEscaped = `"${resultsDir}"`;
-        
-        command = `${pythonCmd} "${scriptPath}" --input-dir ${inputDirEscaped} --output-dir ${resultsDirEscaped}`;
-        
-        const { stdout, stderr } = await execAsync(command, {
-          cwd: projectRoot,
-          maxBuffer: 10 * 1024 * 1024,
-          timeout: MAX_EXECUTION_TIME
-        });
-        
-        if (stderr && !stderr.includes('[INFO]') && !stderr.includes('[OK]')) {
-          console.error('Error al procesar:', stderr);
-        }
+        zipDirect = true;
+        jobs.push({ origen: 'mnprogram', entrada: inputPath, ...output() });
         break;
     }
 
-    // Buscar archivos CSV generados
-    const generatedCsvFiles = findFiles(resultsDir, ['csv']);
-    
-    if (generatedCsvFiles.length === 0) {
-      throw new Error('No se generaron archivos CSV. Verifica el script y los datos de entrada.');
+    // Todos los archivos se convierten en un mismo proceso Python
+    const results = await runConverterWorker(pythonCmd, projectRoot, jobs, MAX_EXECUTION_TIME);
+    const failedJob = results.find(r => !r.ok);
+    if (failedJob) {
+      throw new Error(failedJob.error);
     }
 
-    // Crear directorio downloads si no existe
-    // En Vercel, guardar en /tmp/downloads temporalmente
-    const downloadsBase = process.env.VERCEL ? '/tmp' : projectRoot;
-    const downloadsDir = path.join(downloadsBase, 'downloads');
-    if (!fs.existsSync(downloadsDir)) {
-      fs.mkdirSync(downloadsDir, { recursive: true });
-    }
+    let filesCount = 0;
+    if (zipDirect) {
+      // El conversor ya ha escrito el ZIP (CSV comprimidos y manifiesto SHA256SUMS)
+      filesCount = results.reduce((n, r) => n + r.plantillas.length, 0);
+      if (filesCount === 0 || !fs.existsSync(zipPath)) {
+        throw new Error('No se generaron archivos CSV. Verifica el script y los datos de entrada.');
+      }
+    } else {
+      // Buscar archivos CSV generados
+      const generatedCsvFiles = findFiles(resultsDir, ['csv']);
+      
+      if (generatedCsvFiles.length === 0) {
+        throw new Error('No se generaron archivos CSV. Verifica el script y los datos de entrada.');
+      }
 
-    // Crear ZIP
-    const zipFileName = `resultados_${selectedPage}_${new Date().toISOString().replace(/[:.]/g, '-').slice(0, -5)}.zip`;
-    const zipPath = path.join(downloadsDir, zipFileName);
-    
-    let zipCreated = false;
-    try {
-      zipCreated = createZip(generatedCsvFiles, zipPath);
-    } catch (e) {
-      console.error('Error al crear ZIP:', e);
-    }
+      // Crear ZIP
+      let zipCreated = false;
+      try {
+        zipCreated = createZip(generatedCsvFiles, zipPath);
+      } catch (e) {
+        console.error('Error al crear ZIP:', e);
+      }
 
-    if (!zipCreated) {
-      // Si no se pudo crear ZIP, copiar archivos individuales
-      const individualFiles = [];
-      for (const csvFile of generatedCsvFiles) {
-        const destFile = path.join(downloadsDir, path.basename(csvFile));
-        fs.copyFileSync(csvFile, destFile);
-        individualFiles.push(path.basename(csvFile));
+      if (!zipCreated) {
+        // Si no se pudo crear ZIP, copiar archivos individuales
+        const individualFiles = [];
+        for (const csvFile of generatedCsvFiles) {
+          const destFile = path.join(downloadsDir, path.basename(csvFile));
+          fs.copyFileSync(csvFile, destFile);
+          individualFiles.push(path.basename(csvFile));
+        }
+        
+        return res.json({
+          success: true,
+          message: `Archivos procesados exitosamente. ${individualFiles.length} archivo(s) generado(s).`,
+          download_url: null,
+          individual_files: individualFiles,
+          downloads_dir: 'downloads/',
+          files_count: individualFiles.length,
+          zip_created: false
+        });
       }
-      
-      return res.json({
-        success: true,
-        message: `Archivos procesados exitosamente. ${individualFiles.length} archivo(s) generado(s).`,
-        download_url: null,
-        individual_files: individualFiles,
-        downloads_dir: 'downloads/',
-        files_count: individualFiles.length,
-        zip_created: false
-      });
+      filesCount = generatedCsvFiles.length;
     }
 
     // Limpiar archivos temporales (opcional, comentar para debug)
@@ -352,10 +331,10 @@ module.exports = async function handler(req, res) {
     
     // Preparar respuesta con ZIP
     response.success = true;
-    response.message = `Archivos procesados exitosamente. ${generatedCsvFiles.length} archivo(s) generado(s).`;
+    response.message = `Archivos procesados exitosamente. ${filesCount} archivo(s) generado(s).`;
     response.download_url = `/api/download?file=${encodeURIComponent(zipFileName)}`;
     response.filename = zipFileName;
-    response.files_count = generatedCsvFiles.length;
+    response.files_count = filesCount;
     response.zip_created = true;
     response.zip_base64 = zipBase64; // Incluir ZIP en base64 para descarga directa
 
@@ -0,0 +1 @@
+"""Benchmarks de los conversores a plantillas (no forman parte del despliegue)."""
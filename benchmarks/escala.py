@@ -0,0 +1,339 @@
+"""
+Benchmark de escala de los conversores con datos sintéticos.
+
+Uso:
+    python3 benchmarks/escala.py --tamanos 10k,100k,1M --salida escala.json
+    python3 benchmarks/escala.py --conversores dricloud --tamanos 10M --datos-dir /tmp/datos
+    python3 benchmarks/escala.py --tamanos 100k --comparar escala.json
+
+Para cada conversor y tamaño (registros aproximados de la entrada, sumando
+todas sus tablas) genera una entrada con benchmarks/sinteticos.py y mide
+cada etapa por separado:
+
+- CLINNI (JSON plano y .gz): lectura (leer_archivo_clinni) y cada plantilla.
+- DRICloud: carga (cargar_tablas_relacionadas) y cada plantilla.
+- MN Program: carga de clientes.csv y cada plantilla (que lee su propio CSV).
+
+De cada etapa se da registros/s (registros leídos o filas escritas), MB/s
+(de la entrada en la carga, tal como está en disco; de la plantilla escrita
+en las demás) y rss_pico_mb, el pico de memoria del proceso hasta el final de
+la etapa. Cada medida se hace en un proceso nuevo para que los picos de
+memoria de una no se mezclen con los de otra.
+
+El informe JSON se escribe en --salida (o por stdout) y el resumen legible
+por stderr. Con --comparar se indica, por etapa, el cambio de registros/s
+respecto a un informe anterior.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Raíz del proyecto en el path para importar benchmarks/ y comun/ también al ejecutarlo como script
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from benchmarks import sinteticos
+from benchmarks.utilidades import PLANTILLAS, RAIZ, cargar_conversor, entorno
+from comun.rss import rss_pico_mb
+from comun.salida_csv import registrar_plantillas
+
+
+# conversor -> formatos de entrada que se generan y miden
+FORMATOS = {
+    "clinni": ("json", "gz"),
+    "dricloud": ("xml",),
+    "mnprogram": ("csv",),
+}
+
+TAMANOS_POR_DEFECTO = "10k,100k"
+
+SUFIJOS_TAMANO = {"k": 1_000, "m": 1_000_000}
+
+
+def _tamano(valor: str) -> int:
+    """'10k' -> 10000, '1M' -> 1000000."""
+    valor = valor.strip().lower()
+    factor = SUFIJOS_TAMANO.get(valor[-1:], 1)
+    if factor != 1:
+        valor = valor[:-1]
+    return int(float(valor) * factor)
+
+
+def _mb(n_bytes: int) -> float:
+    return n_bytes / (1024 * 1024)
+
+
+def _tamano_entrada(ruta: Path) -> int:
+    if ruta.is_dir():
+        return sum(p.stat().st_size for p in ruta.iterdir() if p.is_file())
+    return ruta.stat().st_size
+
+
+# ---------------------------------------------------------------------------
+# Preparación de las entradas
+# ---------------------------------------------------------------------------
+
+
+def preparar_entrada(conversor: str, formato: str, registros: int, datos_dir: Path) -> Tuple[Path, Dict[str, int]]:
+    """
+    Devuelve la entrada sintética pedida y cuántos registros tiene de cada tabla.
+
+    Si ya está en 'datos_dir' (de una ejecución anterior con --datos-dir) se
+    reutiliza; generar las entradas grandes tarda más que medirlas.
+    """
+    nombres = {
+        ("clinni", "json"): f"clinni_{registros}.json",
+        ("clinni", "gz"): f"clinni_{registros}.json.gz",
+        ("dricloud", "xml"): f"dricloud_{registros}.xml",
+        ("mnprogram", "csv"): f"csv desde sql de bkprogram_{registros}",
+    }
+    ruta = datos_dir / nombres[(conversor, formato)]
+    recuento = ruta.with_name(ruta.name + ".recuento.json")
+    if ruta.exists() and recuento.exists():
+        return ruta, json.loads(recuento.read_text(encoding="utf-8"))
+
+    print(f"[INFO] Generando {ruta.name} ...", file=sys.stderr)
+    inicio = time.perf_counter()
+    if conversor == "clinni":
+        cuenta = sinteticos.generar_clinni(ruta, registros, comprimido=(formato == "gz"))
+    elif conversor == "dricloud":
+        cuenta = sinteticos.generar_dricloud(ruta, registros)
+    else:
+        cuenta = sinteticos.generar_mn_program(ruta, registros)
+    recuento.write_text(json.dumps(cuenta), encoding="utf-8")
+    print(
+        f"[INFO] {ruta.name}: {sum(cuenta.values())} registros, "
+        f"{_mb(_tamano_entrada(ruta)):.1f} MB en {time.perf_counter() - inicio:.1f} s",
+        file=sys.stderr,
+    )
+    return ruta, cuenta
+
+
+# ---------------------------------------------------------------------------
+# Medida (en un proceso nuevo)
+# ---------------------------------------------------------------------------
+
+
+def _etapa(nombre: str, func: Callable[[], Tuple[int, int]]) -> Dict[str, object]:
+    """Ejecuta una etapa, que devuelve (registros, bytes), y calcula sus tasas."""
+    inicio = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        registros, n_bytes = func()
+    segundos = time.perf_counter() - inicio
+    return {
+        "etapa": nombre,
+        "segundos": round(segundos, 4),
+        "registros": registros,
+        "registros_s": round(registros / segundos, 1) if segundos else None,
+        "mb": round(_mb(n_bytes), 2),
+        "mb_s": round(_mb(n_bytes) / segundos, 2) if segundos else None,
+        "rss_pico_mb": rss_pico_mb(),
+    }
+
+
+def _plantilla(generar: Callable[[Path], None], salida: Path) -> Tuple[int, int]:
+    """Genera una plantilla en 'salida' y devuelve (filas, bytes); el CSV se borra después."""
+    with registrar_plantillas() as generadas:
+        generar(salida)
+    filas = sum(n for _, n in generadas)
+    n_bytes = salida.stat().st_size
+    salida.unlink()
+    return filas, n_bytes
+
+
+def medir(conversor: str, ruta: Path, salida_dir: Path) -> List[Dict[str, object]]:
+    """Mide la carga de 'ruta' y la generación de cada plantilla con el conversor indicado."""
+    modulo = cargar_conversor(conversor)
+    salida_dir.mkdir(parents=True, exist_ok=True)
+    etapas = [{"etapa": "inicio", "rss_pico_mb": rss_pico_mb()}]
+
+    if conversor == "clinni":
+        datos: Dict = {}
+
+        def lectura() -> Tuple[int, int]:
+            datos.update(modulo.leer_archivo_clinni(ruta))
+            return sum(len(v) for v in datos.values()), ruta.stat().st_size
+
+        etapas.append(_etapa("lectura", lectura))
+        for nombre in PLANTILLAS:
+            generar = getattr(modulo, f"generar_{nombre}")
+            plantilla = RAIZ / modulo.ARCHIVOS_PLANTILLA[nombre]
+            etapas.append(_etapa(nombre, lambda: _plantilla(
+                lambda salida: generar(datos, salida, plantilla), salida_dir / f"{nombre}.csv"
+            )))
+
+    elif conversor == "dricloud":
+        tablas: Dict = {}
+
+        def carga() -> Tuple[int, int]:
+            tablas.update(modulo.cargar_tablas_relacionadas(ruta))
+            return sum(len(t) for t in tablas.values()), ruta.stat().st_size
+
+        etapas.append(_etapa("carga", carga))
+        for nombre in PLANTILLAS:
+            generar = getattr(modulo, f"generar_{nombre}")
+            plantilla = RAIZ / modulo.ARCHIVOS_PLANTILLA[nombre]
+            etapas.append(_etapa(nombre, lambda: _plantilla(
+                lambda salida: generar(ruta, tablas, salida, plantilla), salida_dir / f"{nombre}.csv"
+            )))
+
+    else:
+        ctx = modulo.ContextoMN(ruta)
+        etapas.append(_etapa(
+            "carga_clientes", lambda: (len(ctx.clientes), (ruta / "clientes.csv").stat().st_size)
+        ))
+        for nombre in PLANTILLAS:
+            generar = getattr(modulo, f"generar_{nombre}")
+            etapas.append(_etapa(nombre, lambda: _plantilla(
+                lambda salida: generar(ctx, salida), salida_dir / f"{nombre}.csv"
+            )))
+
+    return etapas
+
+
+def _medir_en_proceso_nuevo(conversor: str, ruta: Path, salida_dir: Path) -> List[Dict[str, object]]:
+    # 'spawn' y no fork: el proceso hijo empieza sin la memoria del que lo lanza
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(medir, conversor, ruta, salida_dir).result()
+
+
+# ---------------------------------------------------------------------------
+# Informe
+# ---------------------------------------------------------------------------
+
+
+def _clave(resultado: Dict, etapa: Dict) -> Tuple:
+    return resultado["conversor"], resultado["formato"], resultado["tamano"], etapa["etapa"]
+
+
+def imprimir_resumen(resultados: List[Dict], anterior: Optional[Dict] = None) -> None:
+    """Escribe por stderr una tabla con las medidas (y el cambio respecto a 'anterior')."""
+    previas: Dict[Tuple, float] = {}
+    if anterior is not None:
+        for r in anterior.get("resultados", []):
+            for e in r.get("etapas", []):
+                if e.get("registros_s"):
+                    previas[_clave(r, e)] = e["registros_s"]
+
+    print(
+        f"\n{'conversor':<10} {'formato':<7} {'tamaño':>9} {'etapa':<20} {'s':>9} "
+        f"{'registros/s':>12} {'MB/s':>8} {'RSS MB':>8}" + ("  cambio" if anterior else ""),
+        file=sys.stderr,
+    )
+    for r in resultados:
+        for e in r["etapas"]:
+            if "segundos" not in e:
+                continue
+            linea = (
+                f"{r['conversor']:<10} {r['formato']:<7} {r['tamano']:>9} {e['etapa']:<20} "
+                f"{e['segundos']:>9.3f} {e['registros_s'] or 0:>12.0f} {e['mb_s'] or 0:>8.1f} "
+                f"{e['rss_pico_mb'] or 0:>8.1f}"
+            )
+            previa = previas.get(_clave(r, e))
+            if previa and e["registros_s"]:
+                linea += f"  {(e['registros_s'] / previa - 1) * 100:+6.1f}%"
+            print(linea, file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark de escala de los conversores con datos sintéticos."
+    )
+    parser.add_argument(
+        "--tamanos",
+        default=TAMANOS_POR_DEFECTO,
+        help=(
+            "Registros aproximados de cada entrada, separados por comas; admite "
+            f"sufijos k y M (por defecto {TAMANOS_POR_DEFECTO})."
+        ),
+    )
+    parser.add_argument(
+        "--conversores",
+        default=",".join(FORMATOS),
+        help=f"Conversores a medir, separados por comas (por defecto {','.join(FORMATOS)}).",
+    )
+    parser.add_argument(
+        "--datos-dir",
+        default=None,
+        help=(
+            "Carpeta donde se guardan las entradas sintéticas para reutilizarlas en "
+            "otras ejecuciones (por defecto, una carpeta temporal que se borra al terminar)."
+        ),
+    )
+    parser.add_argument(
+        "--salida",
+        default=None,
+        help="Archivo JSON donde se escribe el informe (por defecto, stdout).",
+    )
+    parser.add_argument(
+        "--comparar",
+        default=None,
+        help="Informe JSON anterior con el que comparar los registros/s de cada etapa.",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        tamanos = [_tamano(t) for t in args.tamanos.split(",") if t.strip()]
+    except ValueError:
+        parser.error(f"Tamaños no válidos: {args.tamanos}")
+    if not tamanos or min(tamanos) < 1:
+        parser.error("Cada tamaño debe ser 1 o mayor")
+    conversores = [c.strip() for c in args.conversores.split(",") if c.strip()]
+    for c in conversores:
+        if c not in FORMATOS:
+            parser.error(f"Conversor no válido: {c} (se espera uno de {', '.join(FORMATOS)})")
+    anterior = None
+    if args.comparar is not None:
+        anterior = json.loads(Path(args.comparar).read_text(encoding="utf-8"))
+
+    temporal = None
+    if args.datos_dir is None:
+        temporal = tempfile.mkdtemp(prefix="bench_escala_")
+        datos_dir = Path(temporal)
+    else:
+        datos_dir = Path(args.datos_dir)
+        datos_dir.mkdir(parents=True, exist_ok=True)
+
+    resultados = []
+    try:
+        for registros in tamanos:
+            for conversor in conversores:
+                for formato in FORMATOS[conversor]:
+                    ruta, cuenta = preparar_entrada(conversor, formato, registros, datos_dir)
+                    print(f"[INFO] Midiendo {conversor} ({formato}, {registros} registros)", file=sys.stderr)
+                    salida_dir = Path(tempfile.mkdtemp(prefix="bench_salida_"))
+                    try:
+                        etapas = _medir_en_proceso_nuevo(conversor, ruta, salida_dir)
+                    finally:
+                        shutil.rmtree(salida_dir, ignore_errors=True)
+                    resultados.append({
+                        "conversor": conversor,
+                        "formato": formato,
+                        "tamano": registros,
+                        "entrada_mb": round(_mb(_tamano_entrada(ruta)), 2),
+                        "registros_entrada": cuenta,
+                        "etapas": etapas,
+                    })
+    finally:
+        if temporal is not None:
+            shutil.rmtree(temporal, ignore_errors=True)
+
+    informe = {"entorno": entorno(), "resultados": resultados}
+    imprimir_resumen(resultados, anterior)
+    texto = json.dumps(informe, ensure_ascii=False, indent=2)
+    if args.salida is None:
+        print(texto)
+    else:
+        Path(args.salida).write_text(texto + "\n", encoding="utf-8")
+        print(f"\n[OK] Informe guardado en {args.salida}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
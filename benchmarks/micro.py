@@ -0,0 +1,331 @@
+"""
+Microbenchmarks de las funciones auxiliares que se llaman una o más veces por fila.
+
+Uso:
+    python3 benchmarks/micro.py                      # mide y compara con la línea base
+    python3 benchmarks/micro.py --solo limpiar_html formatear_fecha
+    python3 benchmarks/micro.py --guardar-base       # mide y guarda la nueva línea base
+
+Cada función se llama sobre una lista fija de entradas (misma semilla en cada
+ejecución) con la mezcla de valores que aparece en las exportaciones: cadenas
+vacías, notas con mucho HTML, fechas en varios formatos, bonos con y sin
+usos... La pasada se repite varias veces; las funciones con lru_cache
+empiezan cada pasada con la caché vacía, como al empezar una conversión.
+
+Los tiempos absolutos dependen de la máquina y de su carga, así que cada
+pasada se alterna con otra de una función de referencia en Python puro y se
+guarda la mediana del cociente entre ambas ('relativo'). Es ese valor el que
+se compara con la línea base (benchmarks/micro_base.json): si alguna función
+es más lenta que la base en más de --tolerancia, se indica como REGRESIÓN y
+se termina con código 1.
+"""
+import argparse
+import gc
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Raíz del proyecto en el path para importar benchmarks/ y comun/ también al ejecutarlo como script
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from benchmarks import sinteticos
+from benchmarks.utilidades import cargar_conversor, entorno
+from comun import fechas
+
+
+LINEA_BASE = Path(__file__).with_name("micro_base.json")
+
+SEMILLA = 2024
+ENTRADAS = 20000
+REPETICIONES = 25
+TOLERANCIA = 0.25
+
+Entradas = List[Tuple]
+
+
+# ---------------------------------------------------------------------------
+# Entradas de cada función
+# ---------------------------------------------------------------------------
+
+
+def _entradas_first_no_empty(rng: random.Random, n: int) -> Entradas:
+    # Alias de un campo: de 2 a 6 columnas candidatas, casi siempre alguna vacía o ausente
+    valores = [None, None, "", "", "   ", 42, "María", "García López", "600123456", "Madrid"]
+    return [tuple(rng.choice(valores) for _ in range(rng.randint(2, 6))) for _ in range(n)]
+
+
+def _dias(rng: random.Random) -> List[str]:
+    """Unos 3000 días distintos en ISO, como los de varios años de agenda."""
+    return [f"{rng.randint(2019, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" for _ in range(3000)]
+
+
+def _entradas_formatear_fecha(rng: random.Random, n: int) -> Entradas:
+    dias = _dias(rng)
+    formatos = (
+        (0.30, lambda d: d),                                       # ISO
+        (0.30, lambda d: f"{d}T{rng.randint(8, 20):02d}:00:00"),   # ISO con hora (DRICloud)
+        (0.20, lambda d: f"{d} 00:00:00.000"),                     # datetime de SQL Server (MN Program)
+        (0.10, lambda d: f"{d[8:10]}/{d[5:7]}/{d[:4]}"),           # DD/MM/YYYY, se deja igual
+        (0.10, lambda d: ""),
+    )
+    return [(_elegir(rng, formatos)(rng.choice(dias)),) for _ in range(n)]
+
+
+def _entradas_formatear_hora(rng: random.Random, n: int) -> Entradas:
+    dias = _dias(rng)
+    franjas = [f"{h:02d}:{m:02d}:00" for h in range(8, 21) for m in (0, 15, 30, 45)]
+    formatos = (
+        (0.50, lambda d: f"{d}T{rng.choice(franjas)}"),
+        (0.20, lambda d: f"{d} {rng.choice(franjas)}.000"),
+        (0.10, lambda d: d),
+        (0.20, lambda d: ""),
+    )
+    return [(_elegir(rng, formatos)(rng.choice(dias)),) for _ in range(n)]
+
+
+def _entradas_limpiar_html(rng: random.Random, n: int) -> Entradas:
+    # Notas pegadas desde un editor: muchos bloques con estilos en línea
+    pesada = "".join(
+        f'<p style="margin:0;font-family:Calibri"><span style="font-size:11pt">{rng.choice(sinteticos.NOTAS)}'
+        f"</span></p>\n\n"
+        for _ in range(12)
+    )
+    sencillas = [nota for nota in sinteticos.NOTAS if nota]
+    formatos = (
+        (0.20, lambda: ""),
+        (0.30, lambda: rng.choice(sinteticos.DIAGNOSTICOS) + " " + rng.choice(sencillas)),
+        (0.30, lambda: f"<p>{rng.choice(sinteticos.DIAGNOSTICOS)}</p>  <br>{rng.choice(sencillas)}"),
+        (0.20, lambda: pesada),
+    )
+    return [(_elegir(rng, formatos)(),) for _ in range(n)]
+
+
+def _entradas_calcular_sesiones_consumidas(rng: random.Random, n: int) -> Entradas:
+    entradas = []
+    for i in range(n):
+        sesiones = rng.choice((5, 10, 20))
+        bono = {
+            "PAC_BON_ID": str(i), "PAC_ID": str(rng.randint(1, 50000)),
+            "PAC_BON_CABECERA": f"Bono {sesiones}", "PAC_BON_PRECIO": "280.0000",
+            "PAC_BON_NUM_SESIONES": str(sesiones), "PAC_BON_PAGADO": "1",
+            "PAC_BON_FECHA_VENCIMIENTO": "2026-05-01T00:00:00",
+        }
+        tipo = rng.random()
+        if tipo < 0.60:
+            bono["PAC_BON_USOS"] = str(rng.randint(0, sesiones))
+        elif tipo < 0.85:
+            # Sin usos: se calculan desde las sesiones sin consumir
+            bono["PAC_BON_SIN_CONSUMIR"] = str(rng.randint(0, sesiones))
+        elif tipo < 0.95:
+            pass
+        else:
+            bono["PAC_BON_SIN_CONSUMIR"] = "n/d"
+        entradas.append((bono,))
+    return entradas
+
+
+def _entradas_sanitize_filename(rng: random.Random, n: int) -> Entradas:
+    nombres = [
+        "Completa_2536.xml", "general_export_2026_01_15 (1)", "Exportación clínica Núria.xml",
+        "backup  final -- v2.json.gz", "C:/Users/recepcion/Desktop/DRICloud/Completa.xml",
+        "csv desde sql de bkprogram1", "pacientes.2025.10.txt",
+    ]
+    return [(rng.choice(nombres),) for _ in range(n)]
+
+
+def _elegir(rng: random.Random, opciones: Sequence[Tuple[float, Callable]]) -> Callable:
+    """Elige una de las opciones (probabilidad, valor) según su probabilidad."""
+    r = rng.random()
+    for probabilidad, valor in opciones:
+        if r < probabilidad:
+            return valor
+        r -= probabilidad
+    return opciones[-1][1]
+
+
+# nombre -> (función a medir, generador de sus entradas). Las tres copias de
+# _first_no_empty son iguales; se mide la de CLINNI.
+CASOS: Dict[str, Tuple[Callable[[], Callable], Callable[[random.Random, int], Entradas]]] = {
+    "_first_no_empty": (lambda: cargar_conversor("clinni")._first_no_empty, _entradas_first_no_empty),
+    "formatear_fecha": (lambda: fechas.formatear_fecha, _entradas_formatear_fecha),
+    "formatear_hora": (lambda: fechas.formatear_hora, _entradas_formatear_hora),
+    "limpiar_html": (lambda: cargar_conversor("clinni").limpiar_html, _entradas_limpiar_html),
+    "calcular_sesiones_consumidas": (
+        lambda: cargar_conversor("dricloud").calcular_sesiones_consumidas,
+        _entradas_calcular_sesiones_consumidas,
+    ),
+    "_sanitize_filename": (lambda: cargar_conversor("dricloud")._sanitize_filename, _entradas_sanitize_filename),
+}
+
+
+# ---------------------------------------------------------------------------
+# Medida
+# ---------------------------------------------------------------------------
+
+
+def _referencia(valor: str) -> str:
+    """Carga fija en Python puro con la que se comparan las demás medidas."""
+    if valor is not None and valor.strip() != "":
+        return valor.upper()
+    return ""
+
+
+def _pasada(func: Callable, entradas: Entradas) -> int:
+    limpiar_cache = getattr(func, "cache_clear", None)
+    if limpiar_cache is not None:
+        limpiar_cache()
+    inicio = time.perf_counter_ns()
+    for args in entradas:
+        func(*args)
+    return time.perf_counter_ns() - inicio
+
+
+def medir(func: Callable, entradas: Entradas, referencia: Entradas, repeticiones: int) -> Tuple[float, float, float]:
+    """
+    Mide 'func' sobre 'entradas' alternando cada pasada con una de _referencia
+    sobre 'referencia', para que las dos se midan en las mismas condiciones.
+
+    Devuelve los nanosegundos por llamada de la pasada más rápida de cada una
+    y la mediana, entre repeticiones, del cociente func / referencia de cada
+    pareja de pasadas (menos sensible a una máquina cargada que el mínimo).
+    """
+    mejor = mejor_referencia = float("inf")
+    cocientes = []
+    gc_activo = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeticiones):
+            ns_referencia = _pasada(_referencia, referencia) / len(referencia)
+            ns = _pasada(func, entradas) / len(entradas)
+            mejor_referencia = min(mejor_referencia, ns_referencia)
+            mejor = min(mejor, ns)
+            cocientes.append(ns / ns_referencia)
+    finally:
+        if gc_activo:
+            gc.enable()
+    return mejor, mejor_referencia, statistics.median(cocientes)
+
+
+def medir_todo(nombres: Sequence[str], n: int, repeticiones: int) -> Dict[str, object]:
+    """Mide las funciones indicadas junto a la referencia; devuelve el informe."""
+    rng = random.Random(SEMILLA)
+    referencia = [(rng.choice(("", "  ", "María", "García", "600123456")),) for _ in range(n)]
+
+    funciones = {}
+    for nombre in nombres:
+        obtener, generar_entradas = CASOS[nombre]
+        ns, ns_referencia, relativo = medir(
+            obtener(), generar_entradas(random.Random(SEMILLA), n), referencia, repeticiones
+        )
+        funciones[nombre] = {
+            "ns_por_llamada": round(ns, 1),
+            "referencia_ns": round(ns_referencia, 1),
+            "relativo": round(relativo, 3),
+        }
+    return {
+        "entorno": entorno(),
+        "entradas": n,
+        "repeticiones": repeticiones,
+        "funciones": funciones,
+    }
+
+
+def comparar(informe: Dict, base: Dict, tolerancia: float) -> List[str]:
+    """Imprime la comparación con la línea base y devuelve las funciones que empeoran."""
+    regresiones = []
+    print(f"{'función':<30} {'ns/llamada':>11} {'relativo':>9} {'base':>9} {'cambio':>8}", file=sys.stderr)
+    for nombre, medida in informe["funciones"].items():
+        previa = base.get("funciones", {}).get(nombre)
+        linea = f"{nombre:<30} {medida['ns_por_llamada']:>11.1f} {medida['relativo']:>9.3f}"
+        if previa is None:
+            linea += f" {'-':>9} {'':>8}  (sin línea base)"
+        else:
+            cambio = medida["relativo"] / previa["relativo"] - 1
+            linea += f" {previa['relativo']:>9.3f} {cambio * 100:>+7.1f}%"
+            if cambio > tolerancia:
+                linea += "  REGRESIÓN"
+                regresiones.append(nombre)
+            elif cambio < -tolerancia:
+                linea += "  mejora"
+        print(linea, file=sys.stderr)
+    return regresiones
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Microbenchmarks de las funciones auxiliares de los conversores."
+    )
+    parser.add_argument(
+        "--solo",
+        nargs="+",
+        choices=list(CASOS),
+        help="Mide solo estas funciones.",
+    )
+    parser.add_argument(
+        "--entradas",
+        type=int,
+        default=ENTRADAS,
+        help=f"Entradas distintas con que se llama a cada función (por defecto {ENTRADAS}).",
+    )
+    parser.add_argument(
+        "--repeticiones",
+        type=int,
+        default=REPETICIONES,
+        help=f"Pasadas por función; se toma la más rápida (por defecto {REPETICIONES}).",
+    )
+    parser.add_argument(
+        "--base",
+        default=str(LINEA_BASE),
+        help="Archivo JSON de la línea base (por defecto benchmarks/micro_base.json).",
+    )
+    parser.add_argument(
+        "--tolerancia",
+        type=float,
+        default=TOLERANCIA,
+        help=(
+            "Empeoramiento relativo a partir del cual una función se considera "
+            f"regresión (por defecto {TOLERANCIA}, un {TOLERANCIA * 100:.0f} %%)."
+        ),
+    )
+    parser.add_argument(
+        "--guardar-base",
+        action="store_true",
+        help="Guarda las medidas como nueva línea base (solo las funciones medidas).",
+    )
+    parser.add_argument(
+        "--salida",
+        default=None,
+        help="Archivo JSON donde guardar también el informe de esta ejecución.",
+    )
+    args = parser.parse_args(argv)
+    if args.entradas < 1 or args.repeticiones < 1:
+        parser.error("--entradas y --repeticiones deben ser 1 o mayor")
+    if args.tolerancia < 0:
+        parser.error("--tolerancia no puede ser negativa")
+
+    informe = medir_todo(args.solo or list(CASOS), args.entradas, args.repeticiones)
+    base_path = Path(args.base)
+    base = json.loads(base_path.read_text(encoding="utf-8")) if base_path.exists() else {}
+
+    if args.salida is not None:
+        Path(args.salida).write_text(json.dumps(informe, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+
+    if not base:
+        print(f"[AVISO] No hay línea base en {base_path}", file=sys.stderr)
+    regresiones = comparar(informe, base, args.tolerancia)
+
+    if args.guardar_base:
+        # Las funciones no medidas en esta ejecución conservan su línea base
+        nueva = {**informe, "funciones": {**base.get("funciones", {}), **informe["funciones"]}}
+        base_path.write_text(json.dumps(nueva, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"\n[OK] Línea base guardada en {base_path}", file=sys.stderr)
+    elif regresiones:
+        print(f"\n[ERROR] Más lentas que la línea base: {', '.join(regresiones)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
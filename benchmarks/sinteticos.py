@@ -0,0 +1,333 @@
+"""
+Datos sintéticos con la forma de las exportaciones reales, a cualquier escala.
+
+- CLINNI: JSON {"pacientes": [...], "bonos": [...]} con procesos, citas y
+  evoluciones anidados en cada paciente (plano o comprimido con gzip).
+- DRICloud: XML con las diez tablas de TABLAS_XML.
+- MN Program: carpeta con los CSV del volcado (clientes, Bonos, events,
+  eventsit y diagnosticoPac), con la misma mezcla de codificaciones.
+
+'registros' es el número aproximado de registros de la entrada sumando
+todas sus tablas; cada generador devuelve cuántos escribió de cada una.
+Todo se escribe a medida que se genera, así que la memoria no crece con el
+tamaño, y con la misma semilla se obtienen siempre los mismos archivos.
+"""
+import csv
+import gzip
+import json
+import random
+from pathlib import Path
+from typing import Dict, List
+from xml.sax.saxutils import escape
+
+SEMILLA = 2024
+
+# Registros medios de cada entrada por paciente o cliente (suma de todas las tablas)
+REGISTROS_POR_PACIENTE = {
+    "clinni": 5.3,      # paciente + 1 proceso + 1,5 citas + 1,5 evoluciones + 1/3 de bono
+    "dricloud": 4.7,    # paciente + 1/2 bono + 2 citas + 1 consulta + datos previos
+    "mnprogram": 5.4,   # cliente + 1 bono + 2 eventos + 0,4 enlaces + 1 diagnóstico
+}
+
+NOMBRES = ["María", "José", "Ana", "Antonio", "Lucía", "Manuel", "Carmen", "Javier", "Núria", "Íñigo"]
+APELLIDOS = [
+    "García", "Fernández", "López", "Martínez", "Sánchez", "Pérez", "Gómez", "Muñoz", "Díaz", "Ibáñez",
+]
+PROVINCIAS = ["Madrid", "Barcelona", "Valencia", "Sevilla", "Málaga", "Bizkaia", "A Coruña", "Zaragoza"]
+POBLACIONES = ["Alcalá de Henares", "Hospitalet", "Gandia", "Dos Hermanas", "Marbella", "Getxo", "Ferrol", ""]
+SERVICIOS = ["Fisioterapia", "Osteopatía", "Pilates", "Nutrición", "Psicología", "Podología"]
+ESTADOS_CITA = ["Realizada", "Confirmada", "Cancelada", "Pendiente", "No presentado", ""]
+DIAGNOSTICOS = [
+    "Lumbalgia mecánica", "Cervicalgia", "Tendinopatía rotuliana", "Esguince de tobillo grado II",
+    "Fascitis plantar", "Epicondilitis", "Contractura trapecio", "",
+]
+# Notas de historial: texto plano, HTML sencillo y HTML pesado copiado de un editor
+NOTAS = [
+    "Refiere dolor al subir escaleras.",
+    "<p>Mejora notable.</p><p>Se pauta <b>fortalecimiento</b> de cuádriceps.</p>",
+    '<div style="font-family: Arial"><span style="color:#333">Dolor <i>EVA 6/10</i></span>'
+    "<br/><ul><li>Calor local</li><li>Estiramientos &amp; movilidad</li></ul></div>",
+    "Paciente derivado por traumatología &lt;ver informe&gt;.\nRevisión en 15 días.",
+    "",
+]
+
+
+def _nombre(rng: random.Random) -> str:
+    return rng.choice(NOMBRES) + (f" {rng.choice(NOMBRES)}" if rng.random() < 0.2 else "")
+
+
+def _apellidos(rng: random.Random) -> str:
+    return f"{rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}"
+
+
+def _telefono(rng: random.Random, i: int) -> str:
+    return "" if rng.random() < 0.05 else f"6{i % 100000000:08d}"
+
+
+def _fecha(rng: random.Random, desde: int = 2019, hasta: int = 2025) -> str:
+    return f"{rng.randint(desde, hasta)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+
+def _pacientes(registros: int, origen: str) -> int:
+    return max(1, round(registros / REGISTROS_POR_PACIENTE[origen]))
+
+
+# ---------------------------------------------------------------------------
+# CLINNI
+# ---------------------------------------------------------------------------
+
+
+def generar_clinni(path: Path, registros: int, comprimido: bool = False, semilla: int = SEMILLA) -> Dict[str, int]:
+    """Escribe un export JSON de CLINNI (gzip si 'comprimido') con unos 'registros'."""
+    rng = random.Random(semilla)
+    pacientes = _pacientes(registros, "clinni")
+    cuenta = {"pacientes": 0, "procesos": 0, "citas": 0, "evoluciones": 0, "bonos": 0}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    abrir = gzip.open if comprimido else open
+    with abrir(path, "wt", encoding="utf-8") as f:
+        f.write('{"pacientes": [')
+        for i in range(1, pacientes + 1):
+            procesos: List[Dict] = []
+            for _ in range(rng.choice((0, 1, 1, 2))):
+                fecha = _fecha(rng)
+                hora = rng.randint(8, 20)
+                citas = [
+                    {
+                        "fecha": fecha if k == 0 else _fecha(rng),
+                        "inicio": f"{hora:02d}:{rng.choice((0, 15, 30, 45)):02d}:00",
+                        "fin": f"{hora + 1:02d}:00:00",
+                        "ESTADO": rng.choice(ESTADOS_CITA),
+                    }
+                    for k in range(rng.choice((0, 1, 2, 3)))
+                ]
+                evoluciones = [{"contenido": rng.choice(NOTAS), "fecha": fecha} for _ in range(rng.choice((1, 2)))]
+                procesos.append({
+                    "titulo": rng.choice(("<p>Primera visita</p>", "Revisión", "Dolor lumbar", "")),
+                    "diagnostico": rng.choice(DIAGNOSTICOS),
+                    "citas": citas,
+                    "evoluciones": evoluciones,
+                })
+                cuenta["procesos"] += 1
+                cuenta["citas"] += len(citas)
+                cuenta["evoluciones"] += len(evoluciones)
+            paciente = {
+                "id": i,
+                "dni": f"{i % 100000000:08d}{'TRWAGMYFPDXBNJZSQVHLCKE'[i % 23]}" if rng.random() < 0.8 else "",
+                "nombre": _nombre(rng),
+                "apellidos": _apellidos(rng),
+                "movil": _telefono(rng, i),
+                "email": f"paciente{i}@correo.es" if rng.random() < 0.6 else "",
+                "direccionFacturacion": (
+                    f"Calle {rng.choice(APELLIDOS)} {rng.randint(1, 200)}" if rng.random() < 0.5 else ""
+                ),
+                "cp": f"{rng.randint(1000, 52999):05d}" if rng.random() < 0.5 else "",
+                "localidad": rng.choice(POBLACIONES),
+                "provincia": rng.choice(PROVINCIAS),
+                "fechaNacimiento": _fecha(rng, 1940, 2015) if rng.random() < 0.7 else "",
+                "sexo": rng.choice(("H", "M", "")),
+                "antecedentes": rng.choice(("", "", "Asma", "HTA", "<p>Alergia a <b>AINEs</b></p>")),
+                "procesos": procesos,
+            }
+            f.write((", " if i > 1 else "") + json.dumps(paciente, ensure_ascii=False))
+            cuenta["pacientes"] += 1
+        f.write('], "bonos": [')
+        for i in range(1, pacientes + 1, 3):
+            bono = {
+                "dni": f"{i % 100000000:08d}{'TRWAGMYFPDXBNJZSQVHLCKE'[i % 23]}",
+                "NOMBRE": f"Bono {rng.choice((5, 10, 20))} sesiones {rng.choice(SERVICIOS)}",
+                "PRECIO": f"{rng.choice((150, 280, 500))}.00",
+                "SESIONES": str(rng.choice((5, 10, 20))),
+                "SESIONES_CONSUMIDAS": str(rng.randint(0, 5)),
+                "FECHA_CADUCIDAD": _fecha(rng, 2025, 2027),
+            }
+            f.write((", " if cuenta["bonos"] else "") + json.dumps(bono, ensure_ascii=False))
+            cuenta["bonos"] += 1
+        f.write("]}")
+    return cuenta
+
+
+# ---------------------------------------------------------------------------
+# DRICloud
+# ---------------------------------------------------------------------------
+
+
+def _elemento(tabla: str, campos: Dict[str, object]) -> str:
+    contenido = "".join(f"<{k}>{escape(str(v))}</{k}>" for k, v in campos.items() if v != "")
+    return f"<{tabla}>{contenido}</{tabla}>\n"
+
+
+def generar_dricloud(path: Path, registros: int, semilla: int = SEMILLA) -> Dict[str, int]:
+    """Escribe un XML de DRICloud con las diez tablas y unos 'registros'."""
+    rng = random.Random(semilla)
+    pacientes = _pacientes(registros, "dricloud")
+    profesionales = max(3, pacientes // 2000)
+    tipos = len(SERVICIOS)
+    cuenta = {tabla: 0 for tabla in (
+        "PACIENTE", "PACIENTE_BONOS", "CITA_PACIENTE", "CITA_PACIENTE_CONSULTA", "TURNO_CITA",
+        "TIPO_CITA", "USUARIO", "USUARIO_DOCTOR", "TRATAMIENTO", "PACIENTE_DATOS_PREVIOS",
+    )}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<NewDataSet>\n')
+
+        def escribir(tabla: str, campos: Dict[str, object]) -> None:
+            f.write(_elemento(tabla, campos))
+            cuenta[tabla] += 1
+
+        for u in range(1, profesionales + 1):
+            escribir("USUARIO", {
+                "USU_ID": u, "USU_NOMBRE": _nombre(rng), "USU_APELLIDOS": _apellidos(rng),
+                "USU_USUARIO": f"prof{u}", "USU_EMAIL": f"prof{u}@clinica.es",
+            })
+            escribir("USUARIO_DOCTOR", {"USU_ID": u, "DOC_NUM_COLEGIADO": f"28/{u:05d}"})
+            escribir("TURNO_CITA", {"TCO_ID": u, "USU_ID": u, "TCO_NOMBRE": f"Agenda {u}"})
+        for t, servicio in enumerate(SERVICIOS, 1):
+            escribir("TIPO_CITA", {"TCI_ID": t, "TCI_NOMBRE": servicio, "TCI_DURACION": 45})
+            escribir("TRATAMIENTO", {"TRA_ID": t, "TRA_NOMBRE": servicio, "TRA_PRECIO": 45 + 5 * t})
+
+        cita = 0
+        for i in range(1, pacientes + 1):
+            escribir("PACIENTE", {
+                "PAC_ID": i,
+                "PAC_NOMBRE": _nombre(rng),
+                "PAC_APELLIDOS": _apellidos(rng),
+                "PAC_TELEFONO1": _telefono(rng, i),
+                "PAC_TELEFONO2": f"91{i % 10000000:07d}" if rng.random() < 0.2 else "",
+                "PAC_NIF": f"{i % 100000000:08d}X" if rng.random() < 0.8 else "",
+                "PAC_DIRECCION": f"C/ {rng.choice(APELLIDOS)}, {rng.randint(1, 200)}" if rng.random() < 0.6 else "",
+                "PAC_COD_POSTAL": f"{rng.randint(1000, 52999):05d}" if rng.random() < 0.6 else "",
+                "PAC_POBLACION": rng.choice(POBLACIONES),
+                "PAC_PROVINCIA": rng.choice(PROVINCIAS),
+                "PAC_PAIS": "España" if rng.random() < 0.9 else "",
+                "PAC_EMAIL": f"p{i}@correo.es" if rng.random() < 0.5 else "",
+                "PAC_FECHA_NACIMIENTO": f"{_fecha(rng, 1940, 2015)}T00:00:00" if rng.random() < 0.7 else "",
+                "SEX_ID": rng.choice((1, 2, "")),
+                "PAC_ANOTACIONES": rng.choice(NOTAS),
+                "PAC_FECHA_ALTA": f"{_fecha(rng)}T{rng.randint(8, 20):02d}:00:00",
+            })
+            if rng.random() < 0.5:
+                sesiones = rng.choice((5, 10, 20))
+                usos = rng.randint(0, sesiones)
+                escribir("PACIENTE_BONOS", {
+                    "PAC_BON_ID": cuenta["PACIENTE_BONOS"] + 1,
+                    "PAC_ID": i,
+                    "PAC_BON_CABECERA": f"Bono {sesiones} {rng.choice(SERVICIOS)}",
+                    "PAC_BON_PRECIO": f"{sesiones * 40}.0000",
+                    "PAC_BON_NUM_SESIONES": sesiones,
+                    # Algunos exports traen los usos y otros solo las sesiones sin consumir
+                    "PAC_BON_USOS": usos if rng.random() < 0.7 else "",
+                    "PAC_BON_SIN_CONSUMIR": sesiones - usos,
+                    "PAC_BON_PAGADO": rng.choice((1, 0, "S", "")),
+                    "PAC_BON_FECHA_VENCIMIENTO": f"{_fecha(rng, 2025, 2027)}T00:00:00",
+                })
+            for _ in range(rng.choice((0, 1, 2, 2, 3, 4))):
+                cita += 1
+                escribir("CITA_PACIENTE", {
+                    "CPA_ID": cita,
+                    "PAC_ID": i,
+                    "TCO_ID": rng.randint(1, profesionales),
+                    "TCI_ID": rng.randint(1, tipos),
+                    "CPA_FECHA_INICIO": f"{_fecha(rng)}T{rng.randint(8, 20):02d}:{rng.choice((0, 15, 30, 45)):02d}:00",
+                    "CPA_MINUTOS_CITA": rng.choice((30, 45, 60, "")),
+                    "CPA_ESTADO": rng.choice(ESTADOS_CITA),
+                })
+                if rng.random() < 0.5:
+                    escribir("CITA_PACIENTE_CONSULTA", {
+                        "CPA_ID": cita,
+                        "CPA_DIAGNOSTICO": rng.choice(DIAGNOSTICOS),
+                        "CPA_NOTAS_ODONTOGRAMA": rng.choice(NOTAS),
+                    })
+            if rng.random() < 0.2:
+                escribir("PACIENTE_DATOS_PREVIOS", {
+                    "PAC_ID": i,
+                    "PDP_ALERGIAS": rng.choice(("Polen", "Penicilina", "")),
+                    "PDP_ANTECEDENTES": rng.choice(NOTAS),
+                })
+        f.write("</NewDataSet>\n")
+    return cuenta
+
+
+# ---------------------------------------------------------------------------
+# MN Program
+# ---------------------------------------------------------------------------
+
+
+def generar_mn_program(carpeta: Path, registros: int, semilla: int = SEMILLA) -> Dict[str, int]:
+    """Escribe la carpeta de CSV de un volcado de MN Program con unos 'registros'."""
+    rng = random.Random(semilla)
+    clientes = _pacientes(registros, "mnprogram")
+    carpeta.mkdir(parents=True, exist_ok=True)
+    cuenta: Dict[str, int] = {}
+
+    def abrir(nombre: str, cabecera: List[str], encoding: str):
+        f = open(carpeta / nombre, "w", encoding=encoding, newline="")
+        escritor = csv.writer(f)
+        escritor.writerow(cabecera)
+        cuenta[nombre] = 0
+        return f, escritor
+
+    # Como en los volcados reales: clientes en UTF-8 con BOM y eventos en latin-1
+    f_cli, w_cli = abrir("clientes.csv", [
+        "icodcli", "snombrecli", "sapellidoscli", "snifcli", "smovilcli", "stelefonocli",
+        "sdomiciliocli", "scodpostalcli", "spoblacioncli", "sprovinciacli", "sNombrePais",
+        "email", "fechanacimiento", "sexo", "textoalerta", "NaturJuridica", "dfechaalta",
+    ], "utf-8-sig")
+    f_bon, w_bon = abrir("Bonos.csv", [
+        "icodBono", "icodcliClientes", "Descripcion", "unidades", "Importe", "FechaCaducidad",
+    ], "utf-8-sig")
+    f_ev, w_ev = abrir("events.csv", [
+        "eventid", "contactid", "resourceid", "subject", "startdate", "starttime", "endtime",
+        "startdatetime", "durationminutes", "status", "done", "location", "notes",
+    ], "latin-1")
+    f_evi, w_evi = abrir("eventsit.csv", ["eventid", "icodcli"], "utf-8-sig")
+    f_dia, w_dia = abrir("diagnosticoPac.csv", [
+        "icodcli", "dfecha", "diagnostico", "tipo", "principal", "codigocie9", "estado",
+    ], "utf-8-sig")
+    archivos = (f_cli, f_bon, f_ev, f_evi, f_dia)
+    evento = 0
+    try:
+        for i in range(1, clientes + 1):
+            movil = _telefono(rng, i)
+            w_cli.writerow([
+                i, _nombre(rng), _apellidos(rng), f"{i % 100000000:08d}M" if rng.random() < 0.8 else "",
+                movil, "" if movil and rng.random() < 0.7 else f"91{i % 10000000:07d}",
+                f"Avda. {rng.choice(APELLIDOS)} {rng.randint(1, 99)}" if rng.random() < 0.5 else "",
+                f"{rng.randint(1000, 52999):05d}" if rng.random() < 0.5 else "",
+                rng.choice(POBLACIONES), rng.choice(PROVINCIAS), rng.choice(("", "", "", "Francia")),
+                f"cliente{i}@correo.es" if rng.random() < 0.5 else "",
+                f"{_fecha(rng, 1940, 2015)} 00:00:00" if rng.random() < 0.7 else "",
+                rng.choice(("H", "M", "")), rng.choice(("", "", "Marcapasos", "Alergia al látex")),
+                rng.choice(("F", "F", "J")), f"{_fecha(rng)} 00:00:00",
+            ])
+            cuenta["clientes.csv"] += 1
+            w_bon.writerow([
+                i, i if rng.random() < 0.95 else clientes + i,
+                f"Bono {rng.choice((5, 10))} {rng.choice(SERVICIOS)}", rng.choice((5, 10)),
+                f"{rng.choice((150, 280))},00", f"{_fecha(rng, 2025, 2027)} 00:00:00",
+            ])
+            cuenta["Bonos.csv"] += 1
+            for _ in range(rng.choice((0, 1, 2, 3, 4))):
+                evento += 1
+                con_fecha = rng.random() < 0.5
+                w_ev.writerow([
+                    evento, i if rng.random() < 0.8 else "", rng.randint(0, 4) if rng.random() < 0.8 else "",
+                    f"Sesión {rng.choice(SERVICIOS)}", _fecha(rng) if con_fecha else "",
+                    "10:00:00" if con_fecha else "", "10:45:00",
+                    f"{_fecha(rng)} {rng.randint(8, 20):02d}:{rng.choice((0, 30)):02d}:00.000",
+                    rng.choice(("30", "45", "")), rng.choice(("done", "pendiente", "cancel", "")),
+                    rng.choice(("True", "False")), rng.choice(("Sala 1", "Online", "")),
+                    rng.choice(("", "Trae informe", "Llamar antes")),
+                ])
+                cuenta["events.csv"] += 1
+                if rng.random() < 0.2:
+                    w_evi.writerow([evento, i])
+                    cuenta["eventsit.csv"] += 1
+            w_dia.writerow([
+                i, f"{_fecha(rng)} 00:00:00", rng.choice(DIAGNOSTICOS) or "Revisión", rng.choice(("T", "P")),
+                rng.choice(("S", "")), rng.choice(("724.2", "")), rng.choice(("activo", "resuelto")),
+            ])
+            cuenta["diagnosticoPac.csv"] += 1
+    finally:
+        for f in archivos:
+            f.close()
+    return cuenta
@@ -0,0 +1,49 @@
+"""
+Utilidades compartidas por los benchmarks: carga de los conversores y datos
+del entorno en el que se mide.
+"""
+import importlib.util
+import os
+import platform
+import sys
+from datetime import datetime
+from pathlib import Path
+from types import ModuleType
+from typing import Dict
+
+RAIZ = Path(__file__).resolve().parents[1]
+
+# Raíz del proyecto en el path para importar comun/ también al ejecutarlo como script
+if str(RAIZ) not in sys.path:
+    sys.path.insert(0, str(RAIZ))
+from comun.trabajador import CONVERSORES
+
+
+# Plantillas que generan los tres conversores (cada una con su función generar_<nombre>)
+PLANTILLAS = ("clientes_y_bonos", "bonos", "historial_basica", "historial_completa", "citas")
+
+_modulos: Dict[str, ModuleType] = {}
+
+
+def cargar_conversor(origen: str) -> ModuleType:
+    """Importa (la primera vez) el script del conversor de 'origen' ("clinni", "dricloud" o "mnprogram")."""
+    modulo = _modulos.get(origen)
+    if modulo is None:
+        nombre, script, _ = CONVERSORES[origen]
+        spec = importlib.util.spec_from_file_location(nombre, script)
+        modulo = importlib.util.module_from_spec(spec)
+        sys.modules[nombre] = modulo
+        spec.loader.exec_module(modulo)
+        _modulos[origen] = modulo
+    return modulo
+
+
+def entorno() -> Dict[str, object]:
+    """Datos de la máquina y del intérprete que acompañan a cada informe."""
+    return {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "implementacion": platform.python_implementation(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
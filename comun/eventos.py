@@ -0,0 +1,184 @@
+"""
+Eventos de progreso en líneas JSON (opción --events jsonl de los conversores).
+
+Con emitir_eventos activo, los conversores escriben en el destino una línea
+JSON por evento, pensada para que la lea otro programa (la capa Node) y no
+una persona:
+
+    {"evento": "inicio", "t": 0.0, "rss_mb": 31.2}
+    {"evento": "lectura", "archivo": "x.xml", "bytes": 10485760, "bytes_total": 52428800,
+     "registros": {"PACIENTE": 20000, "CITA_PACIENTE": 4100}, "registros_s": 61200.5, "t": 0.4, "rss_mb": 64.0}
+    {"evento": "carga", "registros": {"PACIENTE": 60000, ...}, "t": 1.9, "rss_mb": 140.2}
+    {"evento": "escritura", "archivo": "citas_x.csv", "filas": 51200, "filas_s": 80311.0, "terminado": false, ...}
+    {"evento": "fin", "ok": true, "t": 6.3, "rss_mb": 141.0}
+
+- 't' son los segundos desde el inicio y 'rss_mb' la memoria residente
+  actual del proceso (None si el sistema no permite medirla; ver comun/rss.py).
+- Los eventos de lectura y escritura salen de los bucles que recorren las
+  filas, como mucho uno cada INTERVALO segundos por archivo, más uno final
+  (con "terminado": true) al acabar cada archivo.
+
+Sin emitir_eventos activo, seguir_lectura y seguir_escritura devuelven el
+iterador tal cual y evento() no hace nada, así que no cuestan nada en los
+bucles de filas.
+"""
+import json
+import sys
+import time
+from contextlib import contextmanager, redirect_stdout
+from typing import Callable, Dict, Iterable, Iterator, Optional, TextIO, TypeVar
+
+from comun.rss import rss_actual_mb
+
+T = TypeVar("T")
+
+# Segundos mínimos entre dos eventos de progreso del mismo archivo
+INTERVALO = 0.5
+# Elementos entre dos consultas del reloj dentro de los bucles de filas
+PASO = 1024
+
+_eventos: Optional["_Eventos"] = None
+
+
+class _Eventos:
+    def __init__(self, destino: TextIO, campos: Dict) -> None:
+        self.destino = destino
+        self.campos = campos
+        self.t0 = time.monotonic()
+
+    def emitir(self, tipo: str, datos: Dict) -> None:
+        linea = {"evento": tipo, **self.campos, **datos}
+        linea["t"] = round(time.monotonic() - self.t0, 3)
+        linea["rss_mb"] = rss_actual_mb()
+        self.destino.write(json.dumps(linea, ensure_ascii=False) + "\n")
+        self.destino.flush()
+
+
+def eventos_activos() -> bool:
+    return _eventos is not None
+
+
+@contextmanager
+def emitir_eventos(destino: TextIO, **campos):
+    """
+    Escribe en 'destino' los eventos de lo que se ejecute dentro, empezando
+    por "inicio" y terminando por "fin". Los 'campos' se añaden a cada evento
+    (por ejemplo, el id del trabajo en comun/trabajador.py).
+    """
+    global _eventos
+    anterior = _eventos
+    eventos = _Eventos(destino, campos)
+    _eventos = eventos
+    eventos.emitir("inicio", {})
+    ok = False
+    try:
+        yield
+        ok = True
+    except SystemExit as e:
+        ok = e.code in (None, 0)
+        raise
+    finally:
+        eventos.emitir("fin", {"ok": ok})
+        _eventos = anterior
+
+
+@contextmanager
+def eventos_por_stdout():
+    """
+    Para --events jsonl: los eventos salen por stdout y los mensajes del
+    conversor ([INFO], [OK]...) pasan a stderr, para que stdout solo tenga JSON.
+    """
+    with emitir_eventos(sys.stdout), redirect_stdout(sys.stderr):
+        yield
+
+
+def evento(tipo: str, **datos) -> None:
+    """Emite un evento suelto (sin limitar la frecuencia), si hay eventos activos."""
+    if _eventos is not None:
+        _eventos.emitir(tipo, datos)
+
+
+def seguir_lectura(
+    elementos: Iterable[T],
+    archivo: str,
+    bytes_total: Optional[int] = None,
+    posicion: Optional[Callable[[T], int]] = None,
+    tabla: Optional[Callable[[T], str]] = None,
+) -> Iterable[T]:
+    """
+    Con eventos activos, emite eventos "lectura" mientras se recorre
+    'elementos' (los registros leídos de 'archivo').
+
+    - posicion: da, a partir del último elemento, los bytes leídos del archivo.
+    - tabla: da la tabla del elemento, para contar los registros por tabla.
+    """
+    if _eventos is None:
+        return elementos
+    return _lectura_seguida(elementos, archivo, bytes_total, posicion, tabla, _eventos)
+
+
+def _lectura_seguida(elementos, archivo, bytes_total, posicion, tabla, eventos: _Eventos) -> Iterator:
+    registros: Dict[str, int] = {}
+    total = 0
+    ultimo = None
+    inicio = ultimo_evento = time.monotonic()
+    siguiente = PASO
+
+    def emitir(terminado: bool) -> None:
+        datos = {"archivo": archivo}
+        if posicion is not None and ultimo is not None:
+            datos["bytes"] = posicion(ultimo)
+        elif terminado and bytes_total is not None:
+            datos["bytes"] = bytes_total
+        datos["bytes_total"] = bytes_total
+        datos["registros"] = dict(registros) if tabla is not None else total
+        datos["registros_s"] = round(total / max(time.monotonic() - inicio, 1e-9), 1)
+        datos["terminado"] = terminado
+        eventos.emitir("lectura", datos)
+
+    for elemento in elementos:
+        total += 1
+        ultimo = elemento
+        if tabla is not None:
+            clave = tabla(elemento)
+            registros[clave] = registros.get(clave, 0) + 1
+        if total >= siguiente:
+            siguiente = total + PASO
+            ahora = time.monotonic()
+            if ahora - ultimo_evento >= INTERVALO:
+                emitir(terminado=False)
+                ultimo_evento = ahora
+        yield elemento
+    emitir(terminado=True)
+
+
+def seguir_escritura(filas: Iterable[T], archivo: str) -> Iterable[T]:
+    """Con eventos activos, emite eventos "escritura" mientras se escriben las 'filas' de 'archivo'."""
+    if _eventos is None:
+        return filas
+    return _escritura_seguida(filas, archivo, _eventos)
+
+
+def _escritura_seguida(filas: Iterable[T], archivo: str, eventos: _Eventos) -> Iterator[T]:
+    total = 0
+    inicio = ultimo_evento = time.monotonic()
+    siguiente = PASO
+
+    def emitir(terminado: bool) -> None:
+        eventos.emitir("escritura", {
+            "archivo": archivo,
+            "filas": total,
+            "filas_s": round(total / max(time.monotonic() - inicio, 1e-9), 1),
+            "terminado": terminado,
+        })
+
+    for fila in filas:
+        total += 1
+        if total >= siguiente:
+            siguiente = total + PASO
+            ahora = time.monotonic()
+            if ahora - ultimo_evento >= INTERVALO:
+                emitir(terminado=False)
+                ultimo_evento = ahora
+        yield fila
+    emitir(terminado=True)
@@ -0,0 +1,101 @@
+"""
+Normalización de fechas y horas compartida por los conversores de CLINNI,
+DRICloud y MN Program.
+
+formatear_fecha pasa a DD/MM/YYYY los valores que empiezan por una fecha
+YYYY-MM-DD: fechas ISO (2019-03-15), datetimes ISO (2019-03-15T14:30:00) y
+datetimes de SQL Server (2019-03-15 14:30:00.000). Cualquier otro valor, como
+una fecha que ya viene en DD/MM/YYYY, se devuelve sin cambios.
+
+Las mismas fechas y horas se repiten constantemente en los datos de una
+clínica (unos miles de días distintos y un centenar de franjas horarias),
+así que cada función cachea sus resultados en un LRU acotado y las
+expresiones regulares se compilan una sola vez al importar el módulo.
+"""
+import re
+from functools import lru_cache
+from typing import Tuple
+
+
+# Entradas máximas de cada caché; de sobra para los días y franjas de una exportación
+TAMANO_CACHE_FECHAS = 16384
+
+_RE_FECHA_ISO = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+_RE_HORA_ISO = re.compile(r'\d{4}-\d{2}-\d{2}T(\d{2}):(\d{2}):(\d{2})')
+# Mismos valores que acepta datetime.strptime(valor, '%H:%M:%S'): el patrón de
+# %S admite 60 y 61, pero datetime los rechaza después, así que los segundos van de 0 a 59
+_RE_HORA = re.compile(r'(2[0-3]|[0-1][0-9]|[0-9]):([0-5][0-9]|[0-9]):([0-5][0-9]|[0-9])')
+
+
+@lru_cache(maxsize=TAMANO_CACHE_FECHAS)
+def formatear_fecha(fecha_str: str) -> str:
+    """Convierte a DD/MM/YYYY un valor que empieza por YYYY-MM-DD (descarta la hora); el resto se devuelve igual."""
+    if not fecha_str:
+        return ""
+    
+    match = _RE_FECHA_ISO.match(fecha_str)
+    if match:
+        return f"{match.group(3)}/{match.group(2)}/{match.group(1)}"
+    
+    return fecha_str
+
+
+@lru_cache(maxsize=TAMANO_CACHE_FECHAS)
+def formatear_hora(fecha_str: str) -> str:
+    """Extrae la hora (HH:MM:00) de un datetime ISO con 'T'; si no lo es, devuelve ''."""
+    if not fecha_str:
+        return ""
+    
+    match = _RE_HORA_ISO.match(fecha_str)
+    if match:
+        return f"{match.group(1)}:{match.group(2)}:00"
+    
+    return ""
+
+
+@lru_cache(maxsize=TAMANO_CACHE_FECHAS)
+def _segundos_del_dia(hora: str) -> int:
+    """Segundos desde medianoche de una hora HH:MM:SS, o -1 si no es válida."""
+    match = _RE_HORA.fullmatch(hora)
+    if not match:
+        return -1
+    return int(match.group(1)) * 3600 + int(match.group(2)) * 60 + int(match.group(3))
+
+
+def duracion_minutos(hora_inicio: str, hora_fin: str) -> str:
+    """
+    Minutos entre dos horas HH:MM:SS del mismo día, como texto.
+
+    Sustituye a datetime.strptime: acepta los mismos valores, trunca igual
+    hacia cero (una cita que termina antes de empezar da minutos negativos)
+    y devuelve '' si alguna de las dos horas no es válida.
+    """
+    inicio = _segundos_del_dia(hora_inicio)
+    fin = _segundos_del_dia(hora_fin)
+    if inicio < 0 or fin < 0:
+        return ""
+    return str(int((fin - inicio) / 60))
+
+
+@lru_cache(maxsize=TAMANO_CACHE_FECHAS)
+def fecha_sin_hora(fecha_str: str) -> str:
+    """Quita la parte horaria de un datetime ('2019-03-15 00:00:00.000' -> '2019-03-15')."""
+    if fecha_str and len(fecha_str) >= 10:
+        partes = fecha_str.split()
+        if partes:
+            return partes[0]
+    return fecha_str
+
+
+@lru_cache(maxsize=TAMANO_CACHE_FECHAS)
+def separar_fecha_hora(fecha_str: str) -> Tuple[str, str]:
+    """
+    Separa un datetime de SQL Server en fecha y hora HH:MM:SS
+    ('2019-03-15 14:30:00.000' -> ('2019-03-15', '14:30:00')).
+
+    Devuelve ('', '') si el valor no trae las dos partes.
+    """
+    partes = fecha_str.split() if fecha_str else ()
+    if len(partes) >= 2:
+        return partes[0], partes[1][:8]
+    return "", ""
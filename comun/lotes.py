@@ -0,0 +1,201 @@
+"""
+Conversión por lotes: varias exportaciones en una sola ejecución, y varias
+plantillas de una misma exportación.
+
+Los conversores de CLINNI y DRICloud aceptan varias entradas (archivos,
+carpetas o patrones glob). Con --jobs mayor que 1 las entradas se convierten
+en paralelo en un ProcessPoolExecutor, empezando por las más grandes para que
+la última en terminar no sea una exportación enorme que empezó tarde.
+
+Con una sola entrada, ejecutar_tareas reparte entre procesos las plantillas
+de esa entrada (lo usan los tres conversores).
+"""
+import glob
+import io
+import multiprocessing
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from comun.perfil import etapa
+
+
+CARACTERES_GLOB = "*?["
+
+
+def expandir_entradas(
+    valores: Sequence[str],
+    resolver: Callable[[str], Path],
+    extensiones: Optional[Sequence[str]] = None,
+) -> List[Path]:
+    """
+    Convierte los valores de la opción de entrada en la lista de archivos a
+    convertir, sin repetidos y en el orden indicado.
+
+    - Un patrón glob ('exportaciones/*.xml') se expande tal cual.
+    - Una carpeta aporta sus archivos (no ocultos), solo los de 'extensiones'
+      si se indican (en minúsculas y con punto, p. ej. ".xml").
+    - Cualquier otro valor se resuelve con 'resolver' (que puede buscarlo en
+      las carpetas habituales del conversor).
+
+    Lanza ValueError si un valor no corresponde a ningún archivo.
+    """
+    entradas: List[Path] = []
+    for valor in valores:
+        if any(c in valor for c in CARACTERES_GLOB):
+            encontradas = [Path(p) for p in sorted(glob.glob(valor)) if Path(p).is_file()]
+            if not encontradas:
+                raise ValueError(f"Ningún archivo coincide con: {valor}")
+        else:
+            ruta = resolver(valor)
+            if ruta.is_dir():
+                encontradas = [
+                    p for p in sorted(ruta.iterdir())
+                    if p.is_file() and not p.name.startswith(".")
+                    and (extensiones is None or p.suffix.lower() in extensiones)
+                ]
+                if not encontradas:
+                    raise ValueError(f"La carpeta no contiene archivos a convertir: {ruta}")
+            elif ruta.exists():
+                encontradas = [ruta]
+            else:
+                raise ValueError(f"El archivo no existe: {ruta}")
+        for p in encontradas:
+            if p not in entradas:
+                entradas.append(p)
+    return entradas
+
+
+def comprobar_sufijos(entradas: Sequence[Path], sufijo: Callable[[Path], str]) -> None:
+    """Lanza ValueError si dos entradas darían los mismos nombres de salida."""
+    vistas: Dict[str, Path] = {}
+    for entrada in entradas:
+        s = sufijo(entrada)
+        if s in vistas:
+            raise ValueError(
+                f"'{vistas[s]}' y '{entrada}' generarían los mismos archivos de salida (sufijo '{s}')"
+            )
+        vistas[s] = entrada
+
+
+def _convertir_capturando(convertir: Callable[[Path], None], entrada: Path) -> Tuple[bool, str, str]:
+    """
+    Convierte una entrada en un proceso del pool guardando lo que imprime,
+    para escribirlo de una vez y que no se mezcle con el de otras entradas.
+    Devuelve (correcto, salida, error).
+
+    Solo se guarda el registro para personas. Los eventos de --events jsonl
+    siguen saliendo al momento: su destino se fijó en el proceso padre (ver
+    eventos_por_stdout) y redirect_stdout no lo cambia.
+    """
+    salida = io.StringIO()
+    try:
+        with redirect_stdout(salida):
+            convertir(entrada)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            return False, salida.getvalue(), f"terminó con código {e.code}"
+    except Exception as e:
+        traceback.print_exc()
+        return False, salida.getvalue(), f"{type(e).__name__}: {e}"
+    return True, salida.getvalue(), ""
+
+
+def convertir_en_lote(entradas: Sequence[Path], convertir: Callable[[Path], None], jobs: int) -> None:
+    """
+    Llama a convertir(entrada) para cada entrada: en serie y en el orden dado
+    con jobs <= 1, o con 'jobs' procesos (fork), de mayor a menor tamaño.
+
+    Si falla alguna entrada, el resto se sigue convirtiendo y al final se
+    informa de las fallidas y se termina con código 1.
+    """
+    if jobs > 1 and len(entradas) > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        print("[AVISO] Este sistema no permite fork; las entradas se convierten en serie.", file=sys.stderr)
+        jobs = 1
+
+    total = len(entradas)
+    fallidas: List[str] = []
+
+    if jobs <= 1 or total <= 1:
+        for i, entrada in enumerate(entradas, 1):
+            print(f"\n[INFO] [{i}/{total}] {entrada}")
+            try:
+                convertir(entrada)
+            except SystemExit as e:
+                if e.code not in (None, 0):
+                    fallidas.append(entrada.name)
+            except Exception:
+                traceback.print_exc()
+                fallidas.append(entrada.name)
+    else:
+        # Las más grandes primero: el pool reparte las tareas en el orden en que se envían
+        ordenadas = sorted(entradas, key=lambda p: p.stat().st_size, reverse=True)
+        print(f"[INFO] Convirtiendo {total} entradas con {min(jobs, total)} procesos")
+        sys.stdout.flush()
+        sys.stderr.flush()
+        hechas = 0
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("fork")) as pool:
+            futuros = {pool.submit(_convertir_capturando, convertir, e): e for e in ordenadas}
+            for futuro in as_completed(futuros):
+                entrada = futuros[futuro]
+                hechas += 1
+                try:
+                    correcto, salida, error = futuro.result()
+                except Exception as e:
+                    correcto, salida, error = False, "", f"{type(e).__name__}: {e}"
+                print(f"\n[INFO] [{hechas}/{total}] {entrada}")
+                sys.stdout.write(salida)
+                if not correcto:
+                    print(f"[ERROR] {entrada.name}: {error}", file=sys.stderr)
+                    fallidas.append(entrada.name)
+
+    if fallidas:
+        print(f"[ERROR] Fallaron las entradas: {', '.join(fallidas)}", file=sys.stderr)
+        sys.exit(1)
+
+
+def ejecutar_tareas(tasks: List[Tuple[str, Callable[[], None]]], jobs: int) -> None:
+    """
+    Ejecuta las tareas de generación, en serie o en paralelo.
+
+    Con jobs > 1 cada plantilla se escribe en un proceso hijo creado con
+    fork, que hereda las tablas ya cargadas sin copiarlas ni serializarlas
+    (solo se leen). Si el sistema no tiene fork, se ejecuta en serie.
+    """
+    if jobs > 1 and len(tasks) > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        print("[AVISO] Este sistema no permite fork; las plantillas se generan en serie.", file=sys.stderr)
+        jobs = 1
+
+    if jobs <= 1 or len(tasks) <= 1:
+        for name, t in tasks:
+            with etapa(f"generar_{name}"):
+                t()
+        return
+
+    ctx = multiprocessing.get_context("fork")
+    pendientes = list(tasks)
+    activos: Dict[int, Tuple[str, multiprocessing.process.BaseProcess]] = {}
+    fallidas: List[str] = []
+
+    while pendientes or activos:
+        while pendientes and len(activos) < jobs:
+            name, t = pendientes.pop(0)
+            # Vaciar buffers antes del fork para que el hijo no repita la salida pendiente
+            sys.stdout.flush()
+            sys.stderr.flush()
+            proceso = ctx.Process(target=t, name=name)
+            proceso.start()
+            activos[proceso.sentinel] = (name, proceso)
+        for sentinel in wait(list(activos)):
+            name, proceso = activos.pop(sentinel)
+            proceso.join()
+            if proceso.exitcode != 0:
+                fallidas.append(name)
+
+    if fallidas:
+        print(f"[ERROR] Fallaron las plantillas: {', '.join(fallidas)}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,549 @@
+"""
+Límite de memoria con desborde a disco (opción --max-memory de los conversores).
+
+Los conversores crean las tablas grandes que guardan en memoria (tablas de
+origen e índices como pacientes_dict, citas_por_consulta o bonos_por_paciente)
+con diccionario(), lista() y multidiccionario(). Sin un límite activo
+(limitar_memoria) devuelven un dict, una list y un defaultdict(list)
+normales, así que no añaden nada a los bucles.
+
+Con límite, devuelven contenedores con la misma interfaz que empiezan en
+memoria y, si la memoria residente del proceso supera el límite mientras se
+llenan, pasan su contenido a una base SQLite temporal y siguen desde ahí:
+la conversión va más lenta, pero no se queda sin memoria. Una vez superado el
+límite, el resto de contenedores también pasan a disco en cuanto crecen, y
+los que se crean por encima del límite empiezan ya en disco. Los
+contenedores conservan el orden de inserción, como un dict o una list.
+
+indexar() indexa una lista por un campo: si la lista ya está en disco, el
+índice es una vista sobre la misma tabla, de modo que cada elemento se
+guarda en disco una sola vez.
+
+Los valores se guardan con pickle; los Registro guardan el índice de su
+esquema en vez del dict de posiciones, de modo que al leerlos siguen
+compartiendo el mismo dict (ver comun/registros.py). La base temporal solo la
+usa el proceso que la crea, así que con límite las plantillas se generan en serie.
+"""
+import io
+import pickle
+import shutil
+import sqlite3
+import sys
+import tempfile
+import weakref
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from collections.abc import Mapping, MutableMapping, Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from comun.eventos import evento
+from comun.registros import Registro
+from comun.rss import rss_actual_mb, rss_pico_mb
+
+# Inserciones entre dos comprobaciones de la memoria del proceso
+PASO = 4096
+# Escrituras que se acumulan antes de mandarlas a SQLite en un executemany
+LOTE = 10000
+
+_gobernador: Optional["_Gobernador"] = None
+
+
+# ---------------------------------------------------------------------------
+# Serialización de los valores
+# ---------------------------------------------------------------------------
+
+
+# Esquemas (dicts de posiciones) de los Registro guardados en disco en este proceso
+_esquemas_guardados: List[Dict[str, int]] = []
+_indice_esquema: Dict[int, int] = {}
+
+
+def _registro_guardado(n: int, valores: Tuple[Any, ...]) -> Registro:
+    return Registro(_esquemas_guardados[n], valores)
+
+
+def _reducir_registro(registro: Registro):
+    posiciones = registro._posiciones
+    n = _indice_esquema.get(id(posiciones))
+    if n is None:
+        n = _indice_esquema[id(posiciones)] = len(_esquemas_guardados)
+        # La lista mantiene vivo el dict, así que su id no se reutiliza
+        _esquemas_guardados.append(posiciones)
+    return _registro_guardado, (n, registro._valores)
+
+
+class _Serializador:
+    """pickle con un único Pickler reutilizado y los Registro reducidos a (esquema, valores)."""
+
+    def __init__(self) -> None:
+        self._buffer = io.BytesIO()
+        self._pickler = pickle.Pickler(self._buffer, protocol=pickle.HIGHEST_PROTOCOL)
+        self._pickler.dispatch_table = {Registro: _reducir_registro}
+
+    def guardar(self, valor: Any) -> bytes:
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._pickler.clear_memo()
+        self._pickler.dump(valor)
+        return self._buffer.getvalue()
+
+    @staticmethod
+    def cargar(datos: bytes) -> Any:
+        return pickle.loads(datos)
+
+
+# ---------------------------------------------------------------------------
+# Gobernador y base temporal
+# ---------------------------------------------------------------------------
+
+
+class _Gobernador:
+    def __init__(self, limite_mb: int) -> None:
+        self.limite_mb = limite_mb
+        self.excedido = False
+        self.carpeta: Optional[Path] = None
+        self.conexion: Optional[sqlite3.Connection] = None
+        self.serializador = _Serializador()
+        self.tablas = 0
+
+    def comprobar(self) -> bool:
+        """True si la memoria ya superó el límite (a partir de ahí sigue siendo True)."""
+        if not self.excedido:
+            rss = rss_actual_mb()
+            if rss is None:
+                # Sin /proc: el pico sirve igual, porque basta con saber la primera vez que se supera
+                rss = rss_pico_mb()
+            if rss is not None and rss > self.limite_mb:
+                self.excedido = True
+                print(
+                    f"[AVISO] Memoria en {rss:.0f} MB, por encima de --max-memory "
+                    f"({self.limite_mb} MB): las tablas grandes pasan a disco.",
+                    file=sys.stderr,
+                )
+        return self.excedido
+
+    def nueva_tabla(self, nombre: str, clave_unica: bool) -> str:
+        if self.conexion is None:
+            self.carpeta = Path(tempfile.mkdtemp(prefix="migraciones_memoria_"))
+            self.conexion = sqlite3.connect(str(self.carpeta / "tablas.sqlite3"))
+            self.conexion.execute("PRAGMA journal_mode=OFF")
+            self.conexion.execute("PRAGMA synchronous=OFF")
+        tabla = f"t{self.tablas}"
+        self.tablas += 1
+        if clave_unica:
+            self.conexion.execute(f"CREATE TABLE {tabla} (clave TEXT PRIMARY KEY, valor BLOB)")
+        else:
+            self.conexion.execute(f"CREATE TABLE {tabla} (clave TEXT, valor BLOB)")
+            self.conexion.execute(f"CREATE INDEX {tabla}_clave ON {tabla} (clave)")
+        print(f"[INFO] '{nombre}' pasa a disco (SQLite temporal).", file=sys.stderr)
+        evento("desborde", tabla=nombre)
+        return tabla
+
+    def borrar_tabla(self, tabla: str) -> None:
+        """Borra la tabla de un contenedor que ya no se usa (si no se puede ahora, se borra al cerrar)."""
+        if self.conexion is not None:
+            try:
+                self.conexion.execute(f"DROP TABLE IF EXISTS {tabla}")
+            except sqlite3.Error:
+                pass
+
+    def cerrar(self) -> None:
+        if self.conexion is not None:
+            self.conexion.close()
+            self.conexion = None
+        if self.carpeta is not None:
+            shutil.rmtree(self.carpeta, ignore_errors=True)
+            self.carpeta = None
+
+
+@contextmanager
+def limitar_memoria(limite_mb: int):
+    """Activa el límite de memoria para las tablas que se creen dentro; al salir borra la base temporal."""
+    global _gobernador
+    gobernador = _Gobernador(limite_mb)
+    _gobernador = gobernador
+    try:
+        yield
+    finally:
+        _gobernador = None
+        gobernador.cerrar()
+
+
+class _Desbordable(ABC):
+    """Parte común: cuenta inserciones, comprueba la memoria y pasa a disco cuando toca."""
+
+    _clave_unica = True
+
+    def __init__(self, nombre: str, gobernador: _Gobernador) -> None:
+        self.nombre = nombre
+        self._gobernador = gobernador
+        self._tabla: Optional[str] = None
+        self._cuenta = 0
+        self._pendientes: List[Tuple[Any, bytes]] = []
+
+    def _crecer(self) -> None:
+        self._cuenta += 1
+        if self._cuenta >= PASO:
+            self._cuenta = 0
+            if self._gobernador.comprobar():
+                self._a_disco()
+
+    def _crear_tabla(self) -> None:
+        self._tabla = self._gobernador.nueva_tabla(self.nombre, self._clave_unica)
+        weakref.finalize(self, self._gobernador.borrar_tabla, self._tabla)
+
+    @abstractmethod
+    def _a_disco(self) -> None:
+        """Pasa el contenido en memoria a una tabla nueva (no hace nada si ya está en disco)."""
+
+    def _sql(self, consulta: str, parametros: Tuple = ()) -> sqlite3.Cursor:
+        self._volcar()
+        return self._gobernador.conexion.execute(consulta.format(t=self._tabla), parametros)
+
+    def _volcar(self) -> None:
+        if self._pendientes:
+            pendientes, self._pendientes = self._pendientes, []
+            self._escribir(pendientes)
+
+    @abstractmethod
+    def _escribir(self, filas: List[Tuple[Any, bytes]]) -> None:
+        """Inserta en la tabla las filas (clave, valor serializado)."""
+
+
+# ---------------------------------------------------------------------------
+# Contenedores
+# ---------------------------------------------------------------------------
+
+
+class DiccionarioDesbordable(_Desbordable, MutableMapping):
+    """dict (claves str) que pasa a SQLite si se supera el límite de memoria."""
+
+    def __init__(self, nombre: str, gobernador: _Gobernador) -> None:
+        super().__init__(nombre, gobernador)
+        self._datos: Optional[Dict[str, Any]] = {}
+        self._en_espera: Dict[str, Any] = {}
+        if gobernador.comprobar():
+            self._a_disco()
+
+    def _a_disco(self) -> None:
+        if self._datos is None:
+            return
+        self._crear_tabla()
+        guardar = self._gobernador.serializador.guardar
+        self._escribir([(k, guardar(v)) for k, v in self._datos.items()])
+        self._datos = None
+
+    def _escribir(self, filas: List[Tuple[Any, bytes]]) -> None:
+        self._gobernador.conexion.executemany(
+            f"INSERT INTO {self._tabla} (clave, valor) VALUES (?, ?) "
+            "ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor",
+            filas,
+        )
+
+    def _volcar(self) -> None:
+        if self._en_espera:
+            guardar = self._gobernador.serializador.guardar
+            self._pendientes = [(k, guardar(v)) for k, v in self._en_espera.items()]
+            self._en_espera = {}
+        super()._volcar()
+
+    def __setitem__(self, clave: str, valor: Any) -> None:
+        if self._datos is not None:
+            self._datos[clave] = valor
+            self._crecer()
+        else:
+            self._en_espera[clave] = valor
+            if len(self._en_espera) >= LOTE:
+                self._volcar()
+
+    def __getitem__(self, clave: str) -> Any:
+        if self._datos is not None:
+            return self._datos[clave]
+        if clave in self._en_espera:
+            return self._en_espera[clave]
+        fila = self._sql("SELECT valor FROM {t} WHERE clave = ?", (clave,)).fetchone()
+        if fila is None:
+            raise KeyError(clave)
+        return _Serializador.cargar(fila[0])
+
+    def get(self, clave: str, defecto: Any = None) -> Any:
+        if self._datos is not None:
+            return self._datos.get(clave, defecto)
+        try:
+            return self[clave]
+        except KeyError:
+            return defecto
+
+    def __contains__(self, clave: object) -> bool:
+        if self._datos is not None:
+            return clave in self._datos
+        if clave in self._en_espera:
+            return True
+        return self._sql("SELECT 1 FROM {t} WHERE clave = ?", (clave,)).fetchone() is not None
+
+    def __delitem__(self, clave: str) -> None:
+        if self._datos is not None:
+            del self._datos[clave]
+            return
+        if clave not in self:
+            raise KeyError(clave)
+        self._sql("DELETE FROM {t} WHERE clave = ?", (clave,))
+
+    def __len__(self) -> int:
+        if self._datos is not None:
+            return len(self._datos)
+        return self._sql("SELECT COUNT(*) FROM {t}").fetchone()[0]
+
+    def __iter__(self) -> Iterator[str]:
+        if self._datos is not None:
+            return iter(self._datos)
+        return (fila[0] for fila in self._sql("SELECT clave FROM {t} ORDER BY rowid"))
+
+    def items(self):
+        if self._datos is not None:
+            return self._datos.items()
+        cargar = _Serializador.cargar
+        return ((k, cargar(v)) for k, v in self._sql("SELECT clave, valor FROM {t} ORDER BY rowid"))
+
+    def values(self):
+        if self._datos is not None:
+            return self._datos.values()
+        cargar = _Serializador.cargar
+        return (cargar(v) for (v,) in self._sql("SELECT valor FROM {t} ORDER BY rowid"))
+
+
+class ListaDesbordable(_Desbordable, Sequence):
+    """
+    list (solo append, len, índice e iteración) que pasa a SQLite si se supera
+    el límite de memoria. Con 'clave', en disco guarda también el campo 'clave'
+    de cada elemento, para indexarla sin copiarla (ver indexar).
+    """
+
+    _clave_unica = False
+
+    def __init__(self, nombre: str, gobernador: _Gobernador, clave: Optional[str] = None) -> None:
+        super().__init__(nombre, gobernador)
+        self.clave = clave
+        self._datos: Optional[List[Any]] = []
+        if gobernador.comprobar():
+            self._a_disco()
+
+    @property
+    def en_disco(self) -> bool:
+        return self._datos is None
+
+    def _clave_de(self, valor: Any) -> Optional[str]:
+        return valor.get(self.clave) or None if self.clave is not None else None
+
+    def _a_disco(self) -> None:
+        if self._datos is None:
+            return
+        self._crear_tabla()
+        guardar = self._gobernador.serializador.guardar
+        self._escribir([(self._clave_de(v), guardar(v)) for v in self._datos])
+        self._datos = None
+
+    def _escribir(self, filas: List[Tuple[Any, bytes]]) -> None:
+        self._gobernador.conexion.executemany(
+            f"INSERT INTO {self._tabla} (clave, valor) VALUES (?, ?)", filas
+        )
+
+    def append(self, valor: Any) -> None:
+        if self._datos is not None:
+            self._datos.append(valor)
+            self._crecer()
+        else:
+            self._pendientes.append((self._clave_de(valor), self._gobernador.serializador.guardar(valor)))
+            if len(self._pendientes) >= LOTE:
+                self._volcar()
+
+    def __getitem__(self, i):
+        if self._datos is not None:
+            return self._datos[i]
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        # Solo se añade al final, así que la posición i es la fila i + 1
+        fila = self._sql("SELECT valor FROM {t} WHERE rowid = ?", (i + 1,)).fetchone()
+        if fila is None:
+            raise IndexError(i)
+        return _Serializador.cargar(fila[0])
+
+    def __len__(self) -> int:
+        if self._datos is not None:
+            return len(self._datos)
+        return self._sql("SELECT COUNT(*) FROM {t}").fetchone()[0]
+
+    def __iter__(self) -> Iterator[Any]:
+        if self._datos is not None:
+            return iter(self._datos)
+        cargar = _Serializador.cargar
+        return (cargar(v) for (v,) in self._sql("SELECT valor FROM {t} ORDER BY rowid"))
+
+
+class _IndiceDeLista(Mapping):
+    """
+    Vista {clave: elemento} de solo lectura sobre la tabla de una
+    ListaDesbordable en disco, con el mismo resultado que el dict de indexar().
+    """
+
+    def __init__(self, elementos: ListaDesbordable) -> None:
+        self._lista = elementos
+
+    def _sql(self, consulta: str, parametros: Tuple = ()) -> sqlite3.Cursor:
+        return self._lista._sql(consulta, parametros)
+
+    def get(self, clave: str, defecto: Any = None) -> Any:
+        fila = self._sql("SELECT valor FROM {t} WHERE clave = ? ORDER BY rowid DESC LIMIT 1", (clave,)).fetchone()
+        return defecto if fila is None else _Serializador.cargar(fila[0])
+
+    def __getitem__(self, clave: str) -> Any:
+        fila = self._sql("SELECT valor FROM {t} WHERE clave = ? ORDER BY rowid DESC LIMIT 1", (clave,)).fetchone()
+        if fila is None:
+            raise KeyError(clave)
+        return _Serializador.cargar(fila[0])
+
+    def __contains__(self, clave: object) -> bool:
+        return self._sql("SELECT 1 FROM {t} WHERE clave = ? LIMIT 1", (clave,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._sql("SELECT COUNT(DISTINCT clave) FROM {t} WHERE clave <> ''").fetchone()[0]
+
+    # Cada clave en la posición de su primer elemento y con el valor del último, como en un dict
+    _ULTIMOS = (
+        "SELECT g.clave, t.valor FROM "
+        "(SELECT clave, MIN(rowid) AS primero, MAX(rowid) AS ultimo FROM {t} WHERE clave <> '' GROUP BY clave) g "
+        "JOIN {t} t ON t.rowid = g.ultimo ORDER BY g.primero"
+    )
+
+    def __iter__(self) -> Iterator[str]:
+        return (clave for clave, _ in self._sql(self._ULTIMOS))
+
+    def items(self):
+        cargar = _Serializador.cargar
+        return ((clave, cargar(v)) for clave, v in self._sql(self._ULTIMOS))
+
+    def values(self):
+        cargar = _Serializador.cargar
+        return (cargar(v) for _, v in self._sql(self._ULTIMOS))
+
+
+class _Anexar:
+    """Lo que devuelve multidiccionario[clave] en disco: solo admite append."""
+
+    __slots__ = ("_multi", "_clave")
+
+    def __init__(self, multi: "MultidiccionarioDesbordable", clave: str) -> None:
+        self._multi = multi
+        self._clave = clave
+
+    def append(self, valor: Any) -> None:
+        self._multi._anexar(self._clave, valor)
+
+
+class MultidiccionarioDesbordable(_Desbordable, Mapping):
+    """
+    defaultdict(list) para construir índices con d[clave].append(valor) y
+    leerlos con d.get(clave, []), que pasa a SQLite si se supera el límite de memoria.
+    """
+
+    _clave_unica = False
+
+    def __init__(self, nombre: str, gobernador: _Gobernador) -> None:
+        super().__init__(nombre, gobernador)
+        self._datos: Optional[Dict[str, List[Any]]] = defaultdict(list)
+        if gobernador.comprobar():
+            self._a_disco()
+
+    def _a_disco(self) -> None:
+        if self._datos is None:
+            return
+        self._crear_tabla()
+        guardar = self._gobernador.serializador.guardar
+        self._escribir([(k, guardar(v)) for k, valores in self._datos.items() for v in valores])
+        self._datos = None
+
+    def _escribir(self, filas: List[Tuple[Any, bytes]]) -> None:
+        self._gobernador.conexion.executemany(
+            f"INSERT INTO {self._tabla} (clave, valor) VALUES (?, ?)", filas
+        )
+
+    def _anexar(self, clave: str, valor: Any) -> None:
+        self._pendientes.append((clave, self._gobernador.serializador.guardar(valor)))
+        if len(self._pendientes) >= LOTE:
+            self._volcar()
+
+    def __getitem__(self, clave: str):
+        if self._datos is not None:
+            self._crecer()
+            # _crecer puede haber pasado el contenido a disco
+            if self._datos is not None:
+                return self._datos[clave]
+        return _Anexar(self, clave)
+
+    def get(self, clave: str, defecto: Any = None) -> Any:
+        if self._datos is not None:
+            return self._datos.get(clave, defecto)
+        cargar = _Serializador.cargar
+        valores = [
+            cargar(v) for (v,) in self._sql("SELECT valor FROM {t} WHERE clave = ? ORDER BY rowid", (clave,))
+        ]
+        return valores if valores else defecto
+
+    def __contains__(self, clave: object) -> bool:
+        if self._datos is not None:
+            return clave in self._datos
+        return self._sql("SELECT 1 FROM {t} WHERE clave = ? LIMIT 1", (clave,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        if self._datos is not None:
+            return len(self._datos)
+        return self._sql("SELECT COUNT(DISTINCT clave) FROM {t}").fetchone()[0]
+
+    def __iter__(self) -> Iterator[str]:
+        if self._datos is not None:
+            return iter(self._datos)
+        return (
+            fila[0] for fila in self._sql("SELECT clave FROM {t} GROUP BY clave ORDER BY MIN(rowid)")
+        )
+
+
+def diccionario(nombre: str) -> MutableMapping:
+    """dict normal o, con límite de memoria activo, un DiccionarioDesbordable."""
+    if _gobernador is None:
+        return {}
+    return DiccionarioDesbordable(nombre, _gobernador)
+
+
+def lista(nombre: str, clave: Optional[str] = None):
+    """list normal o, con límite de memoria activo, una ListaDesbordable (ver indexar para 'clave')."""
+    if _gobernador is None:
+        return []
+    return ListaDesbordable(nombre, _gobernador, clave)
+
+
+def indexar(elementos: Iterable[Any], clave: str) -> Mapping:
+    """
+    dict {elemento[clave]: elemento} de los elementos con 'clave' no vacía (si
+    se repite, vale el último, en la posición del primero). Si 'elementos' es
+    una ListaDesbordable con esa clave que ya está en disco, devuelve una vista
+    sobre su tabla, así que los elementos no se vuelven a guardar.
+    """
+    if isinstance(elementos, ListaDesbordable) and elementos.en_disco and elementos.clave == clave:
+        return _IndiceDeLista(elementos)
+    indexada = {}
+    for e in elementos:
+        valor = e.get(clave, "")
+        if valor:
+            indexada[valor] = e
+    return indexada
+
+
+def multidiccionario(nombre: str):
+    """defaultdict(list) normal o, con límite de memoria activo, un MultidiccionarioDesbordable."""
+    if _gobernador is None:
+        return defaultdict(list)
+    return MultidiccionarioDesbordable(nombre, _gobernador)
@@ -0,0 +1,86 @@
+"""
+Opciones de línea de comandos comunes a los tres conversores.
+
+anadir_opciones_comunes() declara las opciones de salida, medida y memoria
+(--zip-output, --profile, --profile-pstats, --events y --max-memory) y
+comprobar_opciones_comunes() valida, una vez parseadas, esas opciones junto
+con --jobs, que cada conversor declara con su propia ayuda. Las opciones que
+no permiten generar las plantillas en paralelo bajan --jobs a 1 con un aviso.
+"""
+import argparse
+import sys
+
+
+def anadir_opciones_comunes(parser: argparse.ArgumentParser, etapas: str, desborde: str) -> None:
+    """
+    Añade las opciones comunes al parser.
+
+    - etapas: etapas que mide --profile en este conversor (ej: "carga de cada
+      tabla, índices, generación y escritura de cada plantilla").
+    - desborde: lo que pasa a disco con --max-memory (ej: "los clientes").
+    """
+    parser.add_argument(
+        "--zip-output",
+        default=None,
+        help=(
+            "Escribe las plantillas directamente en este ZIP (comprimidas, con un "
+            "manifiesto SHA256SUMS) en vez de en --output-dir. Las plantillas se "
+            "generan en serie."
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        metavar="INFORME.json",
+        help=(
+            f"Mide el tiempo real, el tiempo de CPU y las filas de cada etapa ({etapas}) "
+            "y guarda el informe en este JSON. Las plantillas se generan en serie."
+        ),
+    )
+    parser.add_argument(
+        "--profile-pstats",
+        default=None,
+        metavar="ARCHIVO.pstats",
+        help="Con --profile, guarda también las estadísticas de cProfile de la etapa más lenta.",
+    )
+    parser.add_argument(
+        "--events",
+        choices=["jsonl"],
+        default=None,
+        help=(
+            "Escribe por stdout eventos de progreso en líneas JSON: bytes y registros "
+            "leídos, filas escritas de cada plantilla, filas/s y memoria, como mucho "
+            "dos por segundo por archivo. Los mensajes de progreso pasan a stderr."
+        ),
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        default=None,
+        metavar="MB",
+        help=(
+            f"Memoria residente máxima del proceso, en MB. Si se supera al cargar, {desborde} "
+            "pasan a una base SQLite temporal: la conversión va más lenta pero no se "
+            "queda sin memoria. Las plantillas se generan en serie."
+        ),
+    )
+
+
+def comprobar_opciones_comunes(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """Valida --jobs y las opciones comunes (parser.error si no son válidas) y ajusta args.jobs."""
+    if args.jobs < 1:
+        parser.error("--jobs debe ser 1 o mayor")
+    if args.zip_output is not None and args.output_dir is not None:
+        parser.error("--zip-output y --output-dir no se pueden usar a la vez")
+    if args.profile_pstats is not None and args.profile is None:
+        parser.error("--profile-pstats requiere --profile")
+    if args.max_memory is not None and args.max_memory < 1:
+        parser.error("--max-memory debe ser 1 o mayor")
+    for opcion, valor in (
+        ("--zip-output", args.zip_output),
+        ("--profile", args.profile),
+        ("--max-memory", args.max_memory),
+    ):
+        if valor is not None and args.jobs > 1:
+            print(f"[AVISO] Con {opcion} las plantillas se generan en serie.", file=sys.stderr)
+            args.jobs = 1
@@ -0,0 +1,212 @@
+"""
+Perfil por etapas de una conversión (opción --profile de los conversores).
+
+Los conversores marcan sus etapas con
+
+    with etapa("carga") as e:
+        ...
+        e["filas"] = len(registros)
+
+y, sin un perfil activo (perfilar), etapa() no mide nada. Con perfil activo
+se guarda de cada etapa el tiempo real, el tiempo de CPU del proceso, las
+filas y la etapa dentro de la que se ejecuta ('dentro_de'), y al terminar se
+escribe un informe JSON con las etapas en el orden en que empezaron.
+
+Las filas de las plantillas se generan a medida que se escriben, así que
+medir_iterador() mide aparte el tiempo de producir los elementos de un
+iterador (por ejemplo, las filas de un generador o las de un CSV que se lee
+a la vez que se escribe la plantilla), y repartir_bucle() reparte el tiempo
+de un bucle que recorre varias tablas de una pasada entre una etapa por tabla.
+Estas etapas no tienen tiempo de CPU propio.
+
+El informe se reescribe al empezar y terminar cada etapa de primer nivel, de
+modo que si el proceso se corta por tiempo queda lo medido hasta entonces y
+la etapa en curso. Con pstats, cada etapa de primer nivel se ejecuta bajo
+cProfile (lo que la hace más lenta) y se guardan las estadísticas de la más
+lenta, para abrirlas con pstats o snakeviz.
+"""
+import cProfile
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+from comun.rss import rss_pico_mb
+
+T = TypeVar("T")
+
+_perfil: Optional["_Perfil"] = None
+
+
+class _Perfil:
+    def __init__(self, informe: Path, pstats: Optional[Path]) -> None:
+        self.informe = informe
+        self.pstats = pstats
+        self.etapas: List[Dict] = []
+        self.pila: List[str] = []
+        self.entrada: Optional[str] = None
+        self.inicio = datetime.now().isoformat(timespec="seconds")
+        self.t0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        self.mas_lenta: Optional[Dict] = None
+        self.perfil_mas_lento: Optional[cProfile.Profile] = None
+
+    def nuevo_registro(self, nombre: str) -> Dict:
+        registro = {"etapa": nombre, "dentro_de": self.pila[-1] if self.pila else None}
+        if self.entrada is not None:
+            registro["entrada"] = self.entrada
+        self.etapas.append(registro)
+        return registro
+
+    def guardar(self, terminado: bool) -> None:
+        """Escribe el informe tal como está (de forma atómica, sobre el anterior)."""
+        informe = {
+            "script": Path(sys.argv[0]).name,
+            "argumentos": sys.argv[1:],
+            "inicio": self.inicio,
+            "terminado": terminado,
+            "en_curso": list(self.pila),
+            "segundos": round(time.perf_counter() - self.t0, 4),
+            "cpu_segundos": round(time.process_time() - self.cpu0, 4),
+            "rss_pico_mb": rss_pico_mb(),
+            "etapa_mas_lenta": self.mas_lenta["etapa"] if self.mas_lenta else None,
+            "pstats": str(self.pstats) if self.pstats is not None and self.perfil_mas_lento else None,
+            "etapas": self.etapas,
+        }
+        temporal = self.informe.with_name(f".{self.informe.name}.{os.getpid()}.tmp")
+        try:
+            self.informe.parent.mkdir(parents=True, exist_ok=True)
+            temporal.write_text(json.dumps(informe, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+            os.replace(temporal, self.informe)
+        except OSError as e:
+            print(f"[AVISO] No se pudo guardar el perfil {self.informe}: {e}", file=sys.stderr)
+
+
+def perfil_activo() -> bool:
+    return _perfil is not None
+
+
+@contextmanager
+def perfilar(informe: Path, pstats: Optional[Path] = None):
+    """Mide las etapas que se ejecuten dentro y escribe el informe JSON en 'informe'."""
+    global _perfil
+    perfil = _Perfil(informe, pstats)
+    _perfil = perfil
+    perfil.guardar(terminado=False)
+    try:
+        yield
+    finally:
+        _perfil = None
+        perfil.pila.clear()
+        if perfil.pstats is not None and perfil.perfil_mas_lento is not None:
+            perfil.perfil_mas_lento.dump_stats(str(perfil.pstats))
+        perfil.guardar(terminado=sys.exc_info()[0] is None)
+        print(f"[INFO] Perfil guardado en: {informe}")
+
+
+def fijar_entrada(nombre: Optional[str]) -> None:
+    """Anota en las etapas siguientes la entrada que se está convirtiendo (con varias entradas)."""
+    if _perfil is not None:
+        _perfil.entrada = nombre
+
+
+@contextmanager
+def etapa(nombre: str):
+    """Mide el bloque como una etapa; devuelve su registro para anotar 'filas' u otros datos."""
+    perfil = _perfil
+    if perfil is None:
+        yield {}
+        return
+
+    registro = perfil.nuevo_registro(nombre)
+    primer_nivel = not perfil.pila
+    perfil.pila.append(nombre)
+    if primer_nivel:
+        perfil.guardar(terminado=False)
+    perfilador = cProfile.Profile() if primer_nivel and perfil.pstats is not None else None
+    inicio, inicio_cpu = time.perf_counter(), time.process_time()
+    if perfilador is not None:
+        perfilador.enable()
+    try:
+        yield registro
+    finally:
+        if perfilador is not None:
+            perfilador.disable()
+        registro["segundos"] = round(time.perf_counter() - inicio, 4)
+        registro["cpu_segundos"] = round(time.process_time() - inicio_cpu, 4)
+        perfil.pila.pop()
+        if primer_nivel:
+            if perfil.mas_lenta is None or registro["segundos"] > perfil.mas_lenta["segundos"]:
+                perfil.mas_lenta = registro
+                perfil.perfil_mas_lento = perfilador
+            perfil.guardar(terminado=False)
+
+
+def medir_iterador(elementos: Iterable[T], nombre: str) -> Iterable[T]:
+    """
+    Con perfil activo, devuelve un iterador que mide como etapa 'nombre' el
+    tiempo que se tarda en producir cada elemento (sin contar lo que haga con
+    él quien lo recorre) y cuántos hay. Sin perfil, devuelve 'elementos' tal cual.
+    """
+    if _perfil is None:
+        return elementos
+    return _iterador_medido(elementos, _perfil.nuevo_registro(nombre))
+
+
+def _iterador_medido(elementos: Iterable[T], registro: Dict) -> Iterator[T]:
+    segundos = 0.0
+    filas = 0
+    iterador = iter(elementos)
+    try:
+        while True:
+            inicio = time.perf_counter()
+            try:
+                elemento = next(iterador)
+            except StopIteration:
+                segundos += time.perf_counter() - inicio
+                return
+            segundos += time.perf_counter() - inicio
+            filas += 1
+            yield elemento
+    finally:
+        registro["segundos"] = round(segundos, 4)
+        registro["filas"] = filas
+
+
+def repartir_bucle(elementos: Iterable[T], prefijo: str, tabla: Callable[[T], str]) -> Iterable[T]:
+    """
+    Con perfil activo, reparte el tiempo del bucle que recorre 'elementos'
+    entre etapas f"{prefijo} {tabla(elemento)}": a cada elemento se le cuenta
+    lo que se tarda en producirlo más lo que tarda el cuerpo del bucle con él.
+    Sin perfil, devuelve 'elementos' tal cual.
+    """
+    if _perfil is None:
+        return elementos
+    return _bucle_repartido(elementos, prefijo, tabla, _perfil)
+
+
+def _bucle_repartido(elementos: Iterable[T], prefijo: str, tabla: Callable[[T], str], perfil: _Perfil) -> Iterator[T]:
+    registros: Dict[str, Dict] = {}
+    segundos: Dict[str, float] = {}
+    filas: Dict[str, int] = {}
+    try:
+        inicio = time.perf_counter()
+        for elemento in elementos:
+            clave = tabla(elemento)
+            if clave not in registros:
+                registros[clave] = perfil.nuevo_registro(f"{prefijo} {clave}")
+                segundos[clave] = 0.0
+                filas[clave] = 0
+            filas[clave] += 1
+            yield elemento
+            ahora = time.perf_counter()
+            segundos[clave] += ahora - inicio
+            inicio = ahora
+    finally:
+        for clave, registro in registros.items():
+            registro["segundos"] = round(segundos[clave], 4)
+            registro["filas"] = filas[clave]
@@ -0,0 +1,223 @@
+"""
+Representación compacta de las filas de las tablas de origen.
+
+Cada fila se guarda como un Registro: una tupla con los valores y una
+referencia al dict {columna: posición}, que es el mismo objeto para todas las
+filas con las mismas columnas en el mismo orden. Así los nombres de columna
+se guardan una vez por tabla y no una vez por fila, como en un dict.
+
+Registro se lee como un dict de solo lectura (get, [], in, keys, items...),
+por lo que los generadores de plantillas no necesitan saber cómo está
+guardada la fila.
+
+Diccionarios hace además que los valores repetidos de las columnas con pocos
+valores distintos (provincia, sexo, estado de la cita, profesional...)
+compartan un único objeto str en lugar de uno por fila.
+"""
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# Conjuntos de columnas distintos que se comparten como mucho; por encima de
+# este número (archivos muy irregulares) cada fila lleva su propio dict de
+# posiciones, que sigue siendo correcto aunque ocupe más.
+MAX_ESQUEMAS = 4096
+
+_esquemas: Dict[Tuple[str, ...], Dict[str, int]] = {}
+
+
+def esquema(columnas: Sequence[str]) -> Dict[str, int]:
+    """Dict {columna: posición} compartido para ese orden de columnas."""
+    columnas = tuple(columnas)
+    posiciones = _esquemas.get(columnas)
+    if posiciones is None:
+        posiciones = {c: i for i, c in enumerate(columnas)}
+        if len(posiciones) != len(columnas):
+            raise ValueError(f"Columnas repetidas en el esquema: {columnas}")
+        if len(_esquemas) < MAX_ESQUEMAS:
+            _esquemas[columnas] = posiciones
+    return posiciones
+
+
+class Registro(Mapping):
+    """Fila de solo lectura: valores en una tupla y posiciones compartidas por columna."""
+
+    __slots__ = ("_posiciones", "_valores")
+
+    def __init__(self, posiciones: Dict[str, int], valores: Tuple[Any, ...]) -> None:
+        self._posiciones = posiciones
+        self._valores = valores
+
+    def __getitem__(self, clave: str) -> Any:
+        return self._valores[self._posiciones[clave]]
+
+    def get(self, clave: str, defecto: Any = None) -> Any:
+        i = self._posiciones.get(clave)
+        return defecto if i is None else self._valores[i]
+
+    def __contains__(self, clave: object) -> bool:
+        return clave in self._posiciones
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._posiciones)
+
+    def __len__(self) -> int:
+        return len(self._posiciones)
+
+    def keys(self):
+        return self._posiciones.keys()
+
+    def valores(self) -> Tuple[Any, ...]:
+        """Los valores, en el orden de keys()."""
+        return self._valores
+
+    def copy(self) -> Dict[str, Any]:
+        return dict(zip(self._posiciones, self._valores))
+
+    def __reduce__(self):
+        return (Registro, (self._posiciones, self._valores))
+
+    def __repr__(self) -> str:
+        return f"Registro({self.copy()!r})"
+
+
+def compactar(campos: Mapping, extra: Optional[Dict[str, Any]] = None) -> Registro:
+    """
+    Convierte un dict de campos en un Registro con las mismas claves, en el
+    mismo orden. Con 'extra' equivale a compactar {**campos, **extra}, sin
+    construir ese dict intermedio.
+    """
+    if extra:
+        claves = (*campos, *extra)
+        valores = (*campos.values(), *extra.values())
+    else:
+        claves = tuple(campos)
+        valores = tuple(campos.values())
+    posiciones = _esquemas.get(claves)
+    if posiciones is None:
+        if extra and any(k in campos for k in extra):
+            # Alguna clave extra ya existe: se sobrescribe en su posición
+            return compactar({**campos, **extra})
+        posiciones = esquema(claves)
+    return Registro(posiciones, valores)
+
+
+# ---------------------------------------------------------------------------
+# Codificación por diccionario de columnas con pocos valores distintos
+# ---------------------------------------------------------------------------
+
+
+# Valores distintos a partir de los cuales una columna deja de codificarse
+# (ids, nombres, notas...): su diccionario se suelta y sus valores se dejan tal cual.
+MAX_VALORES_DICCIONARIO = 1024
+
+
+class _Columna:
+    __slots__ = ("valores", "apariciones")
+
+    def __init__(self) -> None:
+        self.valores: Optional[Dict[str, str]] = {}
+        self.apariciones = 0
+
+
+class _Tabla:
+    __slots__ = ("columnas", "activas")
+
+    def __init__(self) -> None:
+        self.columnas: Dict[str, _Columna] = {}
+        # Columnas que aún se codifican: las descartadas ya no se miran en cada fila
+        self.activas: Dict[str, _Columna] = {}
+
+    def columna(self, clave: str) -> _Columna:
+        columna = self.columnas.get(clave)
+        if columna is None:
+            columna = self.columnas[clave] = self.activas[clave] = _Columna()
+        return columna
+
+
+class Diccionarios:
+    """
+    Diccionario {valor: valor} por tabla y columna mientras la columna tenga
+    pocos valores distintos. Cada valor repetido se sustituye por la primera
+    instancia vista, así que todas las filas comparten el mismo str (menos
+    memoria, y las comparaciones entre valores iguales son por identidad).
+    """
+
+    def __init__(self, max_valores: int = MAX_VALORES_DICCIONARIO) -> None:
+        self.max_valores = max_valores
+        self._tablas: Dict[str, _Tabla] = {}
+
+    def _tabla(self, tabla: str) -> _Tabla:
+        t = self._tablas.get(tabla)
+        if t is None:
+            t = self._tablas[tabla] = _Tabla()
+        return t
+
+    def codificar(self, tabla: str, campos: Dict[str, Any]) -> Dict[str, Any]:
+        """Sustituye en 'campos' (en el sitio) los valores de texto de las columnas codificadas."""
+        t = self._tabla(tabla)
+        if not t.columnas.keys() >= campos.keys():
+            for clave in campos:
+                t.columna(clave)
+        descartadas = []
+        for clave, columna in t.activas.items():
+            valor = campos.get(clave)
+            if valor.__class__ is not str or not valor:
+                continue
+            valores = columna.valores
+            compartido = valores.get(valor)
+            if compartido is None:
+                if len(valores) >= self.max_valores:
+                    columna.valores = None
+                    descartadas.append(clave)
+                    continue
+                valores[valor] = valor
+            else:
+                campos[clave] = compartido
+            columna.apariciones += 1
+        for clave in descartadas:
+            del t.activas[clave]
+        return campos
+
+    def codificar_valores(self, tabla: str, nombres: Sequence[str], valores: Sequence[Any]) -> List[Any]:
+        """Como codificar, para una fila dada como nombres de columna y valores en paralelo."""
+        campos = dict(zip(nombres, valores))
+        return list(self.codificar(tabla, campos).values())
+
+    def unir(self, otro: "Diccionarios") -> None:
+        """
+        Suma a este las columnas de 'otro' (p. ej. el de un proceso hijo), para
+        el resumen. Una columna descartada en cualquiera de los dos queda descartada.
+        """
+        for tabla, t_otro in otro._tablas.items():
+            t = self._tabla(tabla)
+            for clave, col_otro in t_otro.columnas.items():
+                columna = t.columna(clave)
+                if columna.valores is not None and col_otro.valores is not None:
+                    for v in col_otro.valores:
+                        columna.valores.setdefault(v, v)
+                    columna.apariciones += col_otro.apariciones
+                    if len(columna.valores) <= self.max_valores:
+                        continue
+                columna.valores = None
+                t.activas.pop(clave, None)
+
+    def imprimir_resumen(self) -> None:
+        """Lista las columnas codificadas con valores repetidos: valores distintos y apariciones."""
+        lineas = []
+        descartadas = 0
+        for tabla, t in self._tablas.items():
+            for clave, columna in t.columnas.items():
+                if columna.valores is None:
+                    descartadas += 1
+                elif columna.apariciones > len(columna.valores):
+                    lineas.append(
+                        f"  {tabla}.{clave}: {len(columna.valores)} valores distintos "
+                        f"en {columna.apariciones} apariciones"
+                    )
+        if not lineas:
+            return
+        print(f"[INFO] Columnas codificadas por diccionario ({descartadas} descartadas por tener "
+              f"más de {self.max_valores} valores distintos):")
+        for linea in lineas:
+            print(linea)
@@ -0,0 +1,38 @@
+"""
+Memoria residente (RSS) del proceso, para los eventos, el perfil, el límite
+de memoria y los benchmarks.
+
+rss_actual_mb() es la memoria residente en este momento y solo se puede medir
+donde hay /proc (Linux). rss_pico_mb() es el máximo alcanzado hasta ahora,
+según getrusage (Linux y macOS). Las dos devuelven None si el sistema no
+permite medirlas.
+"""
+import os
+import sys
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def rss_actual_mb() -> Optional[float]:
+    """Memoria residente actual en MB (leída de /proc), o None si no se puede medir."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            paginas = int(f.read().split()[1])
+        return round(paginas * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def rss_pico_mb() -> Optional[float]:
+    """Máximo de memoria residente que ha usado este proceso hasta ahora, en MB, o None si no se puede medir."""
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB y macOS en bytes
+    if sys.platform == "darwin":
+        pico /= 1024
+    return round(pico / 1024, 1)
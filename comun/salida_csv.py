@@ -0,0 +1,250 @@
+"""
+Escritura de las plantillas CSV generadas por los conversores.
+
+Los generadores emiten cada fila como tupla (o lista) con los valores ya en
+el orden de las columnas de la plantilla, sin construir un dict por fila, y
+las filas se escriben por lotes con writerows sobre un fichero con buffer
+grande. Las filas se consumen a medida que se generan (nunca se guardan todas
+en memoria), así que el pico de memoria depende de las tablas de origen y no
+del tamaño de la plantilla generada.
+
+Con SalidaZip activa (opción --zip-output de los conversores) las plantillas
+no se escriben en disco sino directamente como entradas comprimidas de un ZIP,
+junto con un manifiesto SHA256SUMS con la suma de cada CSV.
+
+Las cabeceras de las plantillas y las funciones de reordenación se cachean
+para que un proceso que convierte muchos archivos seguidos (comun/trabajador.py)
+no las repita en cada trabajo.
+"""
+import codecs
+import csv
+import hashlib
+import io
+import os
+import time
+import zipfile
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+from comun.eventos import seguir_escritura
+from comun.perfil import etapa, medir_iterador
+
+
+# Buffer del fichero de salida y filas que se pasan juntas a writerows
+BUFFER_ESCRITURA = 1024 * 1024
+LOTE_ESCRITURA = 4096
+
+# Entrada del ZIP con las sumas SHA-256 de los CSV (formato de sha256sum)
+MANIFIESTO_ZIP = "SHA256SUMS"
+
+# ZIP donde se escriben las plantillas mientras hay una SalidaZip activa
+_salida_zip: Optional["SalidaZip"] = None
+
+# Plantillas escritas (ruta, filas) mientras hay un registrar_plantillas activo
+_registro: Optional[List[Tuple[str, int]]] = None
+
+# Cabeceras leídas por plantilla: ruta -> (mtime_ns, tamaño, cabeceras)
+_cabeceras: Dict[str, Tuple[int, int, Tuple[str, ...]]] = {}
+
+
+def leer_cabeceras(plantilla_path: Path) -> List[str]:
+    """
+    Lee las cabeceras de una plantilla CSV.
+
+    El resultado se cachea por ruta y solo se vuelve a leer el fichero si ha
+    cambiado su fecha de modificación o su tamaño.
+    """
+    estado = plantilla_path.stat()
+    clave = str(plantilla_path)
+    cacheada = _cabeceras.get(clave)
+    if cacheada is not None and cacheada[:2] == (estado.st_mtime_ns, estado.st_size):
+        return list(cacheada[2])
+    with plantilla_path.open("r", encoding="utf-8-sig", errors="replace") as f:
+        reader = csv.reader(f)
+        headers = next(reader)
+        cabeceras = tuple(h.strip() for h in headers if h.strip())
+    _cabeceras[clave] = (estado.st_mtime_ns, estado.st_size, cabeceras)
+    return list(cabeceras)
+
+
+@contextmanager
+def registrar_plantillas() -> Iterator[List[Tuple[str, int]]]:
+    """
+    Devuelve una lista en la que escribir_csv va anotando (ruta, filas) de cada
+    plantilla que escribe en este proceso mientras dura el bloque 'with'.
+    """
+    global _registro
+    anterior = _registro
+    _registro = []
+    try:
+        yield _registro
+    finally:
+        _registro = anterior
+
+
+@lru_cache(maxsize=64)
+def _reordenar(cabeceras: Tuple[str, ...], columnas: Tuple[str, ...]) -> Optional[Callable[[Sequence], Sequence]]:
+    """
+    Función que pasa una fila del orden de 'columnas' al de 'cabeceras'
+    (vacío en las cabeceras que no están en 'columnas'), o None si ya coinciden.
+    """
+    if columnas == cabeceras:
+        return None
+    if not cabeceras:
+        return lambda fila: ()
+    posiciones = {c: i for i, c in enumerate(columnas)}
+    vacia = len(columnas)  # posición del "" que se añade al final de cada fila
+    tomar = itemgetter(*(posiciones.get(c, vacia) for c in cabeceras))
+    if len(cabeceras) == 1:
+        return lambda fila: (tomar((*fila, "")),)
+    return lambda fila: tomar((*fila, ""))
+
+
+def escribir_csv(
+    path: Path,
+    cabeceras: Sequence[str],
+    filas: Iterable[Sequence],
+    columnas: Optional[Sequence[str]] = None,
+) -> int:
+    """
+    Escribe un CSV en UTF-8 con BOM (para que Excel lo abra bien) y devuelve
+    el número de filas escritas.
+
+    - filas: tuplas o listas con los valores en el orden de 'columnas' (por
+      defecto, el de 'cabeceras').
+    - Si la plantilla trae otras columnas u otro orden que 'columnas', cada
+      fila se reordena y las columnas que el generador no rellena quedan vacías.
+    - Si el generador de filas falla a mitad, se borra el CSV a medio escribir
+      y se relanza la excepción.
+    """
+    reordenar = _reordenar(tuple(cabeceras), tuple(columnas)) if columnas is not None else None
+    # Con --profile, "filas <archivo>" es el tiempo de generar las filas y el
+    # resto de "escritura <archivo>", el de darles formato y escribirlas
+    with etapa(f"escritura {path.name}") as e:
+        filas = medir_iterador(filas, f"filas {path.name}")
+        filas = seguir_escritura(filas, path.name)
+        filas = iter(filas) if reordenar is None else map(reordenar, filas)
+        if _salida_zip is not None:
+            total = _salida_zip.escribir(path.name, cabeceras, filas)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                with _texto_con_bom(path.open("wb", buffering=BUFFER_ESCRITURA)) as f:
+                    total = _escribir_filas(f, cabeceras, filas)
+            except BaseException:
+                path.unlink(missing_ok=True)
+                raise
+        e["filas"] = total
+    if _registro is not None:
+        _registro.append((str(path), total))
+    return total
+
+
+def _texto_con_bom(binario: BinaryIO) -> TextIO:
+    """
+    Escribe el BOM y devuelve un flujo de texto UTF-8 sobre 'binario'.
+
+    Equivale a abrir con encoding="utf-8-sig", pero el códec utf-8-sig está
+    escrito en Python y se llama en cada escritura; con "utf-8" se usa el
+    codificador en C.
+    """
+    binario.write(codecs.BOM_UTF8)
+    return io.TextIOWrapper(binario, encoding="utf-8", newline="")
+
+
+def _escribir_filas(f: TextIO, cabeceras: Sequence[str], filas: Iterable[Sequence]) -> int:
+    """Escribe la cabecera y las filas por lotes; devuelve el número de filas."""
+    writer = csv.writer(f)
+    writer.writerow(cabeceras)
+    total = 0
+    while True:
+        lote = list(islice(filas, LOTE_ESCRITURA))
+        if not lote:
+            break
+        writer.writerows(lote)
+        total += len(lote)
+    return total
+
+
+# ---------------------------------------------------------------------------
+# SALIDA EN ZIP
+# ---------------------------------------------------------------------------
+
+
+class _ConSuma(io.RawIOBase):
+    """Pasa los bytes escritos a 'destino' y va calculando su SHA-256."""
+
+    def __init__(self, destino):
+        self._destino = destino
+        self.suma = hashlib.sha256()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, datos) -> int:
+        self.suma.update(datos)
+        return self._destino.write(datos)
+
+
+class SalidaZip:
+    """
+    Escribe las plantillas como entradas de un ZIP (deflate) en vez de en disco.
+
+    Uso: 'with SalidaZip(path):' alrededor de la generación; dentro,
+    escribir_csv añade cada CSV al ZIP con el nombre de su ruta, a medida que
+    se generan las filas. Al salir se añade el manifiesto SHA256SUMS. El ZIP
+    se escribe en un temporal junto al destino y solo se renombra al final si
+    todo fue bien, así que nunca queda un ZIP a medias en 'path'.
+
+    Un ZIP no admite varias entradas abiertas a la vez, así que las plantillas
+    se tienen que generar en serie (en el mismo proceso).
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._temporal = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._sumas: Dict[str, str] = {}
+
+    def __enter__(self) -> "SalidaZip":
+        global _salida_zip
+        if _salida_zip is not None:
+            raise RuntimeError("Ya hay una salida ZIP activa")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._zip = zipfile.ZipFile(self._temporal, "w", compression=zipfile.ZIP_DEFLATED)
+        _salida_zip = self
+        return self
+
+    def __exit__(self, tipo, valor, traza) -> None:
+        global _salida_zip
+        _salida_zip = None
+        try:
+            if tipo is None:
+                manifiesto = "".join(f"{suma}  {nombre}\n" for nombre, suma in self._sumas.items())
+                self._zip.writestr(MANIFIESTO_ZIP, manifiesto)
+            self._zip.close()
+        except BaseException:
+            self._temporal.unlink(missing_ok=True)
+            raise
+        if tipo is None:
+            os.replace(self._temporal, self.path)
+        else:
+            self._temporal.unlink(missing_ok=True)
+
+    def escribir(self, nombre: str, cabeceras: Sequence[str], filas: Iterable[Sequence]) -> int:
+        """Añade un CSV (UTF-8 con BOM) al ZIP y devuelve el número de filas."""
+        if nombre in self._sumas:
+            raise ValueError(f"El ZIP ya tiene una entrada '{nombre}'")
+        info = zipfile.ZipInfo(nombre, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        # force_zip64: el tamaño no se conoce de antemano y puede pasar de 2 GiB
+        with self._zip.open(info, "w", force_zip64=True) as entrada:
+            destino = _ConSuma(entrada)
+            with _texto_con_bom(io.BufferedWriter(destino, BUFFER_ESCRITURA)) as f:
+                total = _escribir_filas(f, cabeceras, filas)
+        self._sumas[nombre] = destino.suma.hexdigest()
+        return total
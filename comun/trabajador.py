@@ -0,0 +1,202 @@
+"""
+Proceso de conversión de larga duración con un protocolo de líneas JSON.
+
+Uso:
+
+    python3 comun/trabajador.py
+
+Lee por stdin un trabajo por línea, por ejemplo
+
+    {"id": "1", "origen": "dricloud", "entrada": "/tmp/x.xml", "output_dir": "/tmp/res"}
+
+y, por cada uno y en el mismo orden, escribe por stdout una línea JSON con su
+resultado:
+
+    {"id": "1", "ok": true, "plantillas": [{"archivo": "/tmp/res/citas_x.csv", "filas": 120}, ...], "segundos": 0.84}
+    {"id": "2", "ok": false, "error": "El archivo XML no existe: /tmp/y.xml"}
+
+Si el trabajo lleva "eventos": true, antes de su resultado se escriben también
+sus eventos de progreso (ver comun/eventos.py), con el id del trabajo:
+
+    {"evento": "lectura", "id": "1", "archivo": "x.xml", "bytes": 10485760, ...}
+
+Las líneas con "evento" son eventos; las demás, resultados.
+
+Campos de un trabajo:
+- origen: "clinni", "dricloud" o "mnprogram".
+- entrada: archivo de CLINNI o DRICloud, o carpeta de MN Program.
+- output_dir o zip_output (opcionales): destino, igual que las opciones
+  --output-dir y --zip-output del conversor.
+- plantillas_dir (opcional, no aplica a MN Program): carpeta de las plantillas.
+- solo (opcional): genera solo esa plantilla.
+- max_memory (opcional): límite de memoria en MB, como --max-memory.
+- eventos (opcional): true para recibir los eventos de progreso del trabajo.
+- id (opcional): se devuelve tal cual en el resultado.
+
+Cada conversor se importa una sola vez, así que el arranque del intérprete,
+los módulos, las expresiones compiladas, las cabeceras de las plantillas y las
+cachés de fechas se reutilizan entre trabajos. Los mensajes de progreso de los
+conversores ([INFO], [OK], [AVISO]...) salen por stderr para no mezclarse con
+los resultados.
+"""
+import importlib.util
+import io
+import json
+import sys
+import time
+import traceback
+from contextlib import nullcontext, redirect_stderr, redirect_stdout
+from pathlib import Path
+from types import ModuleType
+from typing import Dict, List, Optional, TextIO
+
+# Raíz del proyecto en el path para importar comun/ también al ejecutarlo como script
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from comun.eventos import emitir_eventos
+from comun.registros import Diccionarios
+from comun.salida_csv import registrar_plantillas
+
+
+RAIZ = Path(__file__).resolve().parents[1]
+
+# origen -> (nombre del módulo, script del conversor, opción con la entrada)
+CONVERSORES = {
+    "clinni": (
+        "clinni_to_plantillas", RAIZ / "CLINNI" / "script" / "clinni_to_plantillas.py", "--input-file"
+    ),
+    "dricloud": (
+        "dricloud_to_plantillas", RAIZ / "DRICloud" / "script" / "dricloud_to_plantillas.py", "--input-xml"
+    ),
+    "mnprogram": (
+        "mn_program_to_plantillas", RAIZ / "MN Program" / "script" / "mn_program_to_plantillas.py", "--input-dir"
+    ),
+}
+
+# Opciones de los conversores que se pueden indicar en un trabajo
+OPCIONES = {
+    "output_dir": "--output-dir",
+    "zip_output": "--zip-output",
+    "plantillas_dir": "--plantillas-dir",
+    "solo": "--solo",
+    "max_memory": "--max-memory",
+}
+
+# Caracteres finales de stderr que se guardan de cada trabajo para explicar un fallo
+COLA_ERRORES = 4096
+
+_modulos: Dict[str, ModuleType] = {}
+
+
+class TrabajoInvalido(ValueError):
+    """La línea recibida no describe un trabajo válido."""
+
+
+class _CopiaStderr(io.TextIOBase):
+    """Reenvía lo escrito a stderr y guarda el final para los mensajes de error."""
+
+    def __init__(self, destino):
+        self._destino = destino
+        self.cola = ""
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, texto: str) -> int:
+        self.cola = (self.cola + texto)[-COLA_ERRORES:]
+        return self._destino.write(texto)
+
+    def flush(self) -> None:
+        self._destino.flush()
+
+    def ultima_linea(self) -> str:
+        lineas = [l.strip() for l in self.cola.splitlines() if l.strip()]
+        return lineas[-1] if lineas else ""
+
+
+def _conversor(origen: str) -> ModuleType:
+    """Importa (la primera vez) el script del conversor de 'origen'."""
+    modulo = _modulos.get(origen)
+    if modulo is None:
+        nombre, script, _ = CONVERSORES[origen]
+        spec = importlib.util.spec_from_file_location(nombre, script)
+        modulo = importlib.util.module_from_spec(spec)
+        # Registrado antes de ejecutarlo para que los procesos hijos (fork) lo encuentren por nombre
+        sys.modules[nombre] = modulo
+        spec.loader.exec_module(modulo)
+        _modulos[origen] = modulo
+    return modulo
+
+
+def _argumentos(trabajo: Dict) -> List[str]:
+    """Traduce un trabajo a los argumentos de línea de comandos del conversor."""
+    origen = trabajo.get("origen")
+    if origen not in CONVERSORES:
+        raise TrabajoInvalido(f"Origen no válido: {origen!r} (se espera uno de {', '.join(CONVERSORES)})")
+    if not trabajo.get("entrada"):
+        raise TrabajoInvalido("Falta 'entrada'")
+    argv = [CONVERSORES[origen][2], str(trabajo["entrada"])]
+    for campo, opcion in OPCIONES.items():
+        if trabajo.get(campo) is not None:
+            argv += [opcion, str(trabajo[campo])]
+    return argv
+
+
+def ejecutar_trabajo(trabajo: Dict, eventos: Optional[TextIO] = None) -> Dict:
+    """
+    Ejecuta un trabajo en este proceso y devuelve su resultado (sin el id).
+    Si el trabajo pide eventos, se escriben en 'eventos'.
+    """
+    try:
+        argv = _argumentos(trabajo)
+        modulo = _conversor(trabajo["origen"])
+    except TrabajoInvalido as e:
+        return {"ok": False, "error": str(e)}
+
+    # Cada trabajo empieza con sus propios diccionarios de valores
+    modulo.DICCIONARIOS = Diccionarios()
+    errores = _CopiaStderr(sys.stderr)
+    progreso = (
+        emitir_eventos(eventos, id=trabajo.get("id"))
+        if trabajo.get("eventos") and eventos is not None else nullcontext()
+    )
+    inicio = time.perf_counter()
+    try:
+        with registrar_plantillas() as plantillas, redirect_stdout(errores), redirect_stderr(errores), progreso:
+            modulo.main(argv)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            return {"ok": False, "error": errores.ultima_linea() or f"El conversor terminó con código {e.code}"}
+    except Exception as e:
+        traceback.print_exc()
+        return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    finally:
+        modulo.DICCIONARIOS = Diccionarios()
+        errores.flush()
+    return {
+        "ok": True,
+        "plantillas": [{"archivo": archivo, "filas": filas} for archivo, filas in plantillas],
+        "segundos": round(time.perf_counter() - inicio, 3),
+    }
+
+
+def main() -> None:
+    entrada = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+    salida = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="\n")
+    for linea in entrada:
+        if not linea.strip():
+            continue
+        try:
+            trabajo = json.loads(linea)
+        except ValueError as e:
+            resultado = {"id": None, "ok": False, "error": f"Línea JSON no válida: {e}"}
+        else:
+            if isinstance(trabajo, dict):
+                resultado = {"id": trabajo.get("id"), **ejecutar_trabajo(trabajo, salida)}
+            else:
+                resultado = {"id": None, "ok": False, "error": "Cada línea debe ser un objeto JSON"}
+        salida.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+        salida.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Lectura de los registros de un XML exportado (DRICloud y CLINNI).
+
+Las exportaciones guardan cada registro como un elemento '<TABLA>' cuyos hijos
+son los campos ('<CAMPO>valor</CAMPO>'). Hay dos formas de recorrerlas:
+
+- iterar_elementos_xml: busca los elementos con expresiones regulares sobre
+  bloques de bytes. Es la más rápida y da el rango de bytes de cada elemento,
+  que DRICloud usa para su índice (ver decodificar_elemento).
+- iterar_elementos_iterparse: usa un parser XML incremental; resuelve CDATA,
+  entidades, atributos y espacios de nombres.
+
+Un elemento que se abre y no se cierra (archivo truncado o mal formado) es un
+error: iterar_elementos_xml lanza ValueError al llegar al final del archivo o
+cuando el elemento pendiente supera MAX_ELEMENTO bytes, en lugar de seguir
+acumulando el resto del archivo en memoria.
+"""
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Tuple
+
+
+CAMPOS_PATTERN = re.compile(r'<([A-Z_][A-Z0-9_]*)>(.*?)</\1>', re.DOTALL)
+
+# Tamaño máximo de un elemento sin cerrar antes de dar el archivo por mal formado
+MAX_ELEMENTO = 256 * 1024 * 1024
+
+
+def extraer_campos(contenido: str) -> Dict[str, str]:
+    """Extrae los sub-elementos (campos) del contenido de un elemento."""
+    campos = {}
+    for campo_match in CAMPOS_PATTERN.finditer(contenido):
+        campos[campo_match.group(1)] = campo_match.group(2).strip()
+    return campos
+
+
+def iterar_elementos_xml(
+    xml_path: Path, tag_names: Iterable[str], chunk_size: int = 10 * 1024 * 1024
+) -> Iterator[Tuple[str, int, int, Dict[str, str]]]:
+    """
+    Recorre el XML por bloques y devuelve (tag, inicio, fin, campos) para cada
+    elemento de los tags indicados, donde [inicio, fin) es el rango de bytes del
+    elemento completo dentro del archivo.
+
+    El buffer solo se recorta hasta el final del último elemento emitido (o hasta
+    la apertura de un elemento aún incompleto), así que cada elemento se emite una
+    única vez aunque caiga entre dos bloques o sea mayor que el tamaño de bloque.
+    Mientras un elemento está incompleto, el cierre se sigue buscando desde donde
+    se quedó la búsqueda anterior, no desde la apertura.
+
+    Lanza ValueError si un elemento no se cierra antes del final del archivo o
+    si supera MAX_ELEMENTO bytes.
+    """
+    tags_por_nombre = {tag.upper(): tag for tag in tag_names}
+    apertura = re.compile(
+        rb'<(' + b'|'.join(re.escape(tag.encode()) for tag in tags_por_nombre) + rb')>',
+        re.IGNORECASE
+    )
+    cierres: Dict[bytes, re.Pattern] = {}
+    # Bytes que hay que conservar al final del buffer por si una apertura quedó partida
+    cola = max(len(tag) for tag in tags_por_nombre) + 1
+
+    # bytearray: añadir bloques y recortar por delante no copia el buffer entero
+    buffer = bytearray()
+    base = 0  # posición en el archivo del primer byte del buffer
+    # Posición en el archivo desde la que seguir buscando el cierre del elemento
+    # incompleto que empieza al principio del buffer (None si no hay ninguno)
+    pendiente = None
+    with xml_path.open('rb') as f:
+        fin_archivo = False
+        while not fin_archivo:
+            chunk = f.read(chunk_size)
+            fin_archivo = not chunk
+            buffer += chunk
+
+            pos = 0
+            while True:
+                match = apertura.search(buffer, pos)
+                if match is None:
+                    pos = max(pos, len(buffer) - cola)
+                    break
+
+                nombre = match.group(1)
+                cierre_pattern = cierres.get(nombre)
+                if cierre_pattern is None:
+                    cierre_pattern = re.compile(rb'</' + re.escape(nombre) + rb'>', re.IGNORECASE)
+                    cierres[nombre] = cierre_pattern
+                desde = match.end()
+                if pendiente is not None:
+                    desde = max(desde, pendiente - base)
+                    pendiente = None
+                cierre = cierre_pattern.search(buffer, desde)
+
+                if cierre is None:
+                    inicio = base + match.start()
+                    if fin_archivo:
+                        raise ValueError(
+                            f"el elemento <{nombre.decode('ascii')}> que empieza en el byte {inicio} "
+                            f"no se cierra antes del final del archivo (¿XML truncado?)"
+                        )
+                    if len(buffer) - match.start() > MAX_ELEMENTO:
+                        raise ValueError(
+                            f"el elemento <{nombre.decode('ascii')}> que empieza en el byte {inicio} "
+                            f"supera {MAX_ELEMENTO // (1024 * 1024)} MB sin cerrarse (¿XML mal formado?)"
+                        )
+                    # Elemento incompleto: esperar al siguiente bloque. El cierre
+                    # ('</TAG>') podría haber quedado partido al final del buffer
+                    pendiente = base + max(match.end(), len(buffer) - len(nombre) - 2)
+                    pos = match.start()
+                    break
+
+                contenido = buffer[match.end():cierre.start()].decode('utf-8', errors='replace')
+                campos = extraer_campos(contenido)
+                if campos:  # Solo emitir si tiene campos
+                    yield (
+                        tags_por_nombre[nombre.decode('ascii').upper()],
+                        base + match.start(),
+                        base + cierre.end(),
+                        campos,
+                    )
+                pos = cierre.end()
+
+            del buffer[:pos]
+            base += pos
+
+
+def leer_elemento_xml(f, inicio: int, fin: int) -> Dict[str, str]:
+    """
+    Lee y decodifica un único elemento a partir de su rango de bytes
+    (tal como lo devuelve iterar_elementos_xml). 'f' es el XML abierto en modo 'rb'.
+    """
+    f.seek(inicio)
+    return decodificar_elemento(f.read(fin - inicio))
+
+
+def decodificar_elemento(elemento: bytes) -> Dict[str, str]:
+    """Extrae los campos de un elemento completo ('<TAG>...</TAG>') leído como bytes."""
+    # Quitar la etiqueta de apertura y la de cierre del propio elemento
+    contenido = elemento[elemento.index(b'>') + 1:elemento.rindex(b'</')]
+    return extraer_campos(contenido.decode('utf-8', errors='replace'))
+
+
+def _nombre_local(tag: str) -> str:
+    """Quita el espacio de nombres ('{uri}NOMBRE' -> 'NOMBRE') de un tag de ElementTree."""
+    return tag.rsplit('}', 1)[-1]
+
+
+def iterar_elementos_iterparse(xml_path: Path, tag_names: Iterable[str]) -> Iterator[Tuple[str, Dict[str, str]]]:
+    """
+    Recorre el XML con un parser incremental (ElementTree.iterparse) y devuelve
+    pares (tag, campos) para cada elemento de los tags indicados.
+
+    - Cada hijo del elemento pasa a ser un campo con su texto (CDATA y entidades
+      ya resueltos por el parser). Los atributos del elemento se añaden como
+      campos y los de sus hijos como 'HIJO@atributo'.
+    - Los espacios de nombres se ignoran al comparar tags y nombres de campo.
+    - Los elementos ya procesados se vacían y se sueltan del árbol, por lo que la
+      memoria no crece con el tamaño del archivo.
+    """
+    tags_por_nombre = {tag.upper(): tag for tag in tag_names}
+    pila = []
+    registros_abiertos = 0
+
+    for evento, elem in ET.iterparse(str(xml_path), events=('start', 'end')):
+        if evento == 'start':
+            pila.append(elem)
+            if _nombre_local(elem.tag).upper() in tags_por_nombre:
+                registros_abiertos += 1
+            continue
+
+        pila.pop()
+        tag = tags_por_nombre.get(_nombre_local(elem.tag).upper())
+        if tag is not None:
+            registros_abiertos -= 1
+            # Igual que con regex, un registro dentro de otro no se emite aparte
+            if registros_abiertos == 0:
+                campos = {_nombre_local(k): v.strip() for k, v in elem.attrib.items()}
+                for hijo in elem:
+                    nombre = _nombre_local(hijo.tag)
+                    campos[nombre] = "".join(hijo.itertext()).strip()
+                    for k, v in hijo.attrib.items():
+                        campos[f"{nombre}@{_nombre_local(k)}"] = v.strip()
+                if campos:
+                    yield tag, campos
+
+        # Fuera de un registro ya no se necesita el elemento: soltarlo del árbol
+        if registros_abiertos == 0:
+            elem.clear()
+            if pila:
+                pila[-1].remove(elem)
@@ -0,0 +1,183 @@
+"""
+Los conversores dan la misma salida por todos los caminos que existen para
+ir más rápido o gastar menos memoria:
+
+- DRICloud con y sin --indice, con el índice reutilizado y con el índice
+  desactualizado (se regenera).
+- MN Program con y sin --staging, con la base reutilizada, con la base
+  desactualizada y con una base que no es SQLite (se regeneran).
+- DRICloud y CLINNI con --max-memory (tablas e índices en disco).
+- CLINNI con el JSON repartido en fragmentos (--json-workers) y en serie.
+
+Las entradas son sintéticas (benchmarks/sinteticos.py) y se generan en una
+carpeta temporal.
+"""
+import json
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Dict
+
+# Raíz del proyecto en el path para importar benchmarks/ y comun/ también al ejecutarlo como script
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from benchmarks import sinteticos
+from benchmarks.utilidades import cargar_conversor
+from comun.trabajador import CONVERSORES
+
+
+def convertir(origen: str, entrada: Path, salida: Path, *opciones: str) -> subprocess.CompletedProcess:
+    """Ejecuta el conversor de 'origen' como lo haría un usuario y falla si termina con error."""
+    _, script, opcion_entrada = CONVERSORES[origen]
+    resultado = subprocess.run(
+        [sys.executable, str(script), opcion_entrada, str(entrada), "--output-dir", str(salida), *opciones],
+        capture_output=True, text=True, encoding="utf-8",
+    )
+    if resultado.returncode != 0:
+        raise AssertionError(f"{origen} terminó con código {resultado.returncode}:\n{resultado.stderr}")
+    return resultado
+
+
+def contenido(carpeta: Path) -> Dict[str, bytes]:
+    """Archivos de una carpeta de salida, por nombre."""
+    return {p.name: p.read_bytes() for p in sorted(carpeta.iterdir())}
+
+
+class ConConversor(unittest.TestCase):
+    def setUp(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        self.carpeta = Path(carpeta.name)
+
+    def salida(self, nombre: str) -> Path:
+        return self.carpeta / "salida" / nombre
+
+    def assertMismaSalida(self, esperada: Path, obtenida: Path) -> None:
+        esperado, obtenido = contenido(esperada), contenido(obtenida)
+        self.assertEqual(sorted(esperado), sorted(obtenido))
+        self.assertTrue(esperado)
+        for nombre in esperado:
+            self.assertEqual(esperado[nombre], obtenido[nombre], nombre)
+
+
+class IndiceDRICloud(ConConversor):
+    def test_indice_reutilizado_y_regenerado(self):
+        xml = self.carpeta / "export.xml"
+        sinteticos.generar_dricloud(xml, 3000)
+        convertir("dricloud", xml, self.salida("sin_indice"))
+        self.assertFalse(xml.with_name("export.xml.indice.json").exists())
+
+        convertir("dricloud", xml, self.salida("creado"), "--indice")
+        self.assertTrue(xml.with_name("export.xml.indice.json").exists())
+        usado = convertir("dricloud", xml, self.salida("usado"), "--indice")
+        self.assertIn("Usando índice", usado.stdout)
+        self.assertMismaSalida(self.salida("sin_indice"), self.salida("creado"))
+        self.assertMismaSalida(self.salida("sin_indice"), self.salida("usado"))
+
+        # Otra exportación en el mismo archivo: el índice ya no corresponde
+        sinteticos.generar_dricloud(xml, 3000, semilla=7)
+        regenerado = convertir("dricloud", xml, self.salida("regenerado"), "--indice")
+        self.assertIn("Índice desactualizado", regenerado.stdout)
+        convertir("dricloud", xml, self.salida("sin_indice_2"))
+        self.assertMismaSalida(self.salida("sin_indice_2"), self.salida("regenerado"))
+
+
+class StagingMNProgram(ConConversor):
+    def test_base_reutilizada_y_regenerada(self):
+        entrada = self.carpeta / "bkprogram"
+        base = entrada.with_name("bkprogram.staging.sqlite3")
+        sinteticos.generar_mn_program(entrada, 3000)
+        convertir("mnprogram", entrada, self.salida("csv"))
+
+        convertir("mnprogram", entrada, self.salida("creada"), "--staging")
+        self.assertTrue(base.exists())
+        usada = convertir("mnprogram", entrada, self.salida("usada"), "--staging")
+        self.assertIn("Usando base intermedia", usada.stdout)
+        self.assertMismaSalida(self.salida("csv"), self.salida("creada"))
+        self.assertMismaSalida(self.salida("csv"), self.salida("usada"))
+
+        # CSV distintos: las tablas de la base ya no corresponden y se recargan
+        sinteticos.generar_mn_program(entrada, 3000, semilla=7)
+        recargada = convertir("mnprogram", entrada, self.salida("recargada"), "--staging")
+        self.assertNotIn("Usando base intermedia", recargada.stdout)
+        convertir("mnprogram", entrada, self.salida("csv_2"))
+        self.assertMismaSalida(self.salida("csv_2"), self.salida("recargada"))
+
+        # Un archivo que no es una base SQLite se sustituye
+        base.write_bytes(b"esto no es una base SQLite" * 100)
+        regenerada = convertir("mnprogram", entrada, self.salida("regenerada"), "--staging")
+        self.assertIn("Base intermedia no válida", regenerada.stdout)
+        self.assertMismaSalida(self.salida("csv_2"), self.salida("regenerada"))
+
+
+class LimiteDeMemoria(ConConversor):
+    def test_dricloud_en_disco(self):
+        xml = self.carpeta / "export.xml"
+        sinteticos.generar_dricloud(xml, 20000)
+        convertir("dricloud", xml, self.salida("memoria"))
+        disco = convertir("dricloud", xml, self.salida("disco"), "--max-memory", "1")
+        self.assertIn("pasan a disco", disco.stderr)
+        self.assertMismaSalida(self.salida("memoria"), self.salida("disco"))
+
+    def test_clinni_en_disco(self):
+        entrada = self.carpeta / "export.json"
+        sinteticos.generar_clinni(entrada, 20000)
+        convertir("clinni", entrada, self.salida("memoria"))
+        disco = convertir("clinni", entrada, self.salida("disco"), "--max-memory", "1")
+        self.assertIn("pasan a disco", disco.stderr)
+        self.assertMismaSalida(self.salida("memoria"), self.salida("disco"))
+
+
+class JsonEnParalelo(ConConversor):
+    @classmethod
+    def setUpClass(cls):
+        cls.clinni = cargar_conversor("clinni")
+
+    def _comparar(self, texto: str, workers: int) -> None:
+        serie = self.clinni.procesar_datos_clinni(json.loads(texto))
+        paralelo = self.clinni.procesar_json_en_paralelo(texto, workers)
+        self.assertIsNotNone(paralelo)
+        self.assertEqual(sorted(serie), sorted(paralelo))
+        for coleccion in serie:
+            self.assertEqual(
+                [dict(r) for r in serie[coleccion]], [dict(r) for r in paralelo[coleccion]], coleccion
+            )
+
+    def test_fragmentos_igual_que_en_serie(self):
+        entrada = self.carpeta / "export.json"
+        sinteticos.generar_clinni(entrada, 5000)
+        texto = entrada.read_text(encoding="utf-8")
+        inicio = texto.index("[") + 1
+        fronteras = self.clinni._fronteras_pacientes(texto, inicio, 4)
+        self.assertEqual(len(fronteras), 3)
+        self.assertEqual(fronteras, sorted(fronteras))
+        for frontera in fronteras:
+            self.assertEqual(texto[frontera], "{")
+        for workers in (2, 4, 7):
+            with self.subTest(workers=workers):
+                self._comparar(texto, workers)
+
+    def test_frontera_dentro_de_un_objeto_anidado(self):
+        # Las citas anidadas empiezan por la misma clave y tienen las mismas
+        # claves que un paciente, así que alguna frontera cae dentro de ellas
+        pacientes = [
+            {
+                "id": str(i), "nombre": f"Paciente {i}", "apellidos": "García",
+                "citas": [{"id": f"{i}-{j}", "nombre": "cita", "apellidos": "", "citas": []} for j in range(30)],
+            }
+            for i in range(40)
+        ]
+        texto = json.dumps({"pacientes": pacientes, "bonos": []}, ensure_ascii=False)
+        self._comparar(texto, 6)
+
+    def test_conversor_con_json_workers(self):
+        entrada = self.carpeta / "export.json"
+        sinteticos.generar_clinni(entrada, 5000)
+        convertir("clinni", entrada, self.salida("serie"))
+        convertir("clinni", entrada, self.salida("paralelo"), "--json-workers", "3")
+        self.assertMismaSalida(self.salida("serie"), self.salida("paralelo"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+Los contenedores de comun/memoria.py dan lo mismo en memoria que pasados a
+disco (--max-memory).
+
+Con PASO = 1 y un límite de 0 MB, los contenedores pasan a disco en la
+primera inserción; sin límite son un dict, una list y un defaultdict(list).
+"""
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# Raíz del proyecto en el path para importar comun/ también al ejecutarlo como script
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from comun import memoria
+from comun.memoria import diccionario, indexar, limitar_memoria, lista, multidiccionario
+from comun.registros import compactar
+
+
+def _filas():
+    """Filas con claves repetidas y vacías, como las de una tabla de origen."""
+    filas = []
+    for i in range(50):
+        filas.append(compactar({"ID": str(i % 20) if i % 7 else "", "NOMBRE": f"n{i}", "TIPO": "ab"[i % 2]}))
+    return filas
+
+
+def _llenar():
+    """Crea y llena un contenedor de cada tipo, y devuelve su contenido como tipos normales."""
+    filas = _filas()
+
+    d = diccionario("d")
+    for f in filas:
+        d[f["NOMBRE"]] = f
+    del d["n3"]
+    d["n5"] = compactar({"ID": "x"})
+
+    lst = lista("l", "ID")
+    for f in filas:
+        lst.append(f)
+    indice = indexar(lst, "ID")
+
+    multi = multidiccionario("m")
+    for f in filas:
+        multi[f["TIPO"]].append(f["NOMBRE"])
+
+    return {
+        "dict": [(k, dict(v)) for k, v in d.items()],
+        "dict_len": len(d),
+        "dict_get": (d.get("n3"), dict(d["n5"]), "n4" in d),
+        "lista": [dict(f) for f in lst],
+        "lista_len": len(lst),
+        "lista_pos": (dict(lst[0]), dict(lst[-1]), [dict(f) for f in lst[10:13]]),
+        "indice": [(k, dict(v)) for k, v in indice.items()],
+        "indice_len": len(indice),
+        "indice_get": (dict(indice["3"]), indice.get("no existe"), "" in indice, "19" in indice),
+        # multidiccionario se lee con get (d[clave] solo sirve para append)
+        "multi": [(k, multi.get(k)) for k in multi],
+        "multi_get": (len(multi), "a" in multi, multi.get("c")),
+    }
+
+
+class DesbordeEquivalente(unittest.TestCase):
+    def test_en_disco_igual_que_en_memoria(self):
+        en_memoria = _llenar()
+        with mock.patch.object(memoria, "PASO", 1), limitar_memoria(0):
+            en_disco = _llenar()
+        self.assertEqual(en_memoria, en_disco)
+
+    def test_indice_de_lista_en_disco_es_una_vista(self):
+        with mock.patch.object(memoria, "PASO", 1), limitar_memoria(0):
+            lst = lista("l", "ID")
+            for f in _filas():
+                lst.append(f)
+            self.assertTrue(lst.en_disco)
+            self.assertIsInstance(indexar(lst, "ID"), memoria._IndiceDeLista)
+            # Con otra clave no sirve la vista y se indexa aparte
+            self.assertIsInstance(indexar(lst, "NOMBRE"), dict)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Ida y vuelta con comun/trabajador.py: varios trabajos por stdin, un
+resultado por trabajo y en el mismo orden, precedido de sus eventos si se
+piden, y las mismas plantillas que el conversor ejecutado directamente.
+"""
+import csv
+import json
+import subprocess
+import sys
+import unittest
+
+from test_conversores import ConConversor, contenido, convertir
+
+# test_conversores ya pone la raíz del proyecto en el path
+from benchmarks import sinteticos
+from comun.trabajador import RAIZ
+
+
+class Trabajador(ConConversor):
+    def _trabajo(self, id_trabajo: str, origen: str, entrada, **opciones) -> dict:
+        salida = self.salida(id_trabajo)
+        return {"id": id_trabajo, "origen": origen, "entrada": str(entrada), "output_dir": str(salida), **opciones}
+
+    def test_ida_y_vuelta(self):
+        xml = self.carpeta / "export.xml"
+        sinteticos.generar_dricloud(xml, 2000)
+        json_clinni = self.carpeta / "export.json"
+        sinteticos.generar_clinni(json_clinni, 2000)
+        trabajos = [
+            self._trabajo("a", "dricloud", xml, eventos=True),
+            self._trabajo("b", "dricloud", self.carpeta / "no_existe.xml"),
+            self._trabajo("c", "clinni", json_clinni, solo="citas"),
+        ]
+        proceso = subprocess.run(
+            [sys.executable, str(RAIZ / "comun" / "trabajador.py")],
+            input="".join(json.dumps(t) + "\n" for t in trabajos),
+            capture_output=True, text=True, encoding="utf-8",
+        )
+        self.assertEqual(proceso.returncode, 0, proceso.stderr)
+        lineas = [json.loads(linea) for linea in proceso.stdout.splitlines()]
+        eventos = [linea for linea in lineas if "evento" in linea]
+        resultados = [linea for linea in lineas if "evento" not in linea]
+
+        self.assertEqual([r["id"] for r in resultados], ["a", "b", "c"])
+        self.assertEqual([r["ok"] for r in resultados], [True, False, True])
+        self.assertIn("no_existe.xml", resultados[1]["error"])
+
+        # Solo el trabajo "a" pidió eventos, y van antes de su resultado
+        self.assertTrue(eventos)
+        self.assertEqual({e["id"] for e in eventos}, {"a"})
+        self.assertEqual(eventos[0]["evento"], "inicio")
+        self.assertEqual((eventos[-1]["evento"], eventos[-1]["ok"]), ("fin", True))
+        self.assertLess(lineas.index(eventos[-1]), lineas.index(resultados[0]))
+
+        # Cada plantilla declarada existe con las filas indicadas
+        for resultado in (resultados[0], resultados[2]):
+            self.assertTrue(resultado["plantillas"])
+            for plantilla in resultado["plantillas"]:
+                with open(plantilla["archivo"], newline="", encoding="utf-8-sig") as f:
+                    self.assertEqual(sum(1 for _ in csv.reader(f)) - 1, plantilla["filas"])
+        self.assertEqual(len(resultados[2]["plantillas"]), 1)
+
+        # Y son las mismas que da el conversor por línea de comandos
+        convertir("dricloud", xml, self.salida("directo"))
+        self.assertEqual(contenido(self.salida("directo")), contenido(self.salida("a")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+iterar_elementos_xml: los elementos no dependen del tamaño de bloque y un
+elemento sin cerrar da un error claro.
+"""
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# Raíz del proyecto en el path para importar comun/ también al ejecutarlo como script
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from comun import xml_elementos
+from comun.xml_elementos import iterar_elementos_iterparse, iterar_elementos_xml, leer_elemento_xml
+
+
+XML = (
+    '<?xml version="1.0" encoding="utf-8"?>\n<EXPORT>\n'
+    '<PACIENTE><PAC_ID>1</PAC_ID><PAC_NOMBRE>María</PAC_NOMBRE></PACIENTE>\n'
+    '<paciente><PAC_ID>2</PAC_ID><PAC_NOTAS>' + 'x' * 5000 + '</PAC_NOTAS></paciente>\n'
+    '<CITA_PACIENTE><CPA_ID>7</CPA_ID><PAC_ID>2</PAC_ID></CITA_PACIENTE>\n'
+    '<PACIENTE></PACIENTE>\n'
+    '<PACIENTE><PAC_ID>3</PAC_ID></PACIENTE>\n'
+    '</EXPORT>\n'
+)
+TAGS = ["PACIENTE", "CITA_PACIENTE"]
+
+
+class IterarElementosXml(unittest.TestCase):
+    def setUp(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        self.carpeta = Path(carpeta.name)
+
+    def _escribir(self, nombre: str, contenido: str) -> Path:
+        ruta = self.carpeta / nombre
+        ruta.write_bytes(contenido.encode("utf-8"))
+        return ruta
+
+    def test_no_depende_del_tamano_de_bloque(self):
+        ruta = self._escribir("x.xml", XML)
+        esperado = list(iterar_elementos_xml(ruta, TAGS))
+        self.assertEqual([tag for tag, _, _, _ in esperado], ["PACIENTE", "PACIENTE", "CITA_PACIENTE", "PACIENTE"])
+        self.assertEqual(esperado[0][3], {"PAC_ID": "1", "PAC_NOMBRE": "María"})
+        for chunk_size in (1, 2, 7, 64, 4096):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(list(iterar_elementos_xml(ruta, TAGS, chunk_size)), esperado)
+
+    def test_rangos_de_bytes(self):
+        ruta = self._escribir("x.xml", XML)
+        with ruta.open("rb") as f:
+            for _tag, inicio, fin, campos in iterar_elementos_xml(ruta, TAGS, 64):
+                self.assertEqual(leer_elemento_xml(f, inicio, fin), campos)
+
+    def test_igual_que_iterparse(self):
+        ruta = self._escribir("x.xml", XML)
+        regex = [(tag, campos) for tag, _, _, campos in iterar_elementos_xml(ruta, TAGS)]
+        self.assertEqual(list(iterar_elementos_iterparse(ruta, TAGS)), regex)
+
+    def test_elemento_sin_cerrar_al_final(self):
+        ruta = self._escribir("x.xml", XML[:XML.rindex("</PACIENTE>")])
+        leidos = []
+        with self.assertRaisesRegex(ValueError, r"<PACIENTE> que empieza en el byte \d+ no se cierra"):
+            for elemento in iterar_elementos_xml(ruta, TAGS, 64):
+                leidos.append(elemento)
+        # Los elementos anteriores sí se han emitido
+        self.assertEqual(len(leidos), 3)
+
+    def test_elemento_sin_cerrar_demasiado_grande(self):
+        ruta = self._escribir("x.xml", "<PACIENTE><PAC_ID>1</PAC_ID>" + "<A>b</A>" * 1000)
+        with mock.patch.object(xml_elementos, "MAX_ELEMENTO", 1024):
+            with self.assertRaisesRegex(ValueError, "sin cerrarse"):
+                list(iterar_elementos_xml(ruta, TAGS, 256))
+
+
+if __name__ == "__main__":
+    unittest.main()